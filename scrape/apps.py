@@ -32,6 +32,7 @@ class ScrapeConfig(AppConfig):
                 from root.views import register_app_modules, init_tables
                 register_app_modules(self.name, 'models')
                 register_app_modules(self.name, 'grid_getters')
+                register_app_modules(self.name, 'search')
 
                 init_tables()
 
@@ -0,0 +1,157 @@
+import json
+import os
+import pathlib
+import random
+import time
+
+from django.core.management import BaseCommand
+
+from scrape.management.util.taumahi import Taumahi, tiki_kōpaki_tūtira, kimikimi_kupu, orokati, oropuare
+from scrape.management.util.tuhinga import tohutau, whakarauiri
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+script_name = os.path.split(__file__)[1][0:-3]
+dir_parts = current_dir.split(os.path.sep)
+cache_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('management')]), 'cache', script_name)
+
+pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+# Numbers, dates, times and money as they appear in the niupepa, so that whakarauiri has something to replace
+tau_tauira = ['1862', '12', '£1,250', '£3 10s. 6d.', '12/3/65', '4.30 p.m.', '10 Hune, 1870', 'te 3 o Hurae 1868',
+              'Hepetema 21, 1874', '1,500', '3.45']
+
+
+def waihanga_kohinga(tau_kōwae, tau_kupu, ōrau_māori=0.6, seed=0):
+    """
+    Generate a reproducible corpus of mixed Māori/English paragraphs
+    :param tau_kōwae: number of paragraphs
+    :param tau_kupu: average number of words per paragraph
+    :param ōrau_māori: proportion of words that are made up Māori words, the rest are taken from the
+                       bundled English and ambiguous word lists, with the odd number or date thrown in
+    :param seed: the same seed always gives the same corpus
+    :return: list of paragraphs
+    """
+    rng = random.Random(seed)
+    dirpath = tiki_kōpaki_tūtira()
+    with open(os.path.join(dirpath, 'kupu_kino.txt'), 'r') as f:
+        kupu_pākehā = f.read().split()
+    with open(os.path.join(dirpath, 'kupu_rangirua.txt'), 'r') as f:
+        kupu_rangirua = f.read().split()
+
+    orokati_pūrua = [x for x in orokati if x not in 'ŋƒ'] + ['ng', 'wh', '']
+
+    def kupu_māori():
+        kupu = ''.join(rng.choice(orokati_pūrua) + rng.choice(oropuare) for _ in range(rng.randint(1, 4)))
+        return kupu.capitalize() if rng.random() < 0.1 else kupu
+
+    kohinga = []
+    for _ in range(tau_kōwae):
+        kupu_tūtira = []
+        for _ in range(rng.randint(tau_kupu // 2, tau_kupu * 3 // 2)):
+            tūpono = rng.random()
+            if tūpono < ōrau_māori:
+                kupu_tūtira.append(kupu_māori())
+            elif tūpono < 0.97:
+                kupu_tūtira.append(rng.choice(kupu_pākehā if rng.random() < 0.7 else kupu_rangirua))
+            else:
+                kupu_tūtira.append(rng.choice(tau_tauira))
+            if rng.random() < 0.08:
+                kupu_tūtira[-1] += rng.choice(',.;:!?')
+        kohinga.append(' '.join(kupu_tūtira))
+    return kohinga
+
+
+class Command(BaseCommand):
+
+    def __init__(self):
+        super().__init__()
+        self.baseline_file = os.path.join(cache_dir, 'baseline.json')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paragraphs', action='store', dest='paragraphs', type=int, default=2000)
+        parser.add_argument('--words', action='store', dest='words', type=int, default=80,
+                            help='Average number of words per paragraph')
+        parser.add_argument('--seed', action='store', dest='seed', type=int, default=0)
+        parser.add_argument('--repeat', action='store', dest='repeat', type=int, default=5)
+        parser.add_argument('--save-baseline', action='store_true', dest='save_baseline', default=False)
+        parser.add_argument('--tolerance', action='store', dest='tolerance', type=float, default=0.2,
+                            help='Slow down (as a fraction of the baseline throughput) reported as a regression')
+
+    def time_it(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+
+    def get_benchmarks(self, kohinga):
+        # A new Taumahi per run, so that its word category cache starts empty each time
+        def run_tiki_orau():
+            taumahi = Taumahi()
+            for kōwae in kohinga:
+                taumahi.tiki_ōrau(kōwae)
+
+        def run_komiri_kupu():
+            taumahi = Taumahi()
+            for kōwae in kohinga:
+                taumahi.kōmiri_kupu(kōwae)
+
+        taumahi = Taumahi()
+        kupu_kohinga = [kimikimi_kupu.findall(kōwae) for kōwae in kohinga]
+
+        def run_hoputu():
+            for kupu_tūtira in kupu_kohinga:
+                taumahi.hōputu(taumahi.hōputu(kupu_tūtira), False)
+
+        def run_whakarauiri():
+            for kōwae in kohinga:
+                whakarauiri(kōwae)
+
+        urutau_kohinga = [whakarauiri(kōwae) for kōwae in kohinga]
+
+        def run_tohutau():
+            for kōwae in urutau_kohinga:
+                tohutau(kōwae)
+
+        return [('tiki_ōrau', run_tiki_orau), ('kōmiri_kupu', run_komiri_kupu), ('hōputu', run_hoputu),
+                ('whakarauiri', run_whakarauiri), ('tohutau', run_tohutau)]
+
+    def handle(self, *args, **options):
+        kohinga = waihanga_kohinga(options['paragraphs'], options['words'], seed=options['seed'])
+        tau_kupu = sum(len(kimikimi_kupu.findall(kōwae)) for kōwae in kohinga)
+        megabytes = sum(len(kōwae.encode('utf-8')) for kōwae in kohinga) / 1e6
+        print('Corpus: {} paragraphs, {} words, {:.2f} MB'.format(len(kohinga), tau_kupu, megabytes))
+
+        baseline = {}
+        if os.path.isfile(self.baseline_file):
+            with open(self.baseline_file, 'r') as f:
+                baseline = json.load(f)
+
+        results = {}
+        regressions = []
+        print('{:<14}{:>14}{:>10}{:>12}'.format('Benchmark', 'words/sec', 'MB/sec', 'vs baseline'))
+        for name, func in self.get_benchmarks(kohinga):
+            elapsed = self.time_it(func, options['repeat'])
+            words_per_sec = tau_kupu / elapsed
+            results[name] = dict(words_per_sec=words_per_sec, mb_per_sec=megabytes / elapsed)
+
+            comparison = ''
+            if name in baseline:
+                ratio = words_per_sec / baseline[name]['words_per_sec']
+                comparison = '{:.2f}x'.format(ratio)
+                if ratio < 1 - options['tolerance']:
+                    regressions.append(name)
+                    comparison += ' !'
+            print('{:<14}{:>14.0f}{:>10.2f}{:>12}'.format(name, words_per_sec, megabytes / elapsed, comparison))
+
+        if options['save_baseline']:
+            with open(self.baseline_file, 'w') as f:
+                json.dump(results, f, indent=2, ensure_ascii=False)
+            print('Saved baseline to {}'.format(self.baseline_file))
+
+        if len(regressions) > 0:
+            print('Slower than the baseline: {}'.format(', '.join(regressions)))
+
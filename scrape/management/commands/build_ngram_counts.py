@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import os
+import pathlib
+import shutil
+
+from django.core.management import BaseCommand
+from progress.bar import Bar
+
+from scrape import textpipe
+from scrape.models import Paragraph
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+script_name = os.path.split(__file__)[1][0:-3]
+dir_parts = current_dir.split(os.path.sep)
+cache_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('management')]), 'cache', script_name)
+
+pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+
+def get_ngrams(sentence, order):
+    """
+    :param sentence: text formatted by tohutau, i.e. '<s> ... </s>'
+    :param order: the longest n-grams to return
+    :return: generator of all 1..order-grams, each as a string of space separated tokens
+    """
+    tokens = sentence.split()
+    for n in range(1, order + 1):
+        for i in range(len(tokens) - n + 1):
+            yield ' '.join(tokens[i:i + n])
+
+
+def read_run(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            ngram, count = line.rstrip('\n').split('\t')
+            yield ngram, int(count)
+
+
+class ExternalCounter:
+    """
+    Counts keys with at most max_keys of them held in memory. Whenever the limit is reached the counts are
+    sorted and spilled to a run file on disk, and at the end all runs are merged (k-way) into one sorted stream,
+    adding up the counts of the same key from different runs.
+    """
+    def __init__(self, tmp_dir, max_keys=2000000):
+        self.tmp_dir = tmp_dir
+        self.max_keys = max_keys
+        self.counts = {}
+        self.runs = []
+        pathlib.Path(tmp_dir).mkdir(parents=True, exist_ok=True)
+
+    def update(self, keys):
+        counts = self.counts
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        if len(counts) >= self.max_keys:
+            self.spill()
+
+    def spill(self):
+        filename = os.path.join(self.tmp_dir, 'run-{:05d}.txt'.format(len(self.runs)))
+        with open(filename, 'w', encoding='utf-8') as f:
+            for key in sorted(self.counts):
+                f.write('{}\t{}\n'.format(key, self.counts[key]))
+        self.runs.append(filename)
+        self.counts = {}
+
+    def items(self):
+        """
+        :return: generator of (key, count) sorted by key, with every key exactly once
+        """
+        streams = [read_run(filename) for filename in self.runs]
+        streams.append((key, self.counts[key]) for key in sorted(self.counts))
+        merged = heapq.merge(*streams, key=lambda item: item[0])
+        for key, group in itertools.groupby(merged, key=lambda item: item[0]):
+            yield key, sum(count for _, count in group)
+
+    def close(self):
+        for filename in self.runs:
+            os.remove(filename)
+        self.runs = []
+        self.counts = {}
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order', action='store', dest='order', type=int, default=3)
+        parser.add_argument('--output', action='store', dest='output', default=None,
+                            help='Default: ngrams.<order>.counts in the cache folder')
+        parser.add_argument('--min-percentage', action='store', dest='min_percentage', type=float, default=None,
+                            help='Only count paragraphs with at least this percentage of Māori words')
+        parser.add_argument('--max-ngrams', action='store', dest='max_ngrams', type=int, default=2000000,
+                            help='Number of distinct n-grams kept in memory before they are spilled to disk')
+        parser.add_argument('--batch-size', action='store', dest='batch_size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        order = options['order']
+        batch_size = options['batch_size']
+        output_file = options['output'] or os.path.join(cache_dir, 'ngrams.{}.counts'.format(order))
+
+        paras = Paragraph.objects.all()
+        if options['min_percentage'] is not None:
+            paras = paras.filter(percentage_maori__gte=options['min_percentage'])
+
+        tmp_dir = os.path.join(cache_dir, 'runs')
+        counter = ExternalCounter(tmp_dir, options['max_ngrams'])
+
+        bar = Bar('Counting n-grams', max=paras.count())
+        # One page of paragraphs at a time: iterator() would still load the whole column with MySQL's client-side cursor
+        last_id = 0
+        while True:
+            batch = list(paras.filter(id__gt=last_id).order_by('id').values_list('id', 'content')[:batch_size])
+            if len(batch) == 0:
+                break
+            for sentence in textpipe.language_model_text.apply_many([content for _, content in batch]):
+                counter.update(get_ngrams(sentence, order))
+            last_id = batch[-1][0]
+            bar.next(len(batch))
+        bar.finish()
+
+        # The number of distinct n-grams of each order, as in the \data\ section of an ARPA file
+        totals = [0] * (order + 1)
+        print('Merging {} runs into {}'.format(len(counter.runs) + 1, output_file))
+        with open(output_file + '.bak', 'w', encoding='utf-8') as f:
+            # The format read by SRILM's ngram-count -read and irstlm, which build the ARPA model from it
+            for ngram, count in counter.items():
+                f.write('{}\t{}\n'.format(ngram, count))
+                totals[ngram.count(' ') + 1] += 1
+        os.rename(output_file + '.bak', output_file)
+
+        counter.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        print('\\data\\')
+        for n in range(1, order + 1):
+            print('ngram {}={}'.format(n, totals[n]))
+        print(textpipe.report())
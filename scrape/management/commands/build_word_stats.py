@@ -0,0 +1,37 @@
+from django.core.management import BaseCommand
+from django.db.models import Max
+from progress.bar import Bar
+
+from scrape.management.util.taumahi import Taumahi
+from scrape.models import Paragraph, ParagraphWord
+from scrape.word_stats import WordCountWriter, get_word_counts
+
+
+class Command(BaseCommand):
+    """
+    Fill the word count table for paragraphs saved before it existed. New paragraphs get their word counts at the
+    time they are scraped.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', action='store', dest='batch_size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        taumahi = Taumahi()
+        writer = WordCountWriter()
+
+        last_id = ParagraphWord.objects.aggregate(last_id=Max('paragraph_id'))['last_id'] or 0
+        paras = Paragraph.objects.filter(id__gt=last_id).order_by('id')
+
+        bar = Bar('Counting words', max=paras.count())
+        while True:
+            batch = list(paras.filter(id__gt=last_id).values_list('id', 'content')[:batch_size])
+            if len(batch) == 0:
+                break
+
+            para_word_counts = [(id, get_word_counts(taumahi.kōmiri_kupu(content))) for id, content in batch]
+            writer.write(para_word_counts)
+            last_id = batch[-1][0]
+            bar.next(len(batch))
+        bar.finish()
@@ -10,6 +10,7 @@ import pandas as pd
 
 from scrape.management.util.json_serialiser import serialise_array
 from scrape.management.util.taumahi import Taumahi
+from scrape.management.util.taumahi_keteroki import KeterokiTaumahi
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 script_name = os.path.split(__file__)[1][0:-3]
@@ -21,14 +22,16 @@ class Command(BaseCommand):
 
     def __init__(self):
         super().__init__()
-        self.taumahi = Taumahi()
+        self.taumahi = KeterokiTaumahi(Taumahi())
 
     def add_arguments(self, parser):
             parser.add_argument('--file', action='store', dest='file_loc', required=True)
+            parser.add_argument('--processes', action='store', dest='processes', type=int, default=None)
 
-    def process_row(self, row, docs):
-        text_raw = row['text']
-        text_raw = text_raw.replace('"', '')
+    def get_text_raw(self, row):
+        return row['text'].replace('"', '')
+
+    def process_row(self, row, text_raw, taumahi_result, docs):
         url = row['url']
         date_str = row['date2']
         creator = row['speaker']
@@ -38,7 +41,7 @@ class Command(BaseCommand):
         percent_original = row['percent']
         date = datetime.datetime.strptime(date_str, '%Y-%m-%d')
         date_iso_format = date.strftime('%Y-%m-%dT%H:%M:%SZ')
-        maori_count, ambiguous_count, english_count, total_count, percentage = self.taumahi.tiki_ōrau(text_raw)
+        maori_count, ambiguous_count, english_count, total_count, percentage = taumahi_result
 
         doct_dict = dict(
             Source='Hansard',
@@ -69,12 +72,18 @@ class Command(BaseCommand):
 
         df = pd.read_csv(file_loc)
         docs = []
+        text_raws = [self.get_text_raw(row) for i, row in df.iterrows()]
+
+        print('Calculating Maori percentage of {} rows'.format(len(text_raws)))
+        taumahi_results = self.taumahi.tiki_ōrau_many(text_raws, processes=options['processes'])
+
         bar = Bar('Processing', max=df.shape[0])
 
-        for i, row in df.iterrows():
-            self.process_row(row, docs)
+        for (i, row), text_raw, taumahi_result in zip(df.iterrows(), text_raws, taumahi_results):
+            self.process_row(row, text_raw, taumahi_result, docs)
             bar.next()
         bar.finish()
+        self.taumahi.close()
 
         output_file = 'hansard.json'
         print('Writing to file: {}'.format(output_file))
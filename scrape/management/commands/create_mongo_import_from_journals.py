@@ -1,43 +1,37 @@
 import datetime
 import json
 import os
-import re
 
 import pandas as pd
-import regex
 from django.core.management import BaseCommand
 from progress.bar import Bar
 
 from scrape.management.util.taumahi import Taumahi
+from scrape.management.util.taumahi_keteroki import KeterokiTaumahi
+from scrape import textpipe
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 script_name = os.path.split(__file__)[1][0:-3]
 dir_parts = current_dir.split(os.path.sep)
 cache_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('management')]), 'cache', script_name)
 
-transl_table = dict( [ (ord(x), ord(y)) for x,y in zip( u"‘’´“”–-",  u"'''\"\"--") ] )
-
-
-def escape_text(text_raw):
-    text_raw = text_raw.strip()
-    text_raw = re.sub('\n+', ' ', text_raw)
-    text_raw = regex.sub(r'[^\p{Latin} \p{posix_punct}]', u'', text_raw)
-    text_raw = re.sub(' +', ' ', text_raw)
-    text_raw = text_raw.translate(transl_table)
-    return text_raw
-
 
 class Command(BaseCommand):
 
     def __init__(self):
         super().__init__()
-        self.taumahi = Taumahi()
+        self.taumahi = KeterokiTaumahi(Taumahi())
 
     def add_arguments(self, parser):
             parser.add_argument('--excel-file', action='store', dest='excel_file', required=True)
             parser.add_argument('--theses-folder', action='store', dest='theses_folder', required=True)
+            parser.add_argument('--processes', action='store', dest='processes', type=int, default=None)
 
-    def process_row(self, row, txt_file, docs):
+    def read_text_raw(self, txt_file):
+        with open(txt_file, 'r', encoding='utf-8-sig') as f:
+            return textpipe.escape_text(f.read())
+
+    def process_row(self, row, text_raw, taumahi_result, docs):
         """
         Notes	File Attachments	Link Attachments	Manual Tags	Automatic Tags
 
@@ -60,10 +54,7 @@ class Command(BaseCommand):
         issue = row['Issue']
         volume = row['Volume']
 
-        with open(txt_file, 'r', encoding='utf-8-sig') as f:
-            text_raw = escape_text(f.read())
-
-        maori_count, ambiguous_count, english_count, total_count, percentage = self.taumahi.tiki_ōrau(text_raw)
+        maori_count, ambiguous_count, english_count, total_count, percentage = taumahi_result
 
         doct_dict = dict(
             Source='Journals',
@@ -73,7 +64,7 @@ class Command(BaseCommand):
             Text_Raw=text_raw,
             URL=url,
             Title=title,
-            Abstract_Note=escape_text(abstract_note),
+            Abstract_Note=textpipe.escape_text(abstract_note),
             Publisher=publisher,
             Languages=languages,
             Copyright=copyright,
@@ -106,7 +97,9 @@ class Command(BaseCommand):
         df = pd.read_excel(excel_file)
         df = df.fillna('')
         docs = []
-        bar = Bar('Processing file...', max=df.shape[0])
+        rows = []
+        text_raws = []
+        bar = Bar('Reading file...', max=df.shape[0])
         for row_num, row in df.iterrows():
             # if row_num > 0:
             #     break
@@ -118,9 +111,21 @@ class Command(BaseCommand):
                 bar.next()
                 continue
 
-            self.process_row(row, txt_file, docs)
+            rows.append(row)
+            text_raws.append(self.read_text_raw(txt_file))
+            bar.next()
+        bar.finish()
+
+        print('Calculating Maori percentage of {} files'.format(len(text_raws)))
+        taumahi_results = self.taumahi.tiki_ōrau_many(text_raws, processes=options['processes'], chunksize=1)
+
+        bar = Bar('Processing file...', max=len(rows))
+        for row, text_raw, taumahi_result in zip(rows, text_raws, taumahi_results):
+            self.process_row(row, text_raw, taumahi_result, docs)
             bar.next()
         bar.finish()
+        self.taumahi.close()
+        print(textpipe.report())
 
         output_file = 'journals.json'
         print('Writing to file: {}'.format(output_file))
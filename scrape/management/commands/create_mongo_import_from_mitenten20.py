@@ -2,13 +2,14 @@ import json
 import os
 import pathlib
 import pickle
-import re
 
 from bs4 import BeautifulSoup
 from django.core.management import BaseCommand
 from progress.bar import Bar
 
 from scrape.management.util.taumahi import Taumahi
+from scrape.management.util.taumahi_keteroki import KeterokiTaumahi
+from scrape import textpipe
 import datetime
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -26,10 +27,13 @@ class Command(BaseCommand):
 
     def __init__(self):
         super().__init__()
-        self.taumahi = Taumahi()
+        self.taumahi = KeterokiTaumahi(Taumahi())
 
     def add_arguments(self, parser):
             parser.add_argument('--file', action='store', dest='file_loc', required=True)
+            parser.add_argument('--processes', action='store', dest='processes', type=int, default=None)
+            parser.add_argument('--batch-size', action='store', dest='batch_size', type=int, default=1000,
+                                help='Number of docs whose paragraphs are scored together')
 
     def process_doc(self, doc):
         docs = []
@@ -53,10 +57,7 @@ class Command(BaseCommand):
         url = doc.attrs.get('url', '')
 
         for i, p in enumerate(doc.select('p'), 1):
-            text = p.text.strip()
-            text = re.sub('\n+', ' ', text)
-
-            maori_count, ambiguous_count, english_count, total_count, percentage = self.taumahi.tiki_ōrau(text)
+            text = textpipe.paragraph_text(p.text)
 
             doct_dict = dict(
                 Source='Mitenten',
@@ -64,15 +65,28 @@ class Command(BaseCommand):
                 Article_Title=title,
                 Paragraph_Number=i,
                 Text_Raw=text,
-                URL=url,
+                URL=url
+            )
+            docs.append(doct_dict)
+        return docs
+
+    def add_percentages(self, docs, processes):
+        """
+        Score the paragraphs of many docs with one call to tiki_ōrau_many, rather than one tiki_ōrau per paragraph
+        :param docs: the dicts returned by process_doc
+        :param processes: number of worker processes, None for one per core
+        """
+        taumahi_results = self.taumahi.tiki_ōrau_many([doct_dict['Text_Raw'] for doct_dict in docs],
+                                                      processes=processes)
+        for doct_dict, taumahi_result in zip(docs, taumahi_results):
+            maori_count, ambiguous_count, english_count, total_count, percentage = taumahi_result
+            doct_dict.update(
                 Percent_Maori=percentage,
                 Num_Words_Maori=maori_count,
                 Num_Words_Ambi=ambiguous_count,
                 Num_Words_Other=english_count,
                 Num_Words_Total=total_count
             )
-            docs.append(doct_dict)
-        return docs
 
     def split_doc(self, file_loc):
         with open(file_loc, 'r') as f:
@@ -156,22 +170,31 @@ class Command(BaseCommand):
                     doc_inds_to_process.append(doc_ind)
 
         bar = Bar('Processing', max=len(doc_inds_to_process))
-        for doc_ind in doc_inds_to_process:
-            doc_file = os.path.join(doc_dir, '{}.doc'.format(doc_ind))
-            json_file = os.path.join(json_dir, '{}.json'.format(doc_ind))
-            with open(doc_file, 'r') as f:
-                json_dicts = self.process_doc(f.read())
+        batch_size = options['batch_size']
+        for batch_start in range(0, len(doc_inds_to_process), batch_size):
+            batch = []
+            for doc_ind in doc_inds_to_process[batch_start:batch_start + batch_size]:
+                doc_file = os.path.join(doc_dir, '{}.doc'.format(doc_ind))
+                with open(doc_file, 'r') as f:
+                    batch.append((doc_ind, self.process_doc(f.read())))
+
+            self.add_percentages([doct_dict for _, json_dicts in batch for doct_dict in json_dicts],
+                                 options['processes'])
+
+            for doc_ind, json_dicts in batch:
+                bar.next()
                 if len(json_dicts) == 0:
                     continue
-            with open(json_file, 'w') as f:
-                for ind, json_dict in enumerate(json_dicts):
-                    json_content = json.dumps(json_dict)
-                    f.write(json_content)
-                    if ind < len(json_dict) - 1:
-                        f.write(',')
-
-            bar.next()
+                json_file = os.path.join(json_dir, '{}.json'.format(doc_ind))
+                with open(json_file, 'w') as f:
+                    for ind, json_dict in enumerate(json_dicts):
+                        json_content = json.dumps(json_dict)
+                        f.write(json_content)
+                        if ind < len(json_dict) - 1:
+                            f.write(',')
         bar.finish()
+        self.taumahi.close()
+        print(textpipe.report())
 
         output_file = 'mitenten20.json'
         self.merge_jsons(output_file)
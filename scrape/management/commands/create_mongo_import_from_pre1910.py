@@ -1,12 +1,13 @@
 import json
 import os
-import re
 
 from bs4 import BeautifulSoup
 from django.core.management import BaseCommand
 from progress.bar import Bar
 
 from scrape.management.util.taumahi import Taumahi
+from scrape.management.util.taumahi_keteroki import KeterokiTaumahi
+from scrape import textpipe
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 script_name = os.path.split(__file__)[1][0:-3]
@@ -18,26 +19,21 @@ class Command(BaseCommand):
 
     def __init__(self):
         super().__init__()
-        self.taumahi = Taumahi()
+        self.taumahi = KeterokiTaumahi(Taumahi())
 
     def add_arguments(self, parser):
             parser.add_argument('--dir', action='store', dest='directory', required=True)
+            parser.add_argument('--processes', action='store', dest='processes', type=int, default=None)
 
-    def process_file(self, category, article, file, docs):
+    def read_text_raw(self, file):
         with open(file, 'r', encoding='utf-16') as f:
             content = f.read()
         soup = BeautifulSoup(content, 'html5lib')
-        texts = []
+        texts = textpipe.paragraph_text.apply_many(p.text for p in soup.select('p'))
+        return textpipe.joined_paragraphs('. '.join(texts))
 
-        for i, p in enumerate(soup.select('p'), 1):
-            text = p.text.strip()
-            text = re.sub('\n+', ' ', text)
-            texts.append(text)
-
-        text_raw = '. '.join(texts)
-        text_raw = re.sub('\.+', ' ', text_raw)
-
-        maori_count, ambiguous_count, english_count, total_count, percentage = self.taumahi.tiki_ōrau(text_raw)
+    def process_file(self, category, article, text_raw, taumahi_result, docs):
+        maori_count, ambiguous_count, english_count, total_count, percentage = taumahi_result
 
         doct_dict = dict(
             Source='Pre1910',
@@ -68,8 +64,9 @@ class Command(BaseCommand):
                         files_count += 1
 
         docs = []
-        i = 0
-        bar = Bar('Processing files...', max=files_count)
+        articles = []
+        text_raws = []
+        bar = Bar('Reading files...', max=files_count)
         for subdir in subdirs:
             subdir_path = os.path.join(directory, subdir)
             if os.path.isdir(subdir_path):
@@ -78,16 +75,19 @@ class Command(BaseCommand):
                     if file.endswith('.txt'):
                         filename = file[:-4]
                         file_path = os.path.join(subdir_path, file)
-                        self.process_file(subdir, filename, file_path, docs)
+                        articles.append((subdir, filename))
+                        text_raws.append(self.read_text_raw(file_path))
                         bar.next()
-                        # i += 1
-                        #
-                        # if i > 10:
-                        #     break
-            # if i > 10:
-            #     break
         bar.finish()
 
+        print('Calculating Maori percentage of {} files'.format(len(text_raws)))
+        taumahi_results = self.taumahi.tiki_ōrau_many(text_raws, processes=options['processes'], chunksize=1)
+
+        for (category, article), text_raw, taumahi_result in zip(articles, text_raws, taumahi_results):
+            self.process_file(category, article, text_raw, taumahi_result, docs)
+        self.taumahi.close()
+        print(textpipe.report())
+
         output_file = 'pre1910.json'
         print('Writing to file: {}'.format(output_file))
         with open(output_file, 'w') as f:
@@ -10,6 +10,7 @@ import pandas as pd
 
 from scrape.management.util.json_serialiser import serialise_array
 from scrape.management.util.taumahi import Taumahi
+from scrape.management.util.taumahi_keteroki import KeterokiTaumahi
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 script_name = os.path.split(__file__)[1][0:-3]
@@ -21,15 +22,16 @@ class Command(BaseCommand):
 
     def __init__(self):
         super().__init__()
-        self.taumahi = Taumahi()
+        self.taumahi = KeterokiTaumahi(Taumahi())
 
     def add_arguments(self, parser):
             parser.add_argument('--file', action='store', dest='file_loc', required=True)
+            parser.add_argument('--processes', action='store', dest='processes', type=int, default=None)
 
-    def process_row(self, doc, docs):
+    def process_row(self, doc, taumahi_result, docs):
         text_raw = doc['content_with_emojis']
         # published_date = datetime.datetime.fromisoformat(doc['date'])
-        maori_count, ambiguous_count, english_count, total_count, percentage = self.taumahi.tiki_ōrau(text_raw)
+        maori_count, ambiguous_count, english_count, total_count, percentage = taumahi_result
 
         doct_dict = dict(
             Source='RmtCorpus',
@@ -55,12 +57,17 @@ class Command(BaseCommand):
 
         df = pd.read_csv(file_loc)
         docs = []
+
+        print('Calculating Maori percentage of {} rows'.format(df.shape[0]))
+        taumahi_results = self.taumahi.tiki_ōrau_many(df['content_with_emojis'], processes=options['processes'])
+
         bar = Bar('Processing', max=df.shape[0])
 
-        for i, row in df.iterrows():
-            self.process_row(row, docs)
+        for (i, row), taumahi_result in zip(df.iterrows(), taumahi_results):
+            self.process_row(row, taumahi_result, docs)
             bar.next()
         bar.finish()
+        self.taumahi.close()
 
         output_file = 'rmtcorpus.json'
         print('Writing to file: {}'.format(output_file))
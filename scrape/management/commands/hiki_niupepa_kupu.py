@@ -3,13 +3,19 @@ import os
 import pathlib
 import pickle
 import re
-import zipfile
 
-from bs4 import BeautifulSoup as bs
 from django.core.management import BaseCommand
 
-from scrape.management.util.browser_wrapper import BrowserWrapper
+from scrape.management.util.auto_save_cache import AutoSaveCache
+from scrape.management.util.browser_wrapper import BrowserPool
+from scrape.management.util.fetcher import Fetcher
+from scrape.management.util.http_transport import HttpTransport
+from scrape.management.util.page_parser import CONTENT_PAGE, ISSUE_LIST, NEWSPAPER_LIST, PAGE_NUMBER, parse
+from scrape.management.util.page_store import PageStore
 from scrape.management.util.taumahi import Taumahi
+from scrape import textpipe
+from scrape.management.util.tuhinga import clean_whitespace
+from scrape.model_utils import IdCache, bulk_upsert
 from scrape.models import Newspaper, Publication, Page
 
 
@@ -22,7 +28,6 @@ cache_zip_dir = os.path.join(cache_dir, 'zip')
 
 pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
 pathlib.Path(cache_html_dir).mkdir(parents=True, exist_ok=True)
-pathlib.Path(cache_zip_dir).mkdir(parents=True, exist_ok=True)
 
 
 pae_tukutuku = 'http://www.nzdl.org'
@@ -34,84 +39,30 @@ NEWSPAPER_VOL_MATCHER = re.compile(r'(.*?) \d\d\d\d.*?Volume (\d+).*')
 NEWSPAPER_NO_MATCHER = re.compile(r'(.*?) \d\d\d\d.*?No. (\d+).*')
 
 
-class AutoSaveCache:
-    def __init__(self, filename: str, save_freq: int):
-        self.filename = filename
-        self.filename_bak = filename + '.bak'
-        self.save_freq = save_freq
-
-        if os.path.isfile(self.filename):
-            with open(self.filename, 'rb') as f:
-                self.db_storage = pickle.load(f)
-        else:
-            self.db_storage = {}
-
-        self.item_count = len(self.db_storage)
-
-    def get_index(self, url):
-        index = self.db_storage.get(url, None)
-        if index is None:
-            return self.item_count + 1, True
-        return index, False
-
-    def __setitem__(self, key, value):
-        if key in self.db_storage:
-            raise Exception('Key {} already exists'.format(key))
-        self.item_count += 1
-        self.db_storage[key] = self.item_count
-
-        if self.item_count % self.save_freq == 0:
-            with open(self.filename_bak, 'wb') as f:
-                pickle.dump(self.db_storage, f)
-
-            os.rename(self.filename_bak, self.filename)
-            print('Saved cache')
-
-    def save(self):
-        with open(self.filename_bak, 'wb') as f:
-            pickle.dump(self.db_storage, f)
-
-        os.rename(self.filename_bak, self.filename)
-        print('Saved final cache')
-
-
 class UrlQuerier:
-    def __init__(self, cache, browser_wrapper):
+    def __init__(self, cache, store, fetcher, refresh=False):
         self.cache = cache
-        self.browser_wrapper = browser_wrapper
-
-    def _query(self, url, cache_file_path_zip):
-        query_finished = False
-        response = None
-        while not query_finished:
-            try:
-                response = self.browser_wrapper.make_query_retrial_if_fail(url)
-                query_finished = True
-            except Exception as e:
-                self.browser_wrapper.reload()
-
-        zf = zipfile.ZipFile(cache_file_path_zip, mode='w', compression=zipfile.ZIP_DEFLATED)
-        try:
-            zf.writestr('content.html', response)
-        finally:
-            zf.close()
-        return response
-
-    def _load(self, cache_file_path_zip):
-        zf = zipfile.ZipFile(cache_file_path_zip, 'r')
-        response = zf.read('content.html').decode('utf-8')
+        self.store = store
+        self.fetcher = fetcher
+        # True to ask the server whether a cached page changed instead of using it as is
+        self.refresh = refresh
+
+    def _query(self, url, cache_index, cached=None):
+        response = self.fetcher.fetch(url, cached)
+        self.store.put(cache_index, response)
         return response
 
     def query_or_load(self, url):
         # if replace:
         #     url = url.replace('&c=niupepa', '').replace('&cl=CL1.1', '&cl=CL2.1').replace('/library', '/library.cgi').replace('/library.cgi.cgi', '/library.cgi')
         cache_index, is_new = self.cache.get_index(url)
-        cache_file_path_zip = os.path.join(cache_zip_dir, '{}.zip'.format(cache_index))
 
-        if is_new:
-            content = self._query(url, cache_file_path_zip)
-        else:
-            content = self._load(cache_file_path_zip)
+        content = None if is_new else self.store.get(cache_index)
+        if content is None:
+            content = self._query(url, cache_index)
+        elif self.refresh:
+            # Only downloaded again if it changed, otherwise the server answers 304 and the cached page is kept
+            content = self._query(url, cache_index, content)
 
         if is_new:
             self.cache[url] = cache_index
@@ -119,10 +70,6 @@ class UrlQuerier:
         return content
 
 
-def clean_whitespace(paragraph):
-    return re.sub(r'\s+', ' ', paragraph).strip()
-
-
 # Punctuation that will be searched for, and stripped respectively. The former indicates the end of a paragraph if followed by a new line character.
 tohutuhi = ".!?"
 tohukī = "‘’\'\") "
@@ -152,10 +99,11 @@ class Rārangi:
         self.perehitanga = niupepa.perehitanga
         self.published_date = niupepa.published_date
         self.taukaea = taukaea
-        # Extracts the soup of the issue's first page
-        self.hupa = bs(url_querier.query_or_load(self.taukaea), 'html.parser')
-        # Extracts the page number from the soup
-        self.tau = self.hupa.find('b').text.split("page  ")[1]
+        # Extracts the soup of the issue's first page, only the text and the navigation arrows are needed
+        kupu_html = url_querier.query_or_load(self.taukaea)
+        self.hupa = parse(kupu_html, CONTENT_PAGE)
+        # Extracts the page number from the first bold text of the page
+        self.tau = parse(kupu_html, PAGE_NUMBER).find('b').text.split("page  ")[1]
         self.māori = 0
         self.rangirua = 0
         self.pākehā = 0
@@ -201,34 +149,6 @@ def mātītori_kupu(kupu):
     return re.findall(r'[\w\W]*?[{}][{}]*\n|[\w\W]+$'.format(tohutuhi, tohukī), kupu)
 
 
-def rīwhi_tauriterite(kimikimi, taumahi_ingoa, kōwae):
-    # Finds all matches to the input regex, in the input text, using the input string to determine what to replace the match with
-    # The first argument is a regex expression, the second is a string containing a function name from the tau module, the third is the text that is to be modified
-    ngā_whakataki_tūtira = re.compile(kimikimi).findall(kōwae)
-    for ngā_whakataki in ngā_whakataki_tūtira:
-        whakataki = ngā_whakataki[0].strip()
-        kupu = " "
-        if taumahi_ingoa == "rā_kupu":
-            kupu += "<date>"
-        elif taumahi_ingoa == "tāima_kupu":
-            kupu += "<time>"
-        else:
-            kupu += "<number>"
-        kupu += " "
-        kōwae = kōwae.replace(whakataki, kupu)
-    return kōwae
-
-
-def tohutau(kupu):
-    # Formats text in a way suitable for the irstlm language model
-    kupu = re.sub(r'w[”“"\'`‘’´]', 'wh', kupu.lower())
-    kupu = re.sub(r'[—–]', '-', kupu)
-    kupu = re.sub(r'([^A-Za-zĀĒĪŌŪāēīōū\s])', r' \1 ', kupu)
-    kupu = re.sub(r'< (date|number|time) >', r'<\1>', kupu)
-    kupu = re.sub(r'-', r'@-@', kupu)
-    return "<s> " + clean_whitespace(kupu) + " </s>"
-
-
 def unu_kupu_tōkau(hupa, tau):
     # Extracts the text for all pages of the issue it has been passed.
     # It takes a tuple and a list. The tuple has the newspaper name, issue name
@@ -253,56 +173,25 @@ def unu_kupu_tōkau(hupa, tau):
     return
 
 
-def whakarauiri(kupu):
-    # The calls to these functions in tau don't need to be made for the irstlm language model, however replacements make the model more effective. Hence we use a string with the function of the tau module's name to represent the kind of object it is replacing.
-    marama = '(Hanuere|Pepuere|Maehe|Apereira|Mei|Hune|Hurae|Akuhata|Hepetema|Oketopa|Noema|Nowema|Tihema)'
-    # Comma separated pound values, ending with common representations for shillings and pounds
-    kupu = rīwhi_tauriterite('((£?([1-9]\d{0,2}[,\/‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3}([.,]{2}\d{1,2}){1,2}))', "pakaru_moni", kupu)
-    kupu = rīwhi_tauriterite('(?i)(£?[1-9]\d{0,2}[,\/‘`´’\'\".][ ]?(\d{3}[,\/‘`´’\'\".]?[ ]?)+ ?l\.? ?( ?\d+ ?[ds]\.? ?){0,2})', "pakaru_moni", kupu)
-    # Non-comma separated pound values, with the same endings
-    kupu = rīwhi_tauriterite('(£?([1-9]\d*([.,]{2}\d{1,2}){1,2}))', "pakaru_moni", kupu)
-    kupu = rīwhi_tauriterite('(?i)((£?[1-9]\d*( ?\d+ ?[lsd]\.? ?){1,3}))', "pakaru_moni", kupu)
-    # Typical date format xx/xx/xx
-    kupu = rīwhi_tauriterite('((\d{1,2}\/){1,2}\d{2})', "rā_kupu", kupu)
-    # Other common date formats that involve words - e.g. the (day) of (month), (year); or (month) (day) (year)
-    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)(te )\d{1,2}( [,o])? ' + marama + ',? \d{4}(\b|\W|\s|\s|$|\W))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)\d{1,2}( [,o])? ' + marama + ',? \d{4}(\b|\W|\s|\s|$|\W))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)(' + marama + ',? \d{1,2},? \d{4}(\b|\W|\s|$))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)\d{4},? ' + marama + ')', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)(' + marama + ',? \d{4}(\b|\W|\s|$))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)(te )\d{1,2}( [,o])? ' + marama + '(\b|\W|\s|$))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)\d{1,2}( [,o])? ' + marama + '(\b|\W|\s|$))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)(' + marama + ',? \d{1,2}(\b|\W|\s|$))', "rā_kupu", kupu)
-    # Comma separated pound values with no suffixes
-    kupu = rīwhi_tauriterite('(£([1-9]\d{0,2}[,‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3})', "pakaru_moni", kupu)
-    # Other comma separated values, not financial
-    kupu = rīwhi_tauriterite('(([1-9]\d{0,2}[,‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3})', "hōputu_tau", kupu)
-    # Finds times separated by punctuation (with or without a space), optionally followed by am/pm
-    kupu = rīwhi_tauriterite('(?i)((\d{1,2}\. ){1,2}(\d{1,2}) ?[ap]\.?m\.?)', "tāima_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)((\d{1,2}[,.:]){0,2}(\d{1,2}) ?[ap]\.?m\.?)', "tāima_kupu", kupu)
-    kupu = rīwhi_tauriterite('((\d{1,2}\. ?){1,2}\d{1,2})', "tāima_kupu", kupu)
-    # Deals with any leftover slash-separated values that weren't accepted by "tāima_kupu" by replacing the slashes with words
-    kupu = rīwhi_tauriterite('((\d{1,6}( \/ | \/|\/ |\/|\.)){1,5}\d{1,5})', "hautau_rānei_ira", kupu)
-    # Finds all other monetary values
-    kupu = rīwhi_tauriterite('(£(\d)+)', "pakaru_moni", kupu)
-    # Finds all other numbers
-    kupu = rīwhi_tauriterite('((\d)+)', "hōputu_tau", kupu)
-    # Removes characters that aren't letters or spaces.
-    kupu = re.sub(r'[^A-Za-zĀĒĪŌŪāēīōū!"#$%&\'()*+,./:;<=>?[\\]^_`‘’{|}-£´\s]', '', kupu)
-    # Clears excess spaces
-    return clean_whitespace(kupu)
-
-
 class Command(BaseCommand):
 
     def __init__(self):
         super().__init__()
         cache_file = os.path.join(cache_dir, 'cache.pkl')
         self.cache = AutoSaveCache(cache_file, 10)
-
-        self.browser_wrapper = BrowserWrapper(cache_dir)
-        self.url_querier = UrlQuerier(self.cache, self.browser_wrapper)
+        self.store = PageStore(cache_dir)
+        if os.path.isdir(cache_zip_dir):
+            imported = self.store.import_zips(cache_zip_dir, self.cache.db_storage.values())
+            if imported > 0:
+                print('Imported {} pages from {}'.format(imported, cache_zip_dir))
+
+        self.browser_wrapper = BrowserPool(cache_dir)
+        self.transport = HttpTransport(validators_file=os.path.join(cache_dir, 'validators.pkl'))
+        self.fetcher = Fetcher(self.browser_wrapper, transport=self.transport)
+        self.url_querier = UrlQuerier(self.cache, self.store, self.fetcher)
         self.progress_cache = dict()
+        self.newspaper_ids = IdCache(1000)
+        self.publication_ids = IdCache(1000)
 
         self.use_cache = True
         self.commit = False
@@ -352,11 +241,22 @@ class Command(BaseCommand):
 
         published_date = datetime.datetime.strptime(published_date, datetime_format).date()
 
-        npp, _ = Newspaper.objects.get_or_create(name=newspaper_title)
-        pub, _ = Publication.objects.get_or_create(newspaper=npp, published_date=published_date,
-                                                volume=volume, number=number)
-
-        pg, _ = Page.objects.get_or_create(publication=pub, page_number=page_number)
+        # The newspaper and publication are the same for every paragraph of an issue, so they're only written once
+        npp_id = self.newspaper_ids.get(newspaper_title)
+        if npp_id is None:
+            bulk_upsert(Newspaper, [Newspaper(name=newspaper_title)], ['name'])
+            npp_id = Newspaper.objects.get(name=newspaper_title).id
+            self.newspaper_ids[newspaper_title] = npp_id
+
+        pub_id = self.publication_ids.get((npp_id, published_date))
+        if pub_id is None:
+            bulk_upsert(Publication, [Publication(newspaper_id=npp_id, published_date=published_date, volume=volume,
+                                                  number=number)],
+                        ['newspaper_id', 'published_date'], ['volume', 'number'])
+            pub_id = Publication.objects.get(newspaper_id=npp_id, published_date=published_date).id
+            self.publication_ids[(npp_id, published_date)] = pub_id
+
+        pg, _ = Page.objects.get_or_create(publication_id=pub_id, page_number=page_number)
         pg.raw_text = raw_text
         pg.adapted_text = adapted_text
         pg.percentage_maori = percent_maori
@@ -420,8 +320,7 @@ class Command(BaseCommand):
                 if not tāuru.kupu:
                     continue
 
-                tāuru.urutau = whakarauiri(tāuru.kupu)
-                tāuru.urutau = tohutau(tāuru.urutau)
+                tāuru.urutau = textpipe.language_model_text(tāuru.kupu)
                 # Gets the percentage of the text that is Māori
                 tāuru.māori, tāuru.rangirua, tāuru.pākehā, tāuru.tapeke, tāuru.ōrau = self.taumahi.tiki_ōrau(tāuru.kupu)
                 # Prepares the row that is to be written to the csv
@@ -436,6 +335,11 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--no-cache', action='store_false', dest='use_cache', default=False)
         parser.add_argument('--commit', action='store_true', dest='commit', default=False)
+        parser.add_argument('--browsers', action='store', dest='browsers', type=int, default=2,
+                            help='Number of browsers for the pages that need one')
+        parser.add_argument('--refresh', action='store_true', dest='refresh', default=False,
+                            help='Ask the server whether each cached page changed. Unchanged pages are not '
+                                 'downloaded again')
 
     def hātepe_perehitanga(self, niupepa):
         # This function extracts the text from every page of the newspaper issue it
@@ -504,7 +408,7 @@ class Command(BaseCommand):
         # Collects the urls and names of all the newspapers
         # Opens the archive page and fetches the soup
 
-        hupa = bs(self.url_querier.query_or_load(pae_tukutuku_haurua), 'html.parser')
+        hupa = parse(self.url_querier.query_or_load(pae_tukutuku_haurua), NEWSPAPER_LIST)
 
         # Gets a list of all tags where newspaper links are stored
         for tr in hupa.select('div.top')[0].find_all('tr', {'valign': 'top'}):
@@ -519,7 +423,7 @@ class Command(BaseCommand):
 
     def tiki_perehitanga(self, niupepa):
         # Collects the names and urls of each issue of a particular newspaper
-        hupa = bs(self.url_querier.query_or_load(niupepa.taukaea), 'html.parser')
+        hupa = parse(self.url_querier.query_or_load(niupepa.taukaea), ISSUE_LIST)
         print("\n\nCollecting issues of " +
               niupepa.niupepa + "\n\n\n----------------------------------------\n\n")
 
@@ -561,6 +465,9 @@ class Command(BaseCommand):
 
     def finalise(self):
         self.cache.save()
+        self.store.close()
+        self.browser_wrapper.close()
+        self.fetcher.close()
         if self.use_cache:
             with open(self.progress_cache_file, 'wb') as f:
                 pickle.dump(self.progress_cache, f)
@@ -569,6 +476,8 @@ class Command(BaseCommand):
         self.browser_wrapper.auto_solve_captcha = True
         self.use_cache = options['use_cache']
         self.commit = options['commit']
+        self.browser_wrapper.size = options['browsers']
+        self.url_querier.refresh = options['refresh']
         self.init_cache()
 
         try:
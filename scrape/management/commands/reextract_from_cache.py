@@ -0,0 +1,194 @@
+import collections
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from progress.bar import Bar
+
+from scrape.management.commands.scrape_maori_text import INITIAL_URL, cache_dir, construct_paragraphs, \
+    init_parse_worker, parse_and_classify, parse_publication_title, split_articles
+from scrape.management.util import page_parser
+from scrape.management.util.auto_save_cache import read_url_indices
+from scrape.management.util.page_store import PageStore
+from scrape.model_utils import bulk_upsert
+from scrape.models import Newspaper, Publication, Article, Paragraph, ParagraphWord
+from scrape.word_stats import WordCountWriter
+
+cache_file = os.path.join(cache_dir, 'cache.pkl')
+
+# The url -> cache index map and the page store of each worker process, set when the process starts
+worker_url_indices = None
+worker_store = None
+
+
+def init_reextract_worker():
+    # Each worker reads the map from the cache files, rather than being sent a copy of it by the main process
+    global worker_url_indices, worker_store
+    worker_url_indices = read_url_indices(cache_file)
+    worker_store = PageStore(cache_dir, read_only=True)
+    init_parse_worker()
+
+
+def extract_publication(link):
+    """
+    Follow the chain of pages of a publication, from the cache only, and parse and score each page
+    :param link: the link to the first page of the publication
+    :return: (list of (paragraph, url of its page, scores), number of pages, url of the first page not in the cache
+             or None if all of them are)
+    """
+    para_and_links = []
+    url = link
+    page_count = 0
+    while url is not None:
+        cache_index = worker_url_indices.get(url, None)
+        html = None if cache_index is None else worker_store.get(cache_index)
+        if html is None:
+            return para_and_links, page_count, url
+
+        next_link, scored, _ = parse_and_classify(html)
+        para_and_links += [(text, url, scores) for text, scores in scored]
+        page_count += 1
+        url = next_link
+
+    return para_and_links, page_count, None
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the articles and paragraphs of every publication from the pages cached by scrape_maori_text, e.g. after
+    changing how the pages are parsed or scored. Nothing is fetched: publications with a page missing from the cache
+    are left as they are in the database.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', action='store', dest='workers', type=int, default=None,
+                            help='Number of processes parsing pages, default is one per CPU')
+
+    def load(self, url):
+        cache_index = self.url_indices.get(url, None)
+        if cache_index is None:
+            return None
+        return self.store.get(cache_index)
+
+    def get_publication_links(self):
+        """
+        :return: list of (link, full title, published date) of all the publications listed in the cached year pages
+        """
+        html = self.load(INITIAL_URL)
+        if html is None:
+            raise Exception('{} is not in the cache, run scrape_maori_text first'.format(INITIAL_URL))
+
+        soup = page_parser.parse(html, page_parser.YEAR_INDEX)
+        publication_links = page_parser.get_publication_links(soup)
+        for year_link in page_parser.get_year_links(soup):
+            html = self.load(year_link)
+            if html is None:
+                print('Skip {}: not in the cache'.format(year_link))
+                continue
+            publication_links += page_parser.get_publication_links(page_parser.parse(html, page_parser.PUBLICATION_LIST))
+
+        # The same publication can be listed twice
+        unique_links = collections.OrderedDict()
+        for link, full_title, published_date in publication_links:
+            unique_links.setdefault(link, (link, full_title, published_date))
+        return list(unique_links.values())
+
+    def get_publication_id(self, newspaper_title, published_date, volume, number):
+        newspaper_id = self.newspapers.get(newspaper_title, None)
+        if newspaper_id is None:
+            bulk_upsert(Newspaper, [Newspaper(name=newspaper_title)], ['name'])
+            newspaper_id = Newspaper.objects.get(name=newspaper_title).id
+            self.newspapers[newspaper_title] = newspaper_id
+
+        bulk_upsert(Publication, [Publication(newspaper_id=newspaper_id, published_date=published_date, volume=volume,
+                                              number=number)],
+                    ['newspaper_id', 'published_date'], ['volume', 'number'])
+        return Publication.objects.get(newspaper_id=newspaper_id, published_date=published_date).id
+
+    def write_publication(self, full_title, published_date, para_and_links):
+        """
+        Replace the articles, paragraphs and word counts of the publication with the ones just extracted, in one
+        transaction and with one bulk insert per table
+        :return: number of paragraphs written
+        """
+        newspaper_title, published_date, volume, number = parse_publication_title(full_title, published_date)
+        articles = split_articles(para_and_links)
+
+        with transaction.atomic():
+            publication_id = self.get_publication_id(newspaper_title, published_date, volume, number)
+
+            ParagraphWord.objects.filter(paragraph__article__publication_id=publication_id).delete()
+            Paragraph.objects.filter(article__publication_id=publication_id).delete()
+            Article.objects.filter(publication_id=publication_id).delete()
+
+            for article in articles:
+                article.publication_id = publication_id
+            Article.objects.bulk_create(articles)
+            article_ids = dict(Article.objects.filter(publication_id=publication_id).values_list('index', 'id'))
+
+            paragraphs = []
+            for article in articles:
+                for paragraph in construct_paragraphs(article):
+                    paragraph.article_id = article_ids[article.index]
+                    paragraphs.append(paragraph)
+            Paragraph.objects.bulk_create(paragraphs)
+
+            para_ids = {(article_id, index): id for id, article_id, index in
+                        Paragraph.objects.filter(article__publication_id=publication_id)
+                        .values_list('id', 'article_id', 'index')}
+            para_word_counts = [(para_ids[(paragraph.article_id, paragraph.index)], paragraph.word_counts)
+                                for paragraph in paragraphs if paragraph.word_counts]
+            if len(para_word_counts) > 0:
+                self.word_count_writer.write(para_word_counts)
+
+        return len(paragraphs)
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or os.cpu_count()
+        # Read only, scrape_maori_text may be adding to the cache at the same time
+        self.url_indices = read_url_indices(cache_file)
+        self.store = PageStore(cache_dir, read_only=True)
+        self.newspapers = dict(Newspaper.objects.values_list('name', 'id'))
+        self.word_count_writer = WordCountWriter()
+
+        publication_links = self.get_publication_links()
+        start = time.perf_counter()
+        page_count = 0
+        paragraph_count = 0
+        incomplete = []
+
+        bar = Bar('Re-extracting publications', max=len(publication_links))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_reextract_worker) as pool:
+            # Keep a few publications ahead of the writer, but not the whole corpus in memory
+            pending = collections.deque()
+            publication_links_iter = iter(publication_links)
+            while True:
+                while len(pending) < workers * 4:
+                    publication_link = next(publication_links_iter, None)
+                    if publication_link is None:
+                        break
+                    pending.append((publication_link, pool.submit(extract_publication, publication_link[0])))
+                if len(pending) == 0:
+                    break
+
+                (link, full_title, published_date), future = pending.popleft()
+                para_and_links, pages, missing_url = future.result()
+                page_count += pages
+                if missing_url is not None:
+                    incomplete.append((full_title, missing_url))
+                else:
+                    paragraph_count += self.write_publication(full_title, published_date, para_and_links)
+                bar.next()
+        bar.finish()
+
+        self.store.close()
+        print('Re-extracted {} paragraphs from {} pages of {} publications in {:.1f}s'
+              .format(paragraph_count, page_count, len(publication_links) - len(incomplete),
+                      time.perf_counter() - start))
+        if len(incomplete) > 0:
+            print('{} publications were left alone because some of their pages are not in the cache:'
+                  .format(len(incomplete)))
+            for full_title, missing_url in incomplete:
+                print('  {}: {}'.format(full_title, missing_url))
@@ -0,0 +1,169 @@
+import os
+import pathlib
+import pickle
+from array import array
+from bisect import bisect_left
+
+from django.core.management import BaseCommand
+from django.db.models import Q
+from django_bulk_update.helper import bulk_update
+from progress.bar import Bar
+
+from scrape.management.util.taumahi import Taumahi, kimikimi_kupu, whakatakitahi_kupu, whakatakirua_kupu
+from scrape.management.util.taumahi_kohinga import TaumahiKohinga
+from scrape.models import Paragraph
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+script_name = os.path.split(__file__)[1][0:-3]
+dir_parts = current_dir.split(os.path.sep)
+cache_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('management')]), 'cache', script_name)
+
+pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+score_fields = ['maori_word_count', 'ambiguous_word_count', 'other_word_count', 'total_word_count',
+                'percentage_maori']
+
+
+def get_index_key(kupu):
+    # Words are indexed the same way Taumahi looks them up in the word lists: encoded and lowercased
+    return whakatakitahi_kupu(kupu).lower()
+
+
+class KupuIndex:
+    """
+    Maps every word to the ids of the paragraphs containing it. It is stored on disk and only the paragraphs
+    added or modified since the last run are read, so that finding the paragraphs affected by a word list change
+    doesn't need a scan of all the content.
+
+    A modified paragraph is added to the postings of its new words, but not removed from those of the words it
+    no longer has: such a stale posting only makes the paragraph rescored for nothing.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.filename_bak = filename + '.bak'
+
+        if os.path.isfile(self.filename):
+            with open(self.filename, 'rb') as f:
+                stored = pickle.load(f)
+            if len(stored) == 2:
+                # Indexes saved before paragraphs had a modified time
+                stored = (stored[0], None, stored[1])
+            self.last_id, self.last_modified, self.index = stored
+        else:
+            self.last_id, self.last_modified, self.index = 0, None, {}
+
+    def update(self):
+        new_or_modified = Q(id__gt=self.last_id)
+        if self.last_modified is not None:
+            # Not __gt: a paragraph saved in the same instant as the last one indexed would be missed
+            new_or_modified |= Q(modified__gte=self.last_modified)
+        paras = Paragraph.objects.filter(new_or_modified)
+        indexed_id = self.last_id
+
+        bar = Bar('Indexing new and modified paragraphs', max=paras.count())
+        for id, content, modified in paras.order_by('id').values_list('id', 'content', 'modified').iterator():
+            for kupu in set(get_index_key(kupu) for kupu in kimikimi_kupu.findall(content)):
+                postings = self.index.get(kupu, None)
+                if postings is None:
+                    postings = array('I')
+                    self.index[kupu] = postings
+                if id > indexed_id:
+                    postings.append(id)
+                else:
+                    # Postings are sorted, as new paragraphs are appended in id order
+                    i = bisect_left(postings, id)
+                    if i == len(postings) or postings[i] != id:
+                        postings.insert(i, id)
+            self.last_id = max(self.last_id, id)
+            if modified is not None and (self.last_modified is None or modified > self.last_modified):
+                self.last_modified = modified
+            bar.next()
+        bar.finish()
+
+    def get_paragraph_ids(self, kupu_tūtira):
+        ids = set()
+        for kupu in kupu_tūtira:
+            ids.update(self.index.get(kupu, ()))
+        return ids
+
+    def save(self):
+        with open(self.filename_bak, 'wb') as f:
+            pickle.dump((self.last_id, self.last_modified, self.index), f)
+        os.rename(self.filename_bak, self.filename)
+
+
+class Command(BaseCommand):
+
+    def __init__(self):
+        super().__init__()
+        self.index_file = os.path.join(cache_dir, 'kupu_index.pkl')
+        self.papakupu_file = os.path.join(cache_dir, 'papakupu.pkl')
+        self.taumahi = Taumahi()
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='all', default=False,
+                            help='Rescore every paragraph, not only those affected by the word list changes')
+        parser.add_argument('--rebuild-index', action='store_true', dest='rebuild_index', default=False,
+                            help='Index all paragraphs again, e.g. to drop the stale postings of edited paragraphs')
+        parser.add_argument('--batch-size', action='store', dest='batch_size', type=int, default=5000)
+
+    def get_changed_words(self):
+        """
+        Compare the word lists used for the last rescoring against the current word lists
+        :return: the words whose category may have changed, or None if there is no record of the last word lists
+        """
+        if not os.path.isfile(self.papakupu_file):
+            return None
+
+        with open(self.papakupu_file, 'rb') as f:
+            old_pakeha, old_rangirua = pickle.load(f)
+
+        changed = (old_pakeha ^ self.taumahi.kupu_pākehā) | (old_rangirua ^ self.taumahi.kupu_rangirua)
+        return set(kupu.lower() for kupu in changed)
+
+    def save_word_lists(self):
+        with open(self.papakupu_file + '.bak', 'wb') as f:
+            pickle.dump((self.taumahi.kupu_pākehā, self.taumahi.kupu_rangirua), f)
+        os.rename(self.papakupu_file + '.bak', self.papakupu_file)
+
+    def rescore(self, para_ids, batch_size):
+        taumahi_kohinga = TaumahiKohinga(self.taumahi)
+        para_ids = sorted(para_ids)
+        bar = Bar('Rescoring paragraphs', max=len(para_ids))
+        for start in range(0, len(para_ids), batch_size):
+            paras = list(Paragraph.objects.filter(id__in=para_ids[start:start + batch_size]).only('id', 'content'))
+            results = taumahi_kohinga.tiki_ōrau_kohinga([para.content for para in paras])
+
+            for para, result in zip(paras, results):
+                para.maori_word_count, para.ambiguous_word_count, para.other_word_count, para.total_word_count, \
+                    para.percentage_maori = result
+
+            bulk_update(paras, update_fields=score_fields, batch_size=batch_size)
+            bar.next(len(paras))
+        bar.finish()
+
+    def handle(self, *args, **options):
+        rescore_all = options['all']
+        batch_size = options['batch_size']
+
+        if options['rebuild_index'] and os.path.isfile(self.index_file):
+            os.remove(self.index_file)
+
+        kupu_index = KupuIndex(self.index_file)
+        kupu_index.update()
+        kupu_index.save()
+
+        changed_words = self.get_changed_words()
+        if changed_words is None and not rescore_all:
+            print('No record of the word lists used last time, rescoring all paragraphs')
+            rescore_all = True
+
+        if rescore_all:
+            para_ids = Paragraph.objects.values_list('id', flat=True)
+        else:
+            print('{} words changed word list: {}'.format(
+                len(changed_words), ', '.join(sorted(whakatakirua_kupu(kupu) for kupu in changed_words))))
+            para_ids = kupu_index.get_paragraph_ids(changed_words)
+
+        self.rescore(para_ids, batch_size)
+        self.save_word_lists()
@@ -2,18 +2,27 @@ import datetime
 import os
 import pathlib
 import pickle
+import queue
 import re
-import zipfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
 
-from bs4 import BeautifulSoup
 from django.core.management import BaseCommand
-from progress.bar import Bar
 
-from scrape.management.util.browser_wrapper import BrowserWrapper
+from scrape.management.util.auto_save_cache import AutoSaveCache
+from scrape.management.util.browser_wrapper import BrowserPool
+from scrape.management.util.fetcher import Fetcher
+from scrape.management.util.http_transport import HttpTransport
+from scrape.management.util import page_parser
+from scrape.management.util.page_store import PageStore
 from scrape.management.util.taumahi import Taumahi
+from scrape.model_utils import IdCache, bulk_upsert, get_ids
 from scrape.models import Newspaper as DbNewspaper, Paragraph as DbParagraph
 from scrape.models import Publication as DbPublication
 from scrape.models import Article as DbArticle
+from scrape.word_stats import WordCountWriter, get_word_counts
 
 from django.db import OperationalError
 
@@ -26,7 +35,6 @@ cache_zip_dir = os.path.join(cache_dir, 'zip')
 
 pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
 pathlib.Path(cache_html_dir).mkdir(parents=True, exist_ok=True)
-pathlib.Path(cache_zip_dir).mkdir(parents=True, exist_ok=True)
 
 INITIAL_URL = 'http://www.nzdl.org/cgi-bin/library.cgi?gg=text&e=d-00000-00---off-0niupepa--00-0----0-10-0---0---0direct-10---4-------0-1l--11-en-50---20-about---00-0-1-00-0-0-11-1-0utfZz-8-00&a=d&cl=CL2.1'
 
@@ -36,48 +44,54 @@ NEWSPAPER_NO_MATCHER = re.compile(r'(.*?) \d\d\d\d.*?No. (\d+).*')
 
 
 class DbStorage:
-    def __init__(self):
-        self.newspapers = None
-        self.publications = None
-        self.articles = None
-        self.paragraphs = None
-        self.populate_newspapers_from_database()
-        self.populate_publications_from_database()
-        self.populate_articles_from_database()
-        self.populate_paragraphs_from_database()
-
-    def populate_newspapers_from_database(self):
-        self.newspapers = {x[1]: x[0] for x in DbNewspaper.objects.values_list('id', 'name')}
-
-    def populate_publications_from_database(self):
-        pub_vl = DbPublication.objects.values_list('id', 'newspaper__name', 'published_date')
+    """
+    Collects the newspapers, publications, articles and paragraphs of a crawl, and saves the new ones in bulk.
+
+    Nothing is loaded up front. A newspaper or publication is looked up in the database when first asked for, and
+    its id kept in a bounded cache. The articles and paragraphs are only matched against the database on save(),
+    with a few queries scoped to the publications being saved. Memory doesn't grow with the size of the tables.
+    """
+    def __init__(self, id_cache_size=100000):
+        # Ids of saved newspapers by name, and of saved publications by (newspaper title, published date)
+        self.newspaper_ids = IdCache(id_cache_size)
+        self.publication_ids = IdCache(id_cache_size)
+        self.word_count_writer = WordCountWriter()
+
+        # What is waiting to be saved, by natural key
+        self.newspapers = {}
         self.publications = {}
-        for id, newspaper_title, published_date in pub_vl:
-            self.publications[(newspaper_title, published_date)] = id
-
-    def populate_articles_from_database(self):
-        article_vl = DbArticle.objects.values_list('id', 'publication__newspaper__name', 'publication__published_date', 'index')
         self.articles = {}
-        for id, newspaper_title, published_date, article_index in article_vl:
-            self.articles[(newspaper_title, published_date, article_index)] = id
-
-    def populate_paragraphs_from_database(self):
-        para_vl = DbParagraph.objects.values_list('id', 'article__publication__newspaper__name', 'article__publication__published_date', 'article__index', 'index')
         self.paragraphs = {}
-        for id, newspaper_title, published_date, article_index, index in para_vl:
-            self.paragraphs[(newspaper_title, published_date, article_index, index)] = id
 
     def get_newspaper(self, name):
-        return self.newspapers.get(name, None)
-
-    def get_publication(self, newspaper_title, published_date):
-        return self.publications.get((newspaper_title, published_date), None)
+        """
+        :return: the id of the newspaper if saved, the unsaved newspaper if added, otherwise None
+        """
+        if name in self.newspapers:
+            return self.newspapers[name]
 
-    def get_article(self, newspaper_title, published_date, index):
-        return self.articles.get((newspaper_title, published_date, index), None)
+        id = self.newspaper_ids.get(name)
+        if id is None:
+            id = DbNewspaper.objects.filter(name=name).values_list('id', flat=True).first()
+            if id is not None:
+                self.newspaper_ids[name] = id
+        return id
 
-    def get_paragraph(self, newspaper_title, published_date, article_index, index):
-        return self.paragraphs.get((newspaper_title, published_date, article_index, index), None)
+    def get_publication(self, newspaper_title, published_date):
+        """
+        :return: the id of the publication if saved, the unsaved publication if added, otherwise None
+        """
+        key = (newspaper_title, published_date)
+        if key in self.publications:
+            return self.publications[key]
+
+        id = self.publication_ids.get(key)
+        if id is None:
+            id = DbPublication.objects.filter(newspaper__name=newspaper_title, published_date=published_date)\
+                .values_list('id', flat=True).first()
+            if id is not None:
+                self.publication_ids[key] = id
+        return id
 
     def add_newspaper(self, db_npp):
         self.newspapers[db_npp.name] = db_npp
@@ -95,30 +109,30 @@ class DbStorage:
         if self.paragraphs.get(key, None) is None:
             self.paragraphs[key] = db_para
 
-    def bulk_create(self, cls, objs):
+    def bulk_upsert(self, cls, objs, unique_fields, update_fields=()):
         success = False
-        batch_size = None
-        retval = None
+        batch_size = 10000
         while not success:
             try:
-                retval = cls.objects.bulk_create(objs, batch_size=batch_size)
+                bulk_upsert(cls, objs, unique_fields, update_fields, batch_size=batch_size)
                 success = True
             except OperationalError:
                 print('Connection error, reduce batch size')
-                if batch_size is None:
-                    batch_size = 10000
-                else:
-                    batch_size = int(batch_size * 0.9)
-        return retval
+                batch_size = int(batch_size * 0.9)
 
     def save(self):
-        unsaved_npps = [x for x in self.newspapers.values() if not isinstance(x, int)]
-
-        print('Saving {} newspapers'.format(len(unsaved_npps)))
-        self.bulk_create(DbNewspaper, unsaved_npps)
-        self.populate_newspapers_from_database()
-
-        unsaved_pubs = [x for x in self.publications.values() if not isinstance(x, int)]
+        """
+        Save everything added since the last save. Rows that are already in the database (e.g. saved by another
+        process in the meantime) are left as they are, except for the volume and number of publications.
+        """
+        print('Saving {} newspapers'.format(len(self.newspapers)))
+        self.bulk_upsert(DbNewspaper, list(self.newspapers.values()), ['name'])
+        # The ids aren't set on the objects, so read them back
+        for (name,), id in get_ids(DbNewspaper.objects, 'name', self.newspapers.keys(), ('name',)).items():
+            self.newspaper_ids[name] = id
+        self.newspapers = {}
+
+        unsaved_pubs = list(self.publications.values())
         for pub in unsaved_pubs:
             if pub.newspaper_id is None or not isinstance(pub.newspaper_id, int):
                 pub.newspaper_id = self.get_newspaper(pub.newspaper_title)
@@ -128,287 +142,189 @@ class DbStorage:
             assert pub.newspaper_id is not None
 
         print('Saving {} publications'.format(len(unsaved_pubs)))
-        self.bulk_create(DbPublication, unsaved_pubs)
-        self.populate_publications_from_database()
-
-        unsaved_articles = [x for x in self.articles.values() if not isinstance(x, int)]
-        for article in unsaved_articles:
-            if article.publication_id is None or not isinstance(article.publication_id, int):
-                article.publication_id = self.get_publication(article.newspaper_title, article.published_date)
-                if article.publication_id is None:
-                    raise Exception('Publication "{}/{}" not found'.format(article.newspaper_title, article.published_date))
-                
-            assert article.publication_id is not None
-
-        print('Saving {} articles'.format(len(unsaved_articles)))
-        self.bulk_create(DbArticle, unsaved_articles)
-        self.populate_articles_from_database()
-        
-        unsaved_paras = [x for x in self.paragraphs.values() if not isinstance(x, int)]
-        for para in unsaved_paras:
-            if para.article_id is None or not isinstance(para.article_id, int):
-                para.article_id = self.get_article(para.newspaper_title, para.published_date, para.article_index)
-                if para.article_id is None:
-                    raise Exception('Article "{}/{}/#{}" not found'.format(para.newspaper_title, para.published_date, para.article_index))
-                
-            assert para.article_id is not None
-
-        print('Saving {} paragraphs'.format(len(unsaved_paras)))
-        self.bulk_create(DbParagraph, unsaved_paras)
-        self.populate_paragraphs_from_database()
-
-
-class AutoSaveCache:
-    def __init__(self, filename: str, save_freq: int):
-        self.filename = filename
-        self.filename_bak = filename + '.bak'
-        self.save_freq = save_freq
-
-        if os.path.isfile(self.filename):
-            with open(self.filename, 'rb') as f:
-                self.db_storage = pickle.load(f)
-        else:
-            self.db_storage = {}
-
-        self.item_count = len(self.db_storage)
-
-    def get_index(self, url):
-        index = self.db_storage.get(url, None)
-        if index is None:
-            return self.item_count + 1, True
-        return index, False
+        self.bulk_upsert(DbPublication, unsaved_pubs, ['newspaper_id', 'published_date'], ['volume', 'number'])
+        dates_by_newspaper = {}
+        for pub in unsaved_pubs:
+            dates_by_newspaper.setdefault((pub.newspaper_id, pub.newspaper_title), []).append(pub.published_date)
+        for (newspaper_id, newspaper_title), dates in dates_by_newspaper.items():
+            saved = get_ids(DbPublication.objects.filter(newspaper_id=newspaper_id), 'published_date', dates,
+                            ('published_date',))
+            for (published_date,), id in saved.items():
+                self.publication_ids[(newspaper_title, published_date)] = id
+        self.publications = {}
 
-    def __setitem__(self, key, value):
-        if key in self.db_storage:
-            raise Exception('Key {} already exists'.format(key))
-        self.item_count += 1
-        self.db_storage[key] = self.item_count
+        # Only the articles of the publications being saved are read back
+        pub_ids = {}
+        for newspaper_title, published_date, _ in self.articles.keys():
+            key = (newspaper_title, published_date)
+            if key not in pub_ids:
+                pub_ids[key] = self.get_publication(newspaper_title, published_date)
+                if pub_ids[key] is None:
+                    raise Exception('Publication "{}/{}" not found'.format(newspaper_title, published_date))
+
+        for (newspaper_title, published_date, _), article in self.articles.items():
+            article.publication_id = pub_ids[(newspaper_title, published_date)]
+
+        print('Saving {} articles'.format(len(self.articles)))
+        self.bulk_upsert(DbArticle, list(self.articles.values()), ['publication_id', 'index'])
+        article_ids = get_ids(DbArticle.objects, 'publication_id', set(pub_ids.values()), ('publication_id', 'index'))
+        self.articles = {}
 
-        if self.item_count % self.save_freq == 0:
-            with open(self.filename_bak, 'wb') as f:
-                pickle.dump(self.db_storage, f)
+        paras = []
+        for (newspaper_title, published_date, article_index, _), para in self.paragraphs.items():
+            pub_id = pub_ids.get((newspaper_title, published_date), None)
+            if pub_id is None:
+                pub_id = self.get_publication(newspaper_title, published_date)
+            para.article_id = article_ids.get((pub_id, article_index), None)
+            if para.article_id is None:
+                raise Exception('Article "{}/{}/#{}" not found'.format(newspaper_title, published_date, article_index))
+            paras.append(para)
+
+        # Word counts are only written for the paragraphs that weren't there before
+        article_ids_of_paras = set(para.article_id for para in paras)
+        saved_paras = get_ids(DbParagraph.objects, 'article_id', article_ids_of_paras, ('article_id', 'index'))
+        unsaved_paras = [para for para in paras if (para.article_id, para.index) not in saved_paras]
 
-            os.rename(self.filename_bak, self.filename)
-            print('Saved cache')
+        print('Saving {} paragraphs'.format(len(unsaved_paras)))
+        self.bulk_upsert(DbParagraph, unsaved_paras, ['article_id', 'index'])
+        para_ids = get_ids(DbParagraph.objects, 'article_id', article_ids_of_paras, ('article_id', 'index'))
+        self.paragraphs = {}
 
-    def save(self):
-        with open(self.filename_bak, 'wb') as f:
-            pickle.dump(self.db_storage, f)
+        para_word_counts = []
+        for para in unsaved_paras:
+            word_counts = getattr(para, 'word_counts', None)
+            if word_counts:
+                para_word_counts.append((para_ids[(para.article_id, para.index)], word_counts))
 
-        os.rename(self.filename_bak, self.filename)
-        print('Saved final cache')
+        print('Saving word counts of {} paragraphs'.format(len(para_word_counts)))
+        if len(para_word_counts) > 0:
+            self.word_count_writer.write(para_word_counts)
 
 
 class SelfQueryOrLoad:
-    def __init__(self, url, cache, browser_wrapper):
+    # Which parts of the page to parse, see page_parser
+    parse_only = None
+
+    def __init__(self, url, cache, store, fetcher, refresh=False):
+        """
+        :param refresh: True to ask the server whether the cached page changed instead of using it as is
+        """
         self.url = url
         self.cache = cache
-        self.browser_wrapper = browser_wrapper
-
-    def _query(self, cache_file_path_zip):
-        query_finished = False
-        response = None
-        while not query_finished:
-            try:
-                response = self.browser_wrapper.make_query_retrial_if_fail(self.url)
-                query_finished = True
-            except Exception as e:
-                self.browser_wrapper.reload()
+        self.store = store
+        self.fetcher = fetcher
+        self.refresh = refresh
 
-        zf = zipfile.ZipFile(cache_file_path_zip, mode='w', compression=zipfile.ZIP_DEFLATED)
-        try:
-            zf.writestr('content.html', response)
-        finally:
-            zf.close()
+    def _query(self, cache_index, cached=None):
+        response = self.fetcher.fetch(self.url, cached)
+        self.store.put(cache_index, response)
         return response
 
-    def _load(self, cache_file_path_zip):
-        zf = zipfile.ZipFile(cache_file_path_zip, 'r')
-        response = zf.read('content.html').decode('utf-8')
-        return response
+    def prefetch(self, urls):
+        """
+        Fetch all the pages that aren't cached yet at once, so that they load from the cache afterwards
+        :param urls: list of urls
+        """
+        missing = []
+        for url in urls:
+            cache_index, is_new = self.cache.get_index(url)
+            if is_new or not self.store.has(cache_index):
+                missing.append(url)
+
+        if len(missing) == 0:
+            return
+
+        print('Fetching {} pages'.format(len(missing)))
+        for url, response in zip(missing, self.fetcher.fetch_many(missing, return_exceptions=True)):
+            # A page that can't be fetched is left to fail again when it is loaded, where it can be dealt with
+            if isinstance(response, Exception):
+                continue
+            cache_index, is_new = self.cache.get_index(url)
+            self.store.put(cache_index, response)
+            if is_new:
+                self.cache[url] = cache_index
 
     def query_or_load(self):
         cache_index, is_new = self.cache.get_index(self.url)
-        cache_file_path_zip = os.path.join(cache_zip_dir, '{}.zip'.format(cache_index))
 
-        if os.path.isfile(cache_file_path_zip):
-            content = self._load(cache_file_path_zip)
-        else:
-            content = self._query(cache_file_path_zip)
+        content = self.store.get(cache_index)
+        if content is None:
+            content = self._query(cache_index)
+        elif self.refresh:
+            # Only downloaded again if it changed, otherwise the server answers 304 and the cached page is kept
+            content = self._query(cache_index, content)
 
         if is_new:
             self.cache[self.url] = cache_index
 
-        soup = BeautifulSoup(content, 'html5lib')
+        soup = page_parser.parse(content, self.parse_only)
         return soup
 
 
 class Page(SelfQueryOrLoad):
+    parse_only = page_parser.PUBLICATION_LIST
+
     def _get_publication_links(self, soup):
-        publications = []
-        rows = soup.select('.date_list tbody tr')
-        for row in rows:
-            cols = row.select('td')
-            links = cols[2].select('a')
-            if len(links) == 1:
-                maori_link = 'http://www.nzdl.org' + links[0].get('href')
-            else:
-                maori_link = 'http://www.nzdl.org' + links[1].get('href')
-            full_title = cols[3].text
-            published_date = cols[4].text
-            publications.append((maori_link, full_title, published_date))
-        return publications
+        return page_parser.get_publication_links(soup)
 
     def save_article(self, article):
         pass
 
     def detect_articles(self, npp_title, pub_published_date, para_and_links, db_storage : DbStorage):
-        articles = []
-        current_article = None
-
-        for p, url in para_and_links:
-            if p.isupper():
-                # Save the previous article if exists
-                if current_article is not None:
-                    if len(current_article.current_contents) > 0:
-                        articles.append(current_article)
-                current_article = DbArticle()
-                current_article.title = p
-                current_article.url = url
-                current_article.current_contents = []
-            else:
-                if current_article is None:
-                    current_article = DbArticle()
-                    current_article.title = ''
-                    current_article.url = url
-                    current_article.current_contents = []
-                current_article.current_contents.append(p)
-
-        if current_article is not None:
-            if len(current_article.current_contents) > 0:
-                articles.append(current_article)
-
-        for i, article in enumerate(articles, 1):
-            article.index = i
+        articles = split_articles(para_and_links)
+        for article in articles:
             article.newspaper_title = npp_title
             article.published_date = pub_published_date
             db_storage.add_article(npp_title, pub_published_date, article)
 
         return articles
 
-    def contruct_paragraphs_and_extract_maori_info(self, article, taumahi):
-        paragraphs = []
-        for i, paragraph_content in enumerate(article.current_contents, 1):
-            maori_count, ambiguous_count, english_count, total_count, percentage = taumahi.tiki_ōrau(paragraph_content)
-            paragraph = DbParagraph()
-            paragraph.index = i
-            paragraph.maori_word_count = maori_count
-            paragraph.ambiguous_word_count = ambiguous_count
-            paragraph.other_word_count = english_count
-            paragraph.total_word_count = total_count
-            paragraph.percentage_maori = percentage
-            paragraph.content = paragraph_content
-
-            paragraphs.append(paragraph)
-        return paragraphs
-
-    def query_all_publications(self, soup, db_storage, taumahi):
+    def query_all_publications(self, soup, db_storage, crawler):
         publication_links = self._get_publication_links(soup)
-        for link, full_title, published_date in publication_links:
-            publication = Publication(link, full_title, published_date, self.cache, self.browser_wrapper)
-            psoup = publication.query_or_load()
+        self.prefetch([link for link, _, _ in publication_links])
 
-            print('Querying content of {}/{}'.format(full_title, published_date))
-            para_and_links, db_pub = publication.query_all_contents(psoup, db_storage)
+        # The crawler fetches and parses the publications in the background, here they are only put into db_storage,
+        # in whatever order they are finished. closing() stops the crawl as soon as anything here raises
+        with closing(crawler.crawl(publication_links)) as crawled:
+            for link, full_title, published_date, para_and_links in crawled:
+                publication = Publication(link, full_title, published_date, self.cache, self.store, self.fetcher)
+                publication.populate_database(db_storage)
+                print('Storing content of {}/{}'.format(full_title, published_date))
 
-            newspaper_title = publication.newspaper_title
-            published_date = publication.published_date
+                newspaper_title = publication.newspaper_title
+                published_date = publication.published_date
 
-            articles = self.detect_articles(newspaper_title, published_date, para_and_links, db_storage)
-            bar = Bar('Extracting articles from page', max=len(articles))
+                articles = self.detect_articles(newspaper_title, published_date, para_and_links, db_storage)
+                for article in articles:
+                    paragraphs = construct_paragraphs(article)
+                    for i, paragraph in enumerate(paragraphs, 1):
+                        paragraph.article = article
+                        paragraph.index = i
+                        paragraph.newspaper_title = newspaper_title
+                        paragraph.published_date = published_date
+                        paragraph.article_index = article.index
+                        db_storage.add_paragraph(newspaper_title, published_date, article.index, paragraph)
 
-            for article in articles:
-                paragraphs = self.contruct_paragraphs_and_extract_maori_info(article, taumahi)
-                # if isinstance(db_pub, int):
-                #     article.publication_id = db_pub
-                # else:
-                #     article.publication = db_pub
-                # article.save()
-
-                for i, paragraph in enumerate(paragraphs, 1):
-                    paragraph.article = article
-                    paragraph.index = i
-                    paragraph.newspaper_title = newspaper_title
-                    paragraph.published_date = published_date
-                    paragraph.article_index = article.index
-                    db_storage.add_paragraph(newspaper_title, published_date, article.index, paragraph)
-
-                bar.next()
-            bar.finish()
+        crawler.report()
 
 
 class IndexPage(Page):
+    parse_only = page_parser.YEAR_INDEX
+
     def get_links_to_years(self, soup):
-        h_items = soup.select('.h_item a')
-        links = []
-        for h_item in h_items:
-            href = 'http://www.nzdl.org' + h_item.get('href')
-            links.append(href)
-        return links
+        return page_parser.get_year_links(soup)
 
 
 class Publication(SelfQueryOrLoad):
-    def __init__(self, link, full_title, published_date, cache, browser_wrapper):
-        super(Publication, self).__init__(link, cache, browser_wrapper)
+    def __init__(self, link, full_title, published_date, cache, store, fetcher):
+        super(Publication, self).__init__(link, cache, store, fetcher)
         self.full_title = full_title
         self.newspaper_title = None
         self.published_date = published_date
 
-    def query_all_contents(self, psoup, db_storage=None):
-        if db_storage is not None:
-            db_pub = self.populate_database(db_storage)
-
-        next_content_link = self.url
-        soup = psoup
-        page_no = 1
-        all_pages_ps = []
-        while next_content_link is not None:
-            content = Content(next_content_link, self.cache, self.browser_wrapper)
-            if soup is None:
-                soup = content.query_or_load()
-
-            if db_storage is not None:
-                ps = content.populate_database(soup, db_pub, self.newspaper_title, self.published_date, page_no, db_storage)
-                if ps is not None:
-                    for p in ps:
-                        all_pages_ps.append((p, next_content_link))
-
-            next_content_link = content.get_next_link(soup)
-            soup = None
-            page_no += 1
-
-        return all_pages_ps, db_pub
-
     def populate_database(self, db_storage : DbStorage):
-        if len(self.published_date) == 8:
-            datetime_format = '%Y%m%d'
-        elif len(self.published_date) == 6:
-            datetime_format = '%Y%m'
-        elif len(self.published_date) == 4:
-            datetime_format = '%Y'
-        elif '-' in self.published_date:
-            self.published_date = self.published_date[:self.published_date.index('-')]
-            datetime_format = '%Y%m'
-        else:
-            raise ValueError('{} does not match any datetime format'.format(self.published_date))
-
-        self.published_date = datetime.datetime.strptime(self.published_date, datetime_format).date()
-
-        name_matcher = NEWSPAPER_NAME_MATCHER.match(self.full_title)
-        if name_matcher is not None:
-            self.newspaper_title = name_matcher.group(1)
-        else:
-            raise Exception('Malform publication title {}'.format(self.full_title))
+        self.newspaper_title, self.published_date, volume, number = \
+            parse_publication_title(self.full_title, self.published_date)
 
         db_pub = db_storage.get_publication(self.newspaper_title, self.published_date)
         if db_pub is not None:
@@ -422,62 +338,291 @@ class Publication(SelfQueryOrLoad):
         db_pub = DbPublication()
         db_pub.newspaper_title = self.newspaper_title
         db_pub.published_date = self.published_date
+        db_pub.volume = volume
+        db_pub.number = number
 
         if isinstance(db_newspaper, int):
             db_pub.newspaper_id = db_newspaper
         else:
             db_pub.newspaper_id = None
 
-        vol_matcher = NEWSPAPER_VOL_MATCHER.match(self.full_title)
-        if vol_matcher is not None:
-            db_pub.volume = int(vol_matcher.group(2))
-
-        no_matcher = NEWSPAPER_NO_MATCHER.match(self.full_title)
-        if no_matcher is not None:
-            db_pub.number = int(no_matcher.group(2))
-
         db_storage.add_publication(self.newspaper_title, db_pub)
         return db_pub
 
 
-class Content(SelfQueryOrLoad):
-    def __init__(self, link, cache, browser_wrapper):
-        super(Content, self).__init__(link, cache, browser_wrapper)
-        self.newspaper_title = None
-        self.published_date = None
-
-    def get_next_link(self, soup):
-        next_button = soup.select('.navarrowsbottom td[align=right] a')
-        if len(next_button) == 0:
-            return None
-        return 'http://www.nzdl.org' + next_button[0].get('href')
-
-    def populate_database(self, soup, db_pub, newspaper_title, published_date, page_no, db_storage : DbStorage):
-        self.newspaper_title = newspaper_title
-        self.published_date = published_date
-
-        document_text = []
-        td = soup.select('.documenttext table tbody td')
-
-        if len(td) == 0:
-            return
-
-        td = td[0]
-
-        ps = td.select('p')
-        p_texts = []
-        for p in ps:
-            p_texts.append(p.text.strip())
-            p.decompose()
-
-        left_over_text = td.text.strip()
-        if len(left_over_text) > 0:
-            document_text.append(left_over_text)
-        for p_text in p_texts:
-            if len(p_text) > 0:
-                document_text.append(p_text)
-
-        return document_text
+def parse_publication_title(full_title, published_date):
+    """
+    :param full_title: e.g. "Te Karere Maori 1850 Volume 2 No. 3", as in the list of publications
+    :param published_date: e.g. "18500401", "185004", "1850" or "185004-185005", as in the list of publications
+    :return: (newspaper title, published date as a date, volume or None, number or None)
+    """
+    if len(published_date) == 8:
+        datetime_format = '%Y%m%d'
+    elif len(published_date) == 6:
+        datetime_format = '%Y%m'
+    elif len(published_date) == 4:
+        datetime_format = '%Y'
+    elif '-' in published_date:
+        published_date = published_date[:published_date.index('-')]
+        datetime_format = '%Y%m'
+    else:
+        raise ValueError('{} does not match any datetime format'.format(published_date))
+
+    published_date = datetime.datetime.strptime(published_date, datetime_format).date()
+
+    name_matcher = NEWSPAPER_NAME_MATCHER.match(full_title)
+    if name_matcher is not None:
+        newspaper_title = name_matcher.group(1)
+    else:
+        raise Exception('Malform publication title {}'.format(full_title))
+
+    volume = None
+    vol_matcher = NEWSPAPER_VOL_MATCHER.match(full_title)
+    if vol_matcher is not None:
+        volume = int(vol_matcher.group(2))
+
+    number = None
+    no_matcher = NEWSPAPER_NO_MATCHER.match(full_title)
+    if no_matcher is not None:
+        number = int(no_matcher.group(2))
+
+    return newspaper_title, published_date, volume, number
+
+
+def split_articles(para_and_links):
+    """
+    Group the paragraphs of a publication into articles: a paragraph all in capitals is the title of a new article
+    :param para_and_links: list of (paragraph, url of its page, (taumahi result, word counts))
+    :return: list of unsaved Articles, numbered from 1, with the paragraphs in current_contents and their scores in
+             current_scores
+    """
+    articles = []
+    current_article = None
+
+    for p, url, scores in para_and_links:
+        if p.isupper():
+            # Save the previous article if exists
+            if current_article is not None:
+                if len(current_article.current_contents) > 0:
+                    articles.append(current_article)
+            current_article = DbArticle()
+            current_article.title = p
+            current_article.url = url
+            current_article.current_contents = []
+            current_article.current_scores = []
+        else:
+            if current_article is None:
+                current_article = DbArticle()
+                current_article.title = ''
+                current_article.url = url
+                current_article.current_contents = []
+                current_article.current_scores = []
+            current_article.current_contents.append(p)
+            current_article.current_scores.append(scores)
+
+    if current_article is not None:
+        if len(current_article.current_contents) > 0:
+            articles.append(current_article)
+
+    for i, article in enumerate(articles, 1):
+        article.index = i
+
+    return articles
+
+
+def construct_paragraphs(article):
+    """
+    :param article: an Article from split_articles
+    :return: list of unsaved Paragraphs, with their Taumahi scores, and their word counts in word_counts
+    """
+    paragraphs = []
+    contents_and_scores = zip(article.current_contents, article.current_scores)
+    for i, (paragraph_content, (taumahi_result, word_counts)) in enumerate(contents_and_scores, 1):
+        maori_count, ambiguous_count, english_count, total_count, percentage = taumahi_result
+        paragraph = DbParagraph()
+        paragraph.index = i
+        paragraph.maori_word_count = maori_count
+        paragraph.ambiguous_word_count = ambiguous_count
+        paragraph.other_word_count = english_count
+        paragraph.total_word_count = total_count
+        paragraph.percentage_maori = percentage
+        paragraph.content = paragraph_content
+        paragraph.word_counts = word_counts
+
+        paragraphs.append(paragraph)
+    return paragraphs
+
+
+# Each parse worker process has its own Taumahi, made once when the process starts
+worker_taumahi = None
+
+
+def init_parse_worker():
+    global worker_taumahi
+    worker_taumahi = Taumahi()
+
+
+def parse_and_classify(html):
+    """
+    The CPU-bound part of the crawl, run in the worker processes: parse a content page, and score its paragraphs
+    :param html: the content page
+    :return: (link to the next page or None, list of (paragraph, (taumahi result, word counts)), seconds spent)
+    """
+    start = time.perf_counter()
+    soup = page_parser.parse(html, page_parser.CONTENT_PAGE)
+    scored = []
+    for text in page_parser.get_page_texts(soup):
+        taumahi_result, ngā_raupapa = worker_taumahi.tiki_ōrau_kōmiri(text)
+        scored.append((text, (taumahi_result, get_word_counts(ngā_raupapa))))
+    return page_parser.get_next_link(soup), scored, time.perf_counter() - start
+
+
+class StageCounter:
+    """
+    How many items a stage of the crawl went through and how long it was busy with them, summed over its workers
+    """
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.count = 0
+        self.seconds = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds, count=1):
+        with self.lock:
+            self.count += count
+            self.seconds += seconds
+
+    def __str__(self):
+        per_item = self.seconds / self.count if self.count > 0 else 0
+        return '{}: {} {} in {:.1f}s busy ({:.3f}s per {})'.format(self.name, self.count, self.unit, self.seconds,
+                                                                   per_item, self.unit[:-1])
+
+
+class PublicationCrawler:
+    """
+    Fetches the content pages of many publications at once and parses them in other processes, so that waiting for
+    the network and parsing/scoring overlap:
+
+      fetch threads --(html)--> parse processes --(paragraphs)--> fetch threads --(publication)--> writer
+
+    Each fetch thread follows the chain of pages of one publication: it loads or fetches a page, has it parsed by the
+    process pool (which also gives the link to the next page), and once the last page is done, puts the whole
+    publication on a bounded queue. The writer is whoever iterates over crawl(), and is the only one touching the
+    DbStorage. When the writer falls behind, the queue fills up and the fetch threads wait, so no more than
+    `queue_size` publications are ever held in memory.
+    """
+    def __init__(self, cache, store, fetcher, fetch_workers=4, parse_workers=None, queue_size=None, refresh=False):
+        """
+        :param fetch_workers: number of publications crawled at the same time
+        :param parse_workers: number of processes parsing pages, None for one per CPU
+        :param queue_size: number of crawled publications that may wait for the writer, None for 2 * fetch_workers
+        :param refresh: True to ask the server whether each cached page changed instead of using it as is
+        """
+        self.cache = cache
+        self.store = store
+        self.fetcher = fetcher
+        self.refresh = refresh
+        self.fetch_workers = fetch_workers
+        self.queue_size = queue_size or 2 * fetch_workers
+        self.parse_pool = ProcessPoolExecutor(max_workers=parse_workers, initializer=init_parse_worker)
+        self.cache_lock = threading.Lock()
+        self.cancelled = threading.Event()
+
+        self.fetch_stage = StageCounter('Fetch', 'pages')
+        self.parse_stage = StageCounter('Parse and classify', 'pages')
+        self.write_stage = StageCounter('Write', 'publications')
+        self.fetchers_blocked = StageCounter('Fetchers waiting for the writer', 'publications')
+        self.writer_starved = StageCounter('Writer waiting for the fetchers', 'publications')
+        self.wall_seconds = 0
+
+    def load(self, url):
+        with self.cache_lock:
+            cache_index, is_new = self.cache.get_index(url)
+            if is_new:
+                self.cache[url] = cache_index
+
+        content = self.store.get(cache_index)
+        if content is None or self.refresh:
+            # A cached page is only downloaded again if it changed
+            content = self.fetcher.fetch(url, content)
+            self.store.put(cache_index, content)
+        return content
+
+    def _put(self, results, item):
+        start = time.perf_counter()
+        while not self.cancelled.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+        self.fetchers_blocked.add(time.perf_counter() - start)
+
+    def _crawl_publication(self, publication_link, results):
+        url = publication_link[0]
+        para_and_links = []
+        try:
+            while url is not None and not self.cancelled.is_set():
+                start = time.perf_counter()
+                html = self.load(url)
+                self.fetch_stage.add(time.perf_counter() - start)
+
+                next_link, scored, seconds = self.parse_pool.submit(parse_and_classify, html).result()
+                self.parse_stage.add(seconds)
+                para_and_links += [(text, url, scores) for text, scores in scored]
+                url = next_link
+            self._put(results, (publication_link, para_and_links))
+        except Exception as e:
+            self._put(results, (publication_link, e))
+
+    def crawl(self, publication_links):
+        """
+        :param publication_links: list of (link, full title, published date)
+        :return: generator of (link, full title, published date, list of (paragraph, url, scores)) for each
+                 publication, as soon as it is crawled. Close it (e.g. with contextlib.closing) if not read to the end
+        """
+        start = time.perf_counter()
+        results = queue.Queue(maxsize=self.queue_size)
+        self.cancelled.clear()
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as pool:
+            futures = []
+            try:
+                for publication_link in publication_links:
+                    futures.append(pool.submit(self._crawl_publication, publication_link, results))
+
+                for _ in range(len(publication_links)):
+                    wait_start = time.perf_counter()
+                    publication_link, para_and_links = results.get()
+                    self.writer_starved.add(time.perf_counter() - wait_start)
+                    if isinstance(para_and_links, Exception):
+                        raise para_and_links
+
+                    write_start = time.perf_counter()
+                    yield publication_link + (para_and_links,)
+                    self.write_stage.add(time.perf_counter() - write_start)
+            finally:
+                # If a publication failed or the writer gave up, stop the fetch threads before the pool waits for
+                # them: the ones not started are cancelled, the others stop after their current page, and the queue
+                # is emptied so that none waits for room in it
+                self.cancelled.set()
+                for future in futures:
+                    future.cancel()
+                while True:
+                    try:
+                        results.get_nowait()
+                    except queue.Empty:
+                        break
+                self.wall_seconds += time.perf_counter() - start
+
+    def report(self):
+        print('Crawled for {:.1f}s'.format(self.wall_seconds))
+        for stage in (self.fetch_stage, self.parse_stage, self.write_stage, self.fetchers_blocked,
+                      self.writer_starved):
+            print('  {}'.format(stage))
+
+    def close(self):
+        self.parse_pool.shutdown()
 
 
 class Command(BaseCommand):
@@ -486,8 +631,16 @@ class Command(BaseCommand):
         super().__init__()
         cache_file = os.path.join(cache_dir, 'cache.pkl')
         self.cache = AutoSaveCache(cache_file, 10)
-        self.browser_wrapper = BrowserWrapper(cache_dir)
-        self.taumahi = Taumahi()
+        self.store = PageStore(cache_dir)
+        if os.path.isdir(cache_zip_dir):
+            imported = self.store.import_zips(cache_zip_dir, self.cache.db_storage.values())
+            if imported > 0:
+                print('Imported {} pages from {}'.format(imported, cache_zip_dir))
+        self.browser_wrapper = BrowserPool(cache_dir)
+        self.transport = HttpTransport(validators_file=os.path.join(cache_dir, 'validators.pkl'))
+        self.fetcher = Fetcher(self.browser_wrapper, transport=self.transport)
+        self.crawler = None
+        self.refresh = False
 
     def _query_or_populate(self, store=False):
         """
@@ -495,13 +648,13 @@ class Command(BaseCommand):
         - Construct a list of links. For each link, do the following:
           + Construct a Page object from the link (including the initial page)
           + Let the Page query its URL or read from stored HTML. The page will have a number of publications.
-          + 1) For each publication, construct a Publication object from the link, and do:
-            * Let the Publication query its URL or read from stored HTML, this HTML file will have the content of the
+          + 1) For each publication, the PublicationCrawler (several publications at a time) does:
+            * Query the publication's URL or read from stored HTML, this HTML file will have the content of the
               page, page number, and link to the next page.
-            * a) For each page, construct a Content object, and let it read from the HTML
+            * a) Parse the page and score its paragraphs in a worker process
             * Then look up the link to the next page, if exists
               # If exists, go back to * a)
-              # If not, return to + 1)
+              # If not, hand the publication to the Page, which puts it in the DbStorage, and return to + 1)
 
         :return:
         """
@@ -512,16 +665,16 @@ class Command(BaseCommand):
         else:
             parse_cache = {}
 
-        index_page = IndexPage(INITIAL_URL, self.cache, self.browser_wrapper)
+        index_page = IndexPage(INITIAL_URL, self.cache, self.store, self.fetcher, self.refresh)
         soup = index_page.query_or_load()
         year_links = index_page.get_links_to_years(soup)
 
-        if parse_cache.get(INITIAL_URL, None) is None:
+        if parse_cache.get(INITIAL_URL, None) is None or self.refresh:
             if store:
                 db_storage = DbStorage()
             else:
                 db_storage = None
-            index_page.query_all_publications(soup, db_storage, self.taumahi)
+            index_page.query_all_publications(soup, db_storage, self.crawler)
             db_storage.save()
             parse_cache[INITIAL_URL] = True
             with open(cache_file, 'wb') as f:
@@ -530,14 +683,14 @@ class Command(BaseCommand):
             print('Skip {}'.format(INITIAL_URL))
 
         for link in year_links:
-            if parse_cache.get(link, None) is None:
+            if parse_cache.get(link, None) is None or self.refresh:
                 if store:
                     db_storage = DbStorage()
                 else:
                     db_storage = None
-                page = Page(link, self.cache, self.browser_wrapper)
+                page = Page(link, self.cache, self.store, self.fetcher, self.refresh)
                 soup = page.query_or_load()
-                page.query_all_publications(soup, db_storage, self.taumahi)
+                page.query_all_publications(soup, db_storage, self.crawler)
                 db_storage.save()
                 parse_cache[link] = True
 
@@ -547,10 +700,38 @@ class Command(BaseCommand):
                 print('Skip {}'.format(link))
 
     def finalise(self):
+        if self.crawler is not None:
+            self.crawler.close()
         self.cache.save()
+        self.store.close()
+        self.browser_wrapper.close()
+        self.fetcher.close()
+        print('Fetched {} pages over HTTP ({} unchanged since last time) and {} with the browser'
+              .format(self.fetcher.http_count, self.transport.not_modified_count, self.fetcher.browser_count))
+        print('Browser leases: {leases}, mean wait {mean_wait:.2f}s, max wait {max_wait:.2f}s, {recycled} recycled'
+              .format(**self.browser_wrapper.lease_stats()))
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', action='store', dest='concurrency', type=int, default=8,
+                            help='Maximum number of pages fetched at the same time')
+        parser.add_argument('--browsers', action='store', dest='browsers', type=int, default=2,
+                            help='Number of browsers for the pages that need one')
+        parser.add_argument('--fetch-workers', action='store', dest='fetch_workers', type=int, default=4,
+                            help='Number of publications crawled at the same time')
+        parser.add_argument('--parse-workers', action='store', dest='parse_workers', type=int, default=None,
+                            help='Number of processes parsing pages, default is one per CPU')
+        parser.add_argument('--refresh', action='store_true', dest='refresh', default=False,
+                            help='Crawl the pages done in previous runs again, and ask the server whether each '
+                                 'cached page changed. Unchanged pages are not downloaded again')
 
     def handle(self, *args, **options):
         self.browser_wrapper.auto_solve_captcha = True
+        self.fetcher.concurrency = options['concurrency']
+        self.transport.set_pool_size(max(options['concurrency'], options['fetch_workers'], self.transport.pool_size))
+        self.browser_wrapper.size = options['browsers']
+        self.refresh = options['refresh']
+        self.crawler = PublicationCrawler(self.cache, self.store, self.fetcher, options['fetch_workers'],
+                                          options['parse_workers'], refresh=self.refresh)
         self.populate()
         self.finalise()
 
@@ -0,0 +1,129 @@
+import json
+import os
+import pickle
+
+
+def read_journal(journal_filename):
+    """
+    :return: list of (url, index) in the journal, and the length of the part of the file they were read from.
+             A last line cut short (by a crash, or because it is being written right now) is left out
+    """
+    entries = []
+    good_length = 0
+    if not os.path.isfile(journal_filename):
+        return entries, good_length
+
+    with open(journal_filename, 'rb') as f:
+        for line in f:
+            try:
+                url, index = json.loads(line.decode('utf-8'))
+            except ValueError:
+                break
+            if not line.endswith(b'\n'):
+                break
+            entries.append((url, index))
+            good_length += len(line)
+    return entries, good_length
+
+
+def read_url_indices(filename):
+    """
+    The url -> index dict of an AutoSaveCache, read without opening any of its files for writing, so that it is safe
+    to call while a scraper is adding to the cache. Urls added after this call aren't in the dict.
+    :param filename: the filename the AutoSaveCache was made with
+    :return: dict of url -> index
+    """
+    # The journal is read before the snapshot: if the cache is compacted in between, the new snapshot has everything
+    # the journal had, so nothing is missed either way
+    entries, _ = read_journal(filename + '.journal')
+    url_indices = {}
+    if os.path.isfile(filename):
+        with open(filename, 'rb') as f:
+            url_indices = pickle.load(f)
+    url_indices.update(entries)
+    return url_indices
+
+
+class AutoSaveCache:
+    """
+    Gives every url a number (1, 2, 3, ...) and remembers it across runs.
+
+    The url -> index dict is kept on disk as a pickle (the snapshot) plus a journal that gets one line per new url,
+    so adding a url costs the same however big the cache is. The journal is fsync'ed every `save_freq` new urls,
+    and folded into the snapshot every `compact_freq`: the new snapshot is written next to the old one and renamed
+    over it, so a crash at any point leaves either the old or the new snapshot, and replaying the journal on top of
+    either gives the same dict.
+    """
+    def __init__(self, filename: str, save_freq: int, compact_freq: int = 10000):
+        self.filename = filename
+        self.filename_bak = filename + '.bak'
+        self.journal_filename = filename + '.journal'
+        self.save_freq = save_freq
+        self.compact_freq = compact_freq
+
+        if os.path.isfile(self.filename):
+            with open(self.filename, 'rb') as f:
+                self.db_storage = pickle.load(f)
+        else:
+            self.db_storage = {}
+
+        self.journal_count = self._replay()
+        self.item_count = len(self.db_storage)
+        self.journal = open(self.journal_filename, 'a', encoding='utf-8')
+
+    def _replay(self):
+        """
+        Apply the journal on top of the snapshot. A last line cut short by a crash is dropped from the file
+        :return: number of urls in the journal
+        """
+        entries, good_length = read_journal(self.journal_filename)
+        self.db_storage.update(entries)
+
+        if os.path.isfile(self.journal_filename) and good_length < os.path.getsize(self.journal_filename):
+            with open(self.journal_filename, 'r+b') as f:
+                f.truncate(good_length)
+        return len(entries)
+
+    def get_index(self, url):
+        index = self.db_storage.get(url, None)
+        if index is None:
+            return self.item_count + 1, True
+        return index, False
+
+    def __setitem__(self, key, value):
+        if key in self.db_storage:
+            raise Exception('Key {} already exists'.format(key))
+        self.item_count += 1
+        self.db_storage[key] = self.item_count
+
+        self.journal.write(json.dumps([key, self.item_count], ensure_ascii=False) + '\n')
+        self.journal_count += 1
+
+        if self.journal_count >= self.compact_freq:
+            self.compact()
+            print('Saved cache')
+        elif self.item_count % self.save_freq == 0:
+            self._sync()
+
+    def _sync(self):
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def compact(self):
+        """
+        Write the whole dict as the new snapshot and empty the journal
+        """
+        self._sync()
+        with open(self.filename_bak, 'wb') as f:
+            pickle.dump(self.db_storage, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(self.filename_bak, self.filename)
+
+        self.journal.close()
+        self.journal = open(self.journal_filename, 'w', encoding='utf-8')
+        self.journal_count = 0
+
+    def save(self):
+        self.compact()
+        print('Saved final cache')
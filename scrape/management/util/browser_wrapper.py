@@ -1,17 +1,21 @@
 import os
 import pathlib
 import pickle
+import queue
 import sys
+import threading
 import time
+from contextlib import contextmanager
 from distutils import util as distutils_util
 
-import requests
 from selenium import webdriver
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from selenium.webdriver.support.expected_conditions import staleness_of
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as ec
 
+from scrape.management.util.http_transport import USER_AGENT, get_transport
+
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
 
@@ -68,7 +72,7 @@ class CaptchaSolver:
                 "data-s": self.data_s,
                 "key": self.api_key,
                 "pageurl": self.pageurl,
-                "useragent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36",
+                "useragent": USER_AGENT,
                 "json": 1}
 
         if self.google_abuse_exemption_cookie is not None:
@@ -77,7 +81,7 @@ class CaptchaSolver:
 
         print('Submitting request for captcha solver: {}'.format(form))
 
-        response = requests.post('http://2captcha.com/in.php', data=form)
+        response = get_transport().post('http://2captcha.com/in.php', data=form)
         response_json = response.json()
         error_text = response_json.get('error_text', '')
         if error_text != '':
@@ -93,7 +97,7 @@ class CaptchaSolver:
         res_json = None
         while not captcha_solved_successful:
             try:
-                res = requests.get(url)
+                res = get_transport().get(url)
                 res_json = res.json()
                 response_status = res_json['status']
                 if response_status == 0:
@@ -121,7 +125,8 @@ class CaptchaSolver:
 
 
 class BrowserWrapper:
-    def __init__(self, cache_dir, cookies=None):
+    def __init__(self, cache_dir, cookies=None, headless=False):
+        self.headless = headless
         self.driver = None
         self.browser = None
         self.cookies = None
@@ -142,6 +147,8 @@ class BrowserWrapper:
         options.experimental_options["prefs"] = chrome_prefs
         chrome_prefs["profile.default_content_settings"] = {"images": 2}
         chrome_prefs["profile.managed_default_content_settings"] = {"images": 2}
+        if self.headless:
+            options.add_argument('--headless')
 
         self.driver = webdriver.Chrome
         self.browser = self.driver(executable_path=drivers_executables[self.driver], chrome_options=options)
@@ -231,4 +238,124 @@ class BrowserWrapper:
             else:
                 cookies = self.browser.get_cookies()
 
-        return self.browser.page_source, bypass_token, cookies
\ No newline at end of file
+        return self.browser.page_source, bypass_token, cookies
+
+
+class BrowserPool:
+    """
+    Keeps up to `size` browsers and leases them out one query at a time, so that several pages that need a browser
+    can be fetched at once. A browser is replaced after `max_pages` queries, or as soon as a query fails, instead of
+    reloading the only browser there is. Has the same make_query_retrial_if_fail and reload as BrowserWrapper.
+
+    The browsers open in a window, like BrowserWrapper's, so that a captcha the solver can't get through can still be
+    solved by hand. Only make them headless when that isn't needed.
+    """
+    def __init__(self, cache_dir, size=2, max_pages=200, headless=False, cookies=None):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_pages = max_pages
+        self.headless = headless
+        self.cookies = cookies
+        self.auto_solve_captcha = False
+
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.created = 0
+
+        self.lease_count = 0
+        self.lease_wait_total = 0
+        self.lease_wait_max = 0
+        self.recycled = 0
+
+    def _new_browser(self):
+        browser_wrapper = BrowserWrapper(self.cache_dir, self.cookies, self.headless)
+        browser_wrapper.init_browser()
+        browser_wrapper.page_count = 0
+        return browser_wrapper
+
+    def _create(self):
+        # Returns a new browser, or None if there are already `size` of them
+        with self.lock:
+            if self.created >= self.size:
+                return None
+            self.created += 1
+        try:
+            return self._new_browser()
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+
+    def _acquire(self):
+        # None in the queue means that a browser has been recycled, which frees a place for a new one
+        while True:
+            try:
+                browser_wrapper = self.idle.get_nowait()
+            except queue.Empty:
+                browser_wrapper = self._create()
+                if browser_wrapper is None:
+                    browser_wrapper = self.idle.get()
+
+            if browser_wrapper is not None:
+                return browser_wrapper
+
+    def _recycle(self, browser_wrapper):
+        try:
+            browser_wrapper.browser.quit()
+        except Exception:
+            pass
+        with self.lock:
+            self.created -= 1
+            self.recycled += 1
+        self.idle.put(None)
+
+    @contextmanager
+    def lease(self):
+        start = time.monotonic()
+        browser_wrapper = self._acquire()
+        wait = time.monotonic() - start
+        with self.lock:
+            self.lease_count += 1
+            self.lease_wait_total += wait
+            self.lease_wait_max = max(self.lease_wait_max, wait)
+
+        browser_wrapper.auto_solve_captcha = self.auto_solve_captcha
+        try:
+            yield browser_wrapper
+        except Exception:
+            self._recycle(browser_wrapper)
+            raise
+
+        browser_wrapper.page_count += 1
+        if browser_wrapper.page_count >= self.max_pages:
+            self._recycle(browser_wrapper)
+        else:
+            self.idle.put(browser_wrapper)
+
+    def make_query_retrial_if_fail(self, url):
+        with self.lease() as browser_wrapper:
+            return browser_wrapper.make_query_retrial_if_fail(url)
+
+    def reload(self):
+        # Nothing to do, the browser that failed has already been replaced
+        pass
+
+    def lease_stats(self):
+        mean_wait = self.lease_wait_total / self.lease_count if self.lease_count > 0 else 0
+        return dict(leases=self.lease_count, mean_wait=mean_wait, max_wait=self.lease_wait_max,
+                    recycled=self.recycled, browsers=self.created)
+
+    def close(self):
+        browser_wrappers = []
+        while True:
+            try:
+                browser_wrapper = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if browser_wrapper is not None:
+                browser_wrappers.append(browser_wrapper)
+
+        for browser_wrapper in browser_wrappers:
+            browser_wrapper.browser.quit()
+        with self.lock:
+            self.created -= len(browser_wrappers)
@@ -0,0 +1,177 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from scrape.management.util.http_transport import HttpTransport
+
+# Any of these in a page means the site wants a captcha solved, which only the browser can do
+CAPTCHA_MARKERS = ('g-recaptcha', 'www.google.com/recaptcha', 'captcha-form', 'www.google.com/sorry')
+
+# Responses that mean we are being throttled or blocked rather than that the page is missing
+BLOCKED_STATUSES = (403, 429, 503)
+
+
+class CaptchaDetectedException(Exception):
+    def __init__(self, url):
+        super(CaptchaDetectedException, self).__init__('Captcha detected at {}'.format(url))
+
+
+def has_captcha(html):
+    return any(marker in html for marker in CAPTCHA_MARKERS)
+
+
+class HostPoliteness:
+    """
+    At most `max_concurrent` requests to the same host at any time, and at least `delay` seconds between the
+    starts of two consecutive requests to it
+    """
+    def __init__(self, max_concurrent, delay):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.lock = asyncio.Lock()
+        self.delay = delay
+        self.next_start = 0
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        async with self.lock:
+            wait = self.next_start - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.next_start = time.monotonic() + self.delay
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+
+
+class Fetcher:
+    """
+    Fetches pages over plain HTTP, many at a time, and only falls back to the (slow) browser for the pages that
+    come back with a captcha. Any other failure (e.g. a 404) is raised.
+
+    The requests are scheduled by one event loop, running in its own thread for the life of the Fetcher, so the
+    limits hold across all the calls to fetch() and fetch_many(), including calls made from several threads at once.
+    """
+    def __init__(self, browser_wrapper, concurrency=8, per_host=4, host_delay=0.25, transport=None,
+                 browser_attempts=3):
+        """
+        :param browser_wrapper: a BrowserWrapper or BrowserPool, used for the pages that can't be fetched without a
+                                browser
+        :param concurrency: maximum number of requests in flight
+        :param per_host: maximum number of requests in flight to the same host
+        :param host_delay: minimum number of seconds between starting two requests to the same host
+        :param transport: the HttpTransport to make the requests with, which also takes care of the retries.
+                          None to make one with a connection pool big enough for `concurrency`
+        :param browser_attempts: number of times the browser tries a page, reloading in between, before giving up
+        """
+        self.browser_wrapper = browser_wrapper
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.browser_attempts = browser_attempts
+        if transport is None:
+            transport = HttpTransport(pool_size=concurrency)
+        self.transport = transport
+
+        # Only ever updated on the loop's thread, so no lock is needed
+        self.http_count = 0
+        self.browser_count = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self._run_loop, daemon=True)
+        self.loop_thread.start()
+        # Made by the first fetch, so that concurrency and the number of browsers can still be changed until then
+        self.executor = None
+        self.semaphore = None
+        self.browser_semaphore = None
+        self.hosts = {}
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def _start(self):
+        # Runs on the loop's thread, as the semaphores must be made on the loop that uses them
+        # A BrowserPool has `size` browsers, a BrowserWrapper only one
+        browser_count = getattr(self.browser_wrapper, 'size', 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency + browser_count)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.browser_semaphore = asyncio.Semaphore(browser_count)
+
+    def _get(self, url, cached):
+        response = self.transport.get(url, cached=cached)
+        if response.status_code in BLOCKED_STATUSES:
+            raise CaptchaDetectedException(url)
+        response.raise_for_status()
+        # nzdl.org doesn't always declare its encoding, and the pages are utf-8
+        response.encoding = 'utf-8'
+        html = response.text
+        if has_captcha(html):
+            raise CaptchaDetectedException(url)
+        return html
+
+    def _browser_get(self, url):
+        for attempt in range(self.browser_attempts):
+            if attempt > 0:
+                self.browser_wrapper.reload()
+            try:
+                return self.browser_wrapper.make_query_retrial_if_fail(url)
+            except Exception as e:
+                error = e
+        raise IOError('The browser failed to fetch {} {} times'.format(url, self.browser_attempts)) from error
+
+    async def _fetch(self, url, cached):
+        host = urlparse(url).netloc
+        politeness = self.hosts.get(host, None)
+        if politeness is None:
+            politeness = HostPoliteness(self.per_host, self.host_delay)
+            self.hosts[host] = politeness
+
+        # Only a captcha goes to the browser. Anything else is raised: the transport has already retried the
+        # connection errors and 5xx, and the browser would get the same 404
+        try:
+            async with self.semaphore, politeness:
+                html = await self.loop.run_in_executor(self.executor, self._get, url, cached.get(url, None))
+            self.http_count += 1
+            return html
+        except CaptchaDetectedException:
+            pass
+
+        # No more pages at a time than there are browsers
+        async with self.browser_semaphore:
+            html = await self.loop.run_in_executor(self.executor, self._browser_get, url)
+        self.browser_count += 1
+        return html
+
+    async def _fetch_all(self, urls, cached, return_exceptions):
+        if self.executor is None:
+            self._start()
+        return await asyncio.gather(*[self._fetch(url, cached) for url in urls], return_exceptions=return_exceptions)
+
+    def fetch_many(self, urls, cached=None, return_exceptions=False):
+        """
+        Fetch all the given pages concurrently
+        :param urls: list of urls
+        :param cached: dict of url -> HTML we already have. These pages are only downloaded again if they changed
+        :param return_exceptions: True to return the exception of a page that can't be fetched in place of its HTML,
+                                  instead of raising the first one
+        :return: list of the pages' HTML, in the same order as urls
+        """
+        if len(urls) == 0:
+            return []
+        return self._run(self._fetch_all(urls, cached or {}, return_exceptions))
+
+    def fetch(self, url, cached=None):
+        return self.fetch_many([url], None if cached is None else {url: cached})[0]
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.transport.close()
@@ -0,0 +1,121 @@
+import os
+import pickle
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) ' \
+             'Chrome/90.0.4430.212 Safari/537.36'
+
+# Server-side hiccups worth trying again. 403/429/503 are left alone: they mean we are being blocked, and hammering
+# the server again won't help - the caller hands those pages to the browser instead
+RETRY_STATUSES = (500, 502, 504)
+
+
+class HttpTransport:
+    """
+    One requests.Session shared by everything that talks plain HTTP, so connections are kept alive and reused
+    instead of opened for every request. On top of the session:
+      - at most `pool_size` open connections per host,
+      - gzip/deflate compressed responses,
+      - retries with exponential backoff on connection errors and 5xx statuses,
+      - conditional requests: the ETag / Last-Modified of every page fetched is remembered, and when the caller
+        already has the page, the server is asked only whether it changed (304 Not Modified has no body).
+
+    The session is thread safe enough for GETs from a thread pool, which is how the Fetcher uses it.
+    """
+    def __init__(self, pool_size=10, retries=3, backoff=0.5, timeout=60, validators_file=None):
+        """
+        :param pool_size: number of connections kept open to each host. Should be at least the number of threads
+                          making requests at the same time, otherwise connections are thrown away and reopened
+        :param retries: number of retries after the first attempt
+        :param backoff: the n-th retry waits backoff * 2^(n-1) seconds
+        :param timeout: seconds before a request is abandoned
+        :param validators_file: where to keep the ETags/Last-Modifieds between runs. None to keep them in memory only
+        """
+        self.timeout = timeout
+        self.validators_file = validators_file
+        self.validators = {}
+        self.lock = threading.Lock()
+        self.not_modified_count = 0
+
+        if validators_file is not None and os.path.isfile(validators_file):
+            with open(validators_file, 'rb') as f:
+                self.validators = pickle.load(f)
+
+        self.retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                           raise_on_status=False)
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.set_pool_size(pool_size)
+
+    def set_pool_size(self, pool_size):
+        """
+        Replace the connection pools with ones of the given size. Connections already open are dropped
+        """
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=self.retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, cached=None, **kwargs):
+        """
+        GET the url, asking the server only whether the page changed if we already have it
+        :param url: the url
+        :param cached: the body we already have for this url, or None
+        :return: the response. If the page hasn't changed, its status is 304 and its text is `cached`
+        """
+        headers = kwargs.pop('headers', {})
+        if cached is not None:
+            etag, last_modified = self.validators.get(url, (None, None))
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+
+        response = self.session.get(url, headers=headers, timeout=kwargs.pop('timeout', self.timeout), **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            with self.lock:
+                self.not_modified_count += 1
+            response.encoding = 'utf-8'
+            response._content = cached.encode('utf-8')
+        elif response.status_code == 200:
+            etag = response.headers.get('ETag', None)
+            last_modified = response.headers.get('Last-Modified', None)
+            if etag is not None or last_modified is not None:
+                with self.lock:
+                    self.validators[url] = (etag, last_modified)
+        return response
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, timeout=kwargs.pop('timeout', self.timeout), **kwargs)
+
+    def save(self):
+        if self.validators_file is None:
+            return
+        with self.lock:
+            with open(self.validators_file, 'wb') as f:
+                pickle.dump(self.validators, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def close(self):
+        self.save()
+        self.session.close()
+
+
+_shared_transport = None
+_shared_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    :return: the process-wide transport, for code that only needs to make the odd request (e.g. CaptchaSolver)
+    """
+    global _shared_transport
+    with _shared_lock:
+        if _shared_transport is None:
+            _shared_transport = HttpTransport()
+        return _shared_transport
@@ -0,0 +1,100 @@
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+SITE = 'http://www.nzdl.org'
+
+
+def only_classes(*class_names):
+    """
+    :return: a SoupStrainer that keeps the elements having any of the given classes, and everything inside them.
+             (SoupStrainer(class_=[...]) would miss the elements that have other classes too)
+    """
+    pattern = r'(?:^|\s)(?:{})(?:\s|$)'.format('|'.join(re.escape(name) for name in class_names))
+    return SoupStrainer(attrs={'class': re.compile(pattern)})
+
+
+# What each kind of page on nzdl.org is read for. Everything else in the page is skipped by the parser, so
+# no tree is built for it. Note that lxml, unlike html5lib, doesn't add the <tbody> missing from the tables
+YEAR_INDEX = only_classes('date_list', 'h_item')
+PUBLICATION_LIST = only_classes('date_list')
+CONTENT_PAGE = only_classes('documenttext', 'navarrowsbottom')
+PAGE_NUMBER = SoupStrainer('b')
+NEWSPAPER_LIST = only_classes('top')
+ISSUE_LIST = SoupStrainer(id='group_top')
+
+
+def parse(html, parse_only=None):
+    """
+    :param html: the page
+    :param parse_only: one of the strainers above, None to parse the whole page
+    :return: the BeautifulSoup of the page, or of the parts of it kept by the strainer
+    """
+    return BeautifulSoup(html, 'lxml', parse_only=parse_only)
+
+
+def get_year_links(soup):
+    """
+    :param soup: a page parsed with YEAR_INDEX
+    :return: the links to the pages of each year
+    """
+    return [SITE + a.get('href') for a in soup.select('.h_item a')]
+
+
+def get_publication_links(soup):
+    """
+    :param soup: a page parsed with PUBLICATION_LIST or YEAR_INDEX
+    :return: list of (link to the Māori version, full title, published date) of each publication in the list
+    """
+    publications = []
+    for row in soup.select('.date_list tr'):
+        cols = row.select('td')
+        links = cols[2].select('a')
+        if len(links) == 1:
+            maori_link = SITE + links[0].get('href')
+        else:
+            maori_link = SITE + links[1].get('href')
+        full_title = cols[3].text
+        published_date = cols[4].text
+        publications.append((maori_link, full_title, published_date))
+    return publications
+
+
+def get_next_link(soup):
+    """
+    :param soup: a content page parsed with CONTENT_PAGE
+    :return: the link to the next page of the publication, or None if it is the last one
+    """
+    next_button = soup.select('.navarrowsbottom td[align=right] a')
+    if len(next_button) == 0:
+        return None
+    return SITE + next_button[0].get('href')
+
+
+def get_page_texts(soup):
+    """
+    :param soup: a content page parsed with CONTENT_PAGE
+    :return: the text of the page, one element per paragraph
+    """
+    document_text = []
+    td = soup.select('.documenttext table td')
+
+    if len(td) == 0:
+        return document_text
+
+    td = td[0]
+
+    ps = td.select('p')
+    p_texts = []
+    for p in ps:
+        p_texts.append(p.text.strip())
+        p.decompose()
+
+    left_over_text = td.text.strip()
+    if len(left_over_text) > 0:
+        document_text.append(left_over_text)
+    for p_text in p_texts:
+        if len(p_text) > 0:
+            document_text.append(p_text)
+
+    return document_text
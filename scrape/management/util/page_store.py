@@ -0,0 +1,134 @@
+import hashlib
+import os
+import struct
+import threading
+import zipfile
+import zlib
+
+
+class PageStore:
+    """
+    All the cached pages of a scraper in two files instead of one zip per page:
+      - pages.pack: the pages, deflated and appended one after the other. Identical pages are stored once.
+      - pages.idx: one fixed size record (offset, length, sha1 of the page) per cache index, at position
+                   index * record size. An all-zero record means the page isn't stored.
+
+    The cache index is the one AutoSaveCache gives to the url, so loading a page is a dict lookup, one read in the
+    index and one in the pack.
+
+    Pages are appended to the pack before their record is written, so if the process dies in between, the page is
+    just missing and will be fetched again.
+    """
+    record = struct.Struct('<QI20s')
+
+    def __init__(self, directory, read_only=False):
+        """
+        :param directory: where the two files are
+        :param read_only: True to only read the pages, e.g. while a scraper is adding to the same store. Pages added
+                          after the store is opened are seen as missing
+        """
+        self.pack_path = os.path.join(directory, 'pages.pack')
+        self.idx_path = os.path.join(directory, 'pages.idx')
+        self.read_only = read_only
+        for path in (self.pack_path, self.idx_path):
+            if not os.path.isfile(path):
+                if read_only:
+                    raise FileNotFoundError('{} not found'.format(path))
+                open(path, 'wb').close()
+
+        mode = 'rb' if read_only else 'r+b'
+        self.pack = open(self.pack_path, mode)
+        self.idx = open(self.idx_path, mode)
+        self.lock = threading.Lock()
+
+        # sha1 -> (offset, length) of every page in the pack, to store each page only once
+        self.hashes = {}
+        pack_size = os.path.getsize(self.pack_path)
+        for offset, length, sha1 in self.record.iter_unpack(self._read_all_records()):
+            if length > 0 and offset + length <= pack_size:
+                self.hashes[sha1] = (offset, length)
+
+    def _read_all_records(self):
+        self.idx.seek(0)
+        content = self.idx.read()
+        # A record cut short by a crash is dropped
+        return content[:len(content) - len(content) % self.record.size]
+
+    def _read_record(self, index):
+        self.idx.seek(index * self.record.size)
+        data = self.idx.read(self.record.size)
+        if len(data) < self.record.size:
+            return None
+        offset, length, sha1 = self.record.unpack(data)
+        if length == 0 or self.hashes.get(sha1, None) != (offset, length):
+            return None
+        return offset, length
+
+    def has(self, index):
+        with self.lock:
+            return self._read_record(index) is not None
+
+    def get(self, index):
+        """
+        :param index: the cache index of the page
+        :return: the HTML of the page, or None if it isn't stored
+        """
+        with self.lock:
+            location = self._read_record(index)
+            if location is None:
+                return None
+            offset, length = location
+            self.pack.seek(offset)
+            return zlib.decompress(self.pack.read(length)).decode('utf-8')
+
+    def put(self, index, html):
+        content = html.encode('utf-8')
+        sha1 = hashlib.sha1(content).digest()
+        with self.lock:
+            location = self.hashes.get(sha1, None)
+            if location is None:
+                blob = zlib.compress(content)
+                self.pack.seek(0, os.SEEK_END)
+                location = (self.pack.tell(), len(blob))
+                self.pack.write(blob)
+                self.pack.flush()
+                self.hashes[sha1] = location
+
+            self.idx.seek(index * self.record.size)
+            self.idx.write(self.record.pack(location[0], location[1], sha1))
+            self.idx.flush()
+
+    def indices(self):
+        """
+        :return: the cache indices of all the stored pages
+        """
+        with self.lock:
+            records = self.record.iter_unpack(self._read_all_records())
+            return [index for index, (offset, length, sha1) in enumerate(records)
+                    if length > 0 and self.hashes.get(sha1, None) == (offset, length)]
+
+    def import_zips(self, zip_dir, indices):
+        """
+        Move the pages of the old one-zip-per-page cache into the store. The zips are left alone, delete the
+        directory once happy with the result
+        :param zip_dir: the directory of <index>.zip files
+        :param indices: the cache indices to import, normally all the values of the AutoSaveCache
+        :return: number of pages imported
+        """
+        count = 0
+        for index in sorted(indices):
+            zip_path = os.path.join(zip_dir, '{}.zip'.format(index))
+            if self.has(index) or not os.path.isfile(zip_path):
+                continue
+            with zipfile.ZipFile(zip_path, 'r') as zf:
+                self.put(index, zf.read('content.html').decode('utf-8'))
+            count += 1
+        return count
+
+    def close(self):
+        with self.lock:
+            for f in (self.pack, self.idx):
+                if not self.read_only:
+                    f.flush()
+                    os.fsync(f.fileno())
+                f.close()
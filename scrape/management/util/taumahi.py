@@ -1,3 +1,5 @@
+import hashlib
+import multiprocessing
 import os
 import re
 import sys
@@ -8,76 +10,211 @@ orokati = "hkmnprtwŋƒ"
 no_tohutō = ''.maketrans({'ā': 'a', 'ē': 'e', 'ī': 'i', 'ō': 'o', 'ū': 'u'})
 arapū = "AaĀāEeĒēIiĪīOoŌōUuŪūHhKkMmNnPpRrTtWwŊŋƑƒ-"
 
+# Patterns are compiled once here rather than once per call (or per word) in the classifier
+kimikimi_kupu = re.compile(r"(?!-)(?!{p}*--{p}*)({p}+)(?<!-)".format(p=r"[a-zāēīōū\-’']"), flags=re.IGNORECASE)
+kimikimi_orokati_rua = re.compile("[{o}][{o}]".format(o=orokati))
+pūriki_arapū = frozenset(arapū)
+
+# Word categories
+MĀORI, RANGIRUA, PĀKEHĀ = 0, 1, 2
+
+# Change this whenever the classification rules change, so that results stored with Papakupu.tapumati go stale
+putanga_taumahi = 1
+
+# Letter groups and the symbols they are encoded as, see whakatakitahi_kupu
+ripanga_whakatakitahi = (('w\'', 'ƒ'), ('w’', 'ƒ'), ('wh', 'ƒ'), ('ng', 'ŋ'),
+                         ('W\'', 'Ƒ'), ('W’', 'Ƒ'), ('Wh', 'Ƒ'), ('Ng', 'Ŋ'), ('WH', 'Ƒ'), ('NG', 'Ŋ'))
+ripanga_whakatakirua = ''.maketrans({'ŋ': 'ng', 'ƒ': 'wh', 'Ŋ': 'Ng', 'Ƒ': 'Wh'})
+
+
+def whakatakitahi_kupu(kupu, ripanga=ripanga_whakatakitahi):
+    # Replaces ng and wh, w', w’ with ŋ and ƒ respectively (or whatever letter groups the given table has).
+    # No letter group in the table can overlap another one, so replacing them one after the other
+    # gives the same result as a single left to right scan, without calling back into Python per match
+    for pūrua, tahi in ripanga:
+        if pūrua in kupu:
+            kupu = kupu.replace(pūrua, tahi)
+    return kupu
+
+
+def whakatakirua_kupu(kupu):
+    # Reverses whakatakitahi_kupu, replacing ŋ and ƒ with ng and wh
+    return kupu.translate(ripanga_whakatakirua)
+
+
+def wehewehe_kupu(kupu_tōkau):
+    # Splits the raw text into words and yields them one at a time, already encoded by whakatakitahi_kupu.
+    # Nothing the size of the text is built, so long documents are split in constant extra memory
+    for tauriterite in kimikimi_kupu.finditer(kupu_tōkau):
+        yield whakatakitahi_kupu(tauriterite.group(1))
+
+
+def tiki_kōpaki_tūtira():
+    # Returns the path of the folder holding the word list files
+    try:
+        root = __file__
+        if os.path.islink(root):
+            root = os.path.realpath(root)
+        return os.path.dirname(os.path.abspath(root)) + '/taumahi_tūtira'
+    except:
+        print("I'm sorry, but something is wrong.")
+        print("There is no __file__ variable. Please contact the author.")
+        sys.exit()
+
+
+def tātai_ōrau(tatau_maori, tatau_rangirua, tatau_pakeha):
+    # Turns the Māori, ambiguous and non-Māori word counts into the tiki_ōrau result
+    tatau_kapa = tatau_maori + tatau_pakeha
+    tatau_tapeke = tatau_kapa + tatau_rangirua
+
+    # Provided there are some words that are categorised as maori or English,
+    # It calculates how many maori words there are compared to the sum, and
+    # Returns the percentage as a string
+    orau = 0.00 if (not tatau_kapa != 0) else round((tatau_maori / tatau_kapa) * 100, 2)
+
+    return tatau_maori, tatau_rangirua, tatau_pakeha, tatau_tapeke, orau
+
+
+class Papakupu:
+    # Holds the English (stop word) and ambiguous word lists, encoded with Taumahi.hōputu, as frozensets
+    # so that looking a word up costs a single hash instead of a scan through the list.
+    def __init__(self, kupu_pākehā, kupu_rangirua):
+        self.kupu_pākehā = frozenset(kupu_pākehā)
+        self.kupu_rangirua = frozenset(kupu_rangirua)
+        self._tapumati = None
+
+    def tapumati(self):
+        # A fingerprint of the word lists (and the rules version), for telling apart results worked out with
+        # different word lists
+        if self._tapumati is None:
+            hāte = hashlib.sha1('{}\n'.format(putanga_taumahi).encode('utf-8'))
+            for kupu_tūtira in (self.kupu_pākehā, self.kupu_rangirua):
+                hāte.update('\n'.join(sorted(kupu_tūtira)).encode('utf-8'))
+                hāte.update(b'\0')
+            self._tapumati = hāte.hexdigest()
+        return self._tapumati
+
+    @classmethod
+    def pānui(cls, dirpath):
+        # Reads the file lists of English and ambiguous words from the given folder
+        with open(dirpath + "/kupu_kino_kūare_tohutō.txt", "r") as kōnae_pākehā:
+            kupu_pākehā = kōnae_pākehā.read().split()
+        with open(dirpath + "/kupu_rangirua_kūare_tohutō.txt", "r") as kōnae_rangirua:
+            kupu_rangirua = kōnae_rangirua.read().split()
+
+        kupu_pākehā = [whakatakitahi_kupu(kupu) for kupu in kupu_pākehā]
+        kupu_rangirua = [whakatakitahi_kupu(kupu) for kupu in kupu_rangirua]
+        return cls(kupu_pākehā, kupu_rangirua)
+
+
+# One Papakupu per folder, shared by every Taumahi (and therefore every importer) in the process
+papakupu_tiritahi = {}
+
+
+def tiki_papakupu(dirpath=None, whakahou=False):
+    # Set whakahou = True to read the word list files again, e.g. after they have been edited
+    if dirpath is None:
+        dirpath = tiki_kōpaki_tūtira()
+    papakupu = papakupu_tiritahi.get(dirpath, None)
+    if papakupu is None or whakahou:
+        papakupu = Papakupu.pānui(dirpath)
+        papakupu_tiritahi[dirpath] = papakupu
+    return papakupu
+
 
 class Taumahi:
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, papakupu=None, keteroki_rahi=100000):
         self.verbose = verbose
-        try:
-            root = __file__
-            if os.path.islink(root):
-                root = os.path.realpath(root)
-            dirpath = os.path.dirname(os.path.abspath(root)) + '/taumahi_tūtira'
-        except:
-            print("I'm sorry, but something is wrong.")
-            print("There is no __file__ variable. Please contact the author.")
-            sys.exit()
-
-        # Reads the file lists of English and ambiguous words into list variables
-        kōnae_pākehā = open(dirpath + "/kupu_kino_kūare_tohutō.txt", "r")
-        kōnae_rangirua = open(dirpath + "/kupu_rangirua_kūare_tohutō.txt", "r")
-        self.kupu_pākehā = kōnae_pākehā.read().split()
-        self.kupu_rangirua = kōnae_rangirua.read().split()
-        self.kupu_pākehā = self.hōputu(self.kupu_pākehā)
-        self.kupu_rangirua = self.hōputu(self.kupu_rangirua)
-
-        kōnae_pākehā.close(), kōnae_rangirua.close()
-
-    def whakatakitahi(self, tauriterite):
-        # If passed the appropriate letters, return the corresponding symbol
-        oro = tauriterite.group(0)
-        if oro == 'ng':
-            return 'ŋ'
-        elif oro == 'w\'' or oro == 'w’' or oro == 'wh':
-            return 'ƒ'
-        elif oro == 'Ng' or oro == 'NG':
-            return 'Ŋ'
-        else:
-            return 'Ƒ'
-
-    def whakatakirua(self, tauriterite):
-        # If passed the appropriate symbol, return the corresponding letters
-        oro = tauriterite.group(0)
-        if oro == 'ŋ':
-            return 'ng'
-        elif oro == 'ƒ':
-            return 'wh'
-        elif oro == 'Ŋ':
-            return 'Ng'
-        else:
-            return 'Wh'
+        self.keteroki_rahi = keteroki_rahi
+        self.keteroki_hits = 0
+        self.keteroki_misses = 0
+        if papakupu is None:
+            papakupu = tiki_papakupu()
+        self.tautuhi_papakupu(papakupu)
 
     def hōputu(self, kupu, hōputu_takitahi=True):
         # Replaces ng and wh, w', w’ with ŋ and ƒ respectively, since Māori
         # consonants are easier to deal with in unicode format
         # The Boolean variable determines whether it's encoding or decoding
         # (set False if decoding)
-        if isinstance(kupu, list):
-            if hōputu_takitahi:
-                return [re.sub(r'(w\')|(w’)|(wh)|(ng)|(W\')|(W’)|(Wh)|(Ng)|(WH)|(NG)', self.whakatakitahi, whakatomo) for
-                        whakatomo in kupu]
-            else:
-                return [re.sub(r'(ŋ)|(ƒ)|(Ŋ)|(Ƒ)', self.whakatakirua, whakatomo) for whakatomo in kupu]
-        elif isinstance(kupu, dict):
-            if hōputu_takitahi:
-                return [re.sub(r'(w\')|(w’)|(wh)|(ng)|(W\')|(W’)|(Wh)|(Ng)|(WH)|(NG)', self.whakatakitahi, whakatomo) for
-                        whakatomo in kupu.keys()]
-            else:
-                return [re.sub(r'(ŋ)|(ƒ)|(Ŋ)|(Ƒ)', self.whakatakirua, whakatomo) for whakatomo in kupu.keys()]
+        hōputu_kupu = whakatakitahi_kupu if hōputu_takitahi else whakatakirua_kupu
+        if isinstance(kupu, (list, dict)):
+            return [hōputu_kupu(whakatomo) for whakatomo in kupu]
         else:
-            if hōputu_takitahi:
-                return re.sub(r'(w\')|(w’)|(wh)|(ng)|(W\')|(W’)|(Wh)|(Ng)|(WH)|(NG)', self.whakatakitahi, kupu)
-            else:
-                return re.sub(r'(ŋ)|(ƒ)|(Ŋ)|(Ƒ)', self.whakatakirua, kupu)
+            return hōputu_kupu(kupu)
+
+    def whakarōpū(self, kupu):
+        # Returns the category (MĀORI, RANGIRUA or PĀKEHĀ) of a word already encoded by hōputu.
+        # The category only depends on the lowercased word, so it is remembered in a size-capped
+        # cache, which is emptied whenever the word lists are swapped out
+        if self.verbose:
+            return self._whakarōpū(kupu)
+
+        if self.kupu_pākehā is not self.keteroki_pākehā or self.kupu_rangirua is not self.keteroki_rangirua:
+            self.ūkui_keteroki()
+
+        kupu_iti = kupu.lower()
+        momo = self.keteroki.get(kupu_iti, None)
+        if momo is not None:
+            self.keteroki_hits += 1
+            return momo
+
+        self.keteroki_misses += 1
+        momo = self._whakarōpū(kupu)
+        if len(self.keteroki) >= self.keteroki_rahi:
+            # Evicts the oldest entry. Frequent words come back in straight away
+            del self.keteroki[next(iter(self.keteroki))]
+        self.keteroki[kupu_iti] = momo
+        return momo
+
+    def _whakarōpū(self, kupu):
+        # Goes to the ambiguous category if it's in the ambiguous list, goes to the Māori category
+        # if it doesn't have consecutive consonants, doesn't end in a consnant, doesn't have any
+        # english letters and isn't one of the provided stop words. Otherwise it is non-Māori.
+        kupu_iti = kupu.lower()
+        if kupu_iti in self.kupu_rangirua:
+            if self.verbose:
+                if self.kupu_rangirua:
+                    print('"{}" is an ambiguous word'.format(kupu))
+            return RANGIRUA
+
+        has_consecutive_consonants = kimikimi_orokati_rua.search(kupu_iti)
+        ends_in_consonant = kupu[-1].lower() in orokati
+        has_english_letter = not pūriki_arapū.issuperset(kupu_iti)
+        is_stop_word = kupu_iti in self.kupu_pākehā
+
+        if has_consecutive_consonants or ends_in_consonant or has_english_letter or is_stop_word:
+            if self.verbose:
+                if has_consecutive_consonants:
+                    print('"{}" is an English word because it has consecutive consonants'.format(kupu))
+                if ends_in_consonant:
+                    print('"{}" is an English word because it ends in a consonant'.format(kupu))
+                if has_english_letter:
+                    print('"{}" is an English word because it has an English letter'.format(kupu))
+                if is_stop_word:
+                    print('"{}" is an English word because it is a stop word'.format(kupu))
+            return PĀKEHĀ
+
+        if self.verbose:
+            print('"{}" is a Maori word'.format(kupu))
+        return MĀORI
+
+    def ūkui_keteroki(self):
+        # Empties the word category cache and remembers which word lists it is valid for
+        self.keteroki = {}
+        self.keteroki_pākehā = self.kupu_pākehā
+        self.keteroki_rangirua = self.kupu_rangirua
+
+    def tautuhi_papakupu(self, papakupu):
+        # Swaps the word lists used by this Taumahi, which also invalidates the word category cache
+        self.papakupu = papakupu
+        self.kupu_pākehā = papakupu.kupu_pākehā
+        self.kupu_rangirua = papakupu.kupu_rangirua
+        self.ūkui_keteroki()
+
+    def keteroki_info(self):
+        return dict(hits=self.keteroki_hits, misses=self.keteroki_misses, size=len(self.keteroki),
+                    maxsize=self.keteroki_rahi)
 
     def kōmiri_kupu(self, kupu_tōkau):
         # Removes words that contain any English characters from the string above,
@@ -85,90 +222,73 @@ class Taumahi:
         # Māori, ambiguous, non-Māori (Pākehā)
         # Set kūare_tohutō = True to become sensitive to the presence of macrons when making the match
 
-        # Splits the raw text along characters that a
-        kupu_hou = re.findall('(?!-)(?!{p}*--{p}*)({p}+)(?<!-)'.format(
-            p='[a-zāēīōū\-’\']'), kupu_tōkau, flags=re.IGNORECASE)
-
         if self.verbose:
-            print('Words are: {}'.format(', '.join(kupu_hou)))
+            print('Words are: {}'.format(', '.join(kimikimi_kupu.findall(kupu_tōkau))))
+            print('After replacing character groups: {}'.format(', '.join(wehewehe_kupu(kupu_tōkau))))
 
         # Setting up the dictionaries in which the words in the text will be placed
         raupapa_māori, raupapa_rangirua, raupapa_pākehā = {}, {}, {}
 
-        kupu_hou = self.hōputu(kupu_hou)
-        if self.verbose:
-            print('After replacing character groups: {}'.format(', '.join(kupu_hou)))
-
-        # Puts each word through tests to determine which word frequency dictionary
-        # it should be referred to. Goes to the ambiguous dictionary if it's in the
-        # ambiguous list, goes to the Māori dictionary if it doesn't have consecutive
-        # consonants, doesn't end in a consnant, doesn't have any english letters
-        # and isn't one of the provided stop words. Otherwise it goes to the non-Māori
-        # dictionary. If this word hasn't been added to the dictionary, it does so,
-        # and adds a count for every time the corresponding word gets passed to the
-        # dictionary.
-
-        for kupu in kupu_hou:
-            if kupu.lower() in self.kupu_rangirua:
-                if self.verbose:
-                    if self.kupu_rangirua:
-                        print('"{}" is an ambiguous word'.format(kupu))
-                kupu = self.hōputu(kupu, False)
-                if kupu not in raupapa_rangirua:
-                    raupapa_rangirua[kupu] = 0
-                raupapa_rangirua[kupu] += 1
-                continue
-            else:
-                has_consecutive_consonants = re.compile("[{o}][{o}]".format(o=orokati)).search(kupu.lower())
-                ends_in_consonant = kupu[-1].lower() in orokati
-                has_english_letter = any(pūriki not in arapū for pūriki in kupu.lower())
-                is_stop_word = kupu.lower() in self.kupu_pākehā
-
-                if has_consecutive_consonants or ends_in_consonant or has_english_letter or is_stop_word:
-                    if self.verbose:
-                        if has_consecutive_consonants:
-                            print('"{}" is an English word because it has consecutive consonants'.format(kupu))
-                        if ends_in_consonant:
-                            print('"{}" is an English word because it ends in a consonant'.format(kupu))
-                        if has_english_letter:
-                            print('"{}" is an English word because it has an English letter'.format(kupu))
-                        if is_stop_word:
-                            print('"{}" is an English word because it is a stop word'.format(kupu))
-                    kupu = self.hōputu(kupu, False)
-                    if kupu not in raupapa_pākehā:
-                        raupapa_pākehā[kupu] = 0
-                    raupapa_pākehā[kupu] += 1
-                    continue
-                else:
-                    if self.verbose:
-                        print('"{}" is a Maori word'.format(kupu))
-                    kupu = self.hōputu(kupu, False)
-                    if kupu not in raupapa_māori:
-                        raupapa_māori[kupu] = 0
-                    raupapa_māori[kupu] += 1
+        # Puts each word through the tests in whakarōpū to determine which word frequency dictionary
+        # it should be referred to. If this word hasn't been added to the dictionary, it does so,
+        # and adds a count for every time the corresponding word gets passed to the dictionary.
+        ngā_raupapa = {MĀORI: raupapa_māori, RANGIRUA: raupapa_rangirua, PĀKEHĀ: raupapa_pākehā}
+
+        # Splits the raw text along characters that aren't part of words, one word at a time
+        for kupu in wehewehe_kupu(kupu_tōkau):
+            raupapa = ngā_raupapa[self.whakarōpū(kupu)]
+            kupu = whakatakirua_kupu(kupu)
+            if kupu not in raupapa:
+                raupapa[kupu] = 0
+            raupapa[kupu] += 1
 
         return raupapa_māori, raupapa_rangirua, raupapa_pākehā
 
-    def tiki_ōrau(self, kōwae):
-        # Uses the kōmiri_kupu function from the taumahi module to estimate how
-        # Much of the text is Māori. Input is a string of text, output is a percentage string
+    def tatau(self, kupu_tōkau):
+        # Same as kōmiri_kupu, but only counts how many Māori, ambiguous and non-Māori words there are,
+        # without decoding the words again and building the word frequency dictionaries.
+        # Use kōmiri_kupu when the words themselves are needed
+        ngā_tatau = [0, 0, 0]
+        for kupu in wehewehe_kupu(kupu_tōkau):
+            ngā_tatau[self.whakarōpū(kupu)] += 1
 
-        # Gets the word frequency dictionaries for the input text
-        raupapa_maori, raupapa_rangirua, raupapa_pakeha = self.kōmiri_kupu(kōwae)
+        return ngā_tatau[MĀORI], ngā_tatau[RANGIRUA], ngā_tatau[PĀKEHĀ]
+
+    def tiki_ōrau(self, kōwae):
+        # Uses the tatau function to estimate how much of the text is Māori.
+        # Input is a string of text, output is a percentage string
 
         # Calculates how many words of the maori and English dictionary there are
-        tatau_maori = sum(raupapa_maori.values())
-        tatau_rangirua = sum(raupapa_rangirua.values())
-        tatau_pakeha = sum(raupapa_pakeha.values())
-        tatau_kapa = tatau_maori + tatau_pakeha
-        tatau_tapeke = tatau_kapa + tatau_rangirua
-
-        # Provided there are some words that are categorised as maori or English,
-        # It calculates how many maori words there are compared to the sum, and
-        # Returns the percentage as a string
-        orau = 0.00 if (not tatau_kapa != 0) else round((tatau_maori / tatau_kapa) * 100, 2)
-
-        return tatau_maori, tatau_rangirua, tatau_pakeha, tatau_tapeke, orau
+        return tātai_ōrau(*self.tatau(kōwae))
+
+    def tiki_ōrau_kōmiri(self, kōwae):
+        # Returns both the tiki_ōrau result and the kōmiri_kupu dictionaries of the text,
+        # tokenising it only once
+        ngā_raupapa = self.kōmiri_kupu(kōwae)
+        return tātai_ōrau(*(sum(raupapa.values()) for raupapa in ngā_raupapa)), ngā_raupapa
+
+    def tiki_ōrau_many(self, kōwae_tūtira, processes=None, chunksize=64):
+        # Runs tiki_ōrau over an iterable of texts and returns the list of results in the same order.
+        # The texts are handed out to a pool of worker processes in chunks of `chunksize`, `processes`
+        # defaults to the number of cores. With processes=1 everything runs in this process.
+        if processes == 1:
+            return [self.tiki_ōrau(kōwae) for kōwae in kōwae_tūtira]
+
+        with multiprocessing.Pool(processes, initializer=tīmata_kaimahi, initargs=(self.papakupu,)) as pool:
+            return list(pool.imap(tiki_ōrau_kaimahi, kōwae_tūtira, chunksize))
+
+
+# The Taumahi used by each worker process of Taumahi.tiki_ōrau_many
+taumahi_kaimahi = None
+
+
+def tīmata_kaimahi(papakupu):
+    global taumahi_kaimahi
+    taumahi_kaimahi = Taumahi(papakupu=papakupu)
+
+
+def tiki_ōrau_kaimahi(kōwae):
+    return taumahi_kaimahi.tiki_ōrau(kōwae)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import pathlib
+import re
+import sqlite3
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+dir_parts = current_dir.split(os.path.sep)
+cache_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('management')]), 'cache', 'taumahi')
+
+whitespace_re = re.compile(r'\s+')
+
+
+class KeterokiTaumahi:
+    # Wraps a Taumahi and keeps its tiki_ōrau results on disk (in SQLite), so that importing or exporting
+    # the same text again doesn't classify it again. Results are keyed by a hash of the text, with the
+    # whitespace collapsed since that never changes the words, and by the fingerprint of the word lists,
+    # so editing the word lists makes the old results stale.
+    def __init__(self, taumahi, db_file=None, commit_freq=1000):
+        if db_file is None:
+            pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            db_file = os.path.join(cache_dir, 'tiki_orau.sqlite3')
+
+        self.taumahi = taumahi
+        self.commit_freq = commit_freq
+        self.uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tiki_orau (tapumati TEXT, hash TEXT, maori INTEGER, '
+                          'rangirua INTEGER, pakeha INTEGER, tapeke INTEGER, orau REAL, PRIMARY KEY (tapumati, hash))')
+        # Results from word lists that are no longer in use will never be read again
+        self.conn.execute('DELETE FROM tiki_orau WHERE tapumati != ?', (self.tapumati(),))
+        self.conn.commit()
+
+    def tapumati(self):
+        return self.taumahi.papakupu.tapumati()
+
+    def get_hash(self, kōwae):
+        # Same key as ' '.join(kōwae.split()), without building the list of words
+        return hashlib.sha1(whitespace_re.sub(' ', kōwae).strip().encode('utf-8')).hexdigest()
+
+    def get(self, hash):
+        row = self.conn.execute('SELECT maori, rangirua, pakeha, tapeke, orau FROM tiki_orau '
+                                'WHERE tapumati = ? AND hash = ?', (self.tapumati(), hash)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tuple(row)
+
+    def put(self, hash, result):
+        self.conn.execute('INSERT OR REPLACE INTO tiki_orau VALUES (?, ?, ?, ?, ?, ?, ?)',
+                          (self.tapumati(), hash) + tuple(result))
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_freq:
+            self.save()
+
+    def tiki_ōrau(self, kōwae):
+        hash = self.get_hash(kōwae)
+        result = self.get(hash)
+        if result is None:
+            result = self.taumahi.tiki_ōrau(kōwae)
+            self.put(hash, result)
+        return result
+
+    def tiki_ōrau_many(self, kōwae_tūtira, processes=None, chunksize=64):
+        # Same as Taumahi.tiki_ōrau_many, but only the texts that aren't in the cache are sent to the pool
+        kōwae_tūtira = list(kōwae_tūtira)
+        hashes = [self.get_hash(kōwae) for kōwae in kōwae_tūtira]
+        results = [self.get(hash) for hash in hashes]
+
+        missing_inds = [i for i, result in enumerate(results) if result is None]
+        if len(missing_inds) > 0:
+            missing_results = self.taumahi.tiki_ōrau_many([kōwae_tūtira[i] for i in missing_inds], processes, chunksize)
+            for i, result in zip(missing_inds, missing_results):
+                results[i] = result
+                self.put(hashes[i], result)
+        return results
+
+    def save(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.save()
+        self.conn.close()
@@ -0,0 +1,64 @@
+import itertools
+from array import array
+
+import numpy as np
+
+from scrape.management.util.taumahi import Taumahi, kimikimi_kupu, tātai_ōrau, whakatakitahi_kupu
+
+
+class TaumahiKohinga:
+    # Scores a whole batch (kohinga) of paragraphs at once, for rescoring large parts of the corpus.
+    # Every paragraph is tokenised once, each distinct word is given an integer id and is classified
+    # only once, then the counts of every paragraph are worked out with numpy.
+    # The results are exactly what Taumahi.tiki_ōrau returns for each paragraph.
+    def __init__(self, taumahi=None, kupu_rahi=2000000):
+        if taumahi is None:
+            taumahi = Taumahi()
+        self.taumahi = taumahi
+        self.kupu_rahi = kupu_rahi
+        self.ūkui()
+
+    def ūkui(self):
+        # Forgets the vocabulary, needed whenever the word lists of the Taumahi change
+        self.kupu_id = {}
+        self.momo = array('b')
+        self.momo_pākehā = self.taumahi.kupu_pākehā
+        self.momo_rangirua = self.taumahi.kupu_rangirua
+
+    def tatau_kohinga(self, kōwae_tūtira):
+        # Returns an array of shape (number of paragraphs, 3) holding the Māori, ambiguous and
+        # non-Māori word counts of each paragraph
+        if self.taumahi.kupu_pākehā is not self.momo_pākehā or self.taumahi.kupu_rangirua is not self.momo_rangirua:
+            self.ūkui()
+        elif len(self.kupu_id) > self.kupu_rahi:
+            self.ūkui()
+
+        kupu_id = self.kupu_id
+        ngā_id = array('q')
+        ngā_roa = array('q')
+        for kōwae in kōwae_tūtira:
+            ngā_kupu = kimikimi_kupu.findall(kōwae)
+            ngā_roa.append(len(ngā_kupu))
+            ngā_id.extend(kupu_id.setdefault(kupu, len(kupu_id)) for kupu in ngā_kupu)
+
+        # Only the words that haven't been seen in a previous batch need classifying
+        for kupu in itertools.islice(kupu_id, len(self.momo), None):
+            self.momo.append(self.taumahi.whakarōpū(whakatakitahi_kupu(kupu)))
+
+        tau_kōwae = len(ngā_roa)
+        if tau_kōwae == 0:
+            return np.zeros((0, 3), dtype=np.int64)
+
+        ngā_id = np.frombuffer(ngā_id, dtype=np.int64)
+        ngā_roa = np.frombuffer(ngā_roa, dtype=np.int64)
+        momo = np.frombuffer(self.momo, dtype=np.int8).astype(np.int64)
+
+        # Each word is counted in the cell (paragraph, category) of a flattened (n, 3) table
+        kōwae_tau = np.repeat(np.arange(tau_kōwae, dtype=np.int64), ngā_roa)
+        wāhi = kōwae_tau * 3 + momo[ngā_id]
+        return np.bincount(wāhi, minlength=tau_kōwae * 3).reshape(tau_kōwae, 3)
+
+    def tiki_ōrau_kohinga(self, kōwae_tūtira):
+        # Returns the list of tiki_ōrau results of the given paragraphs, in the same order
+        ngā_tatau = self.tatau_kohinga(kōwae_tūtira)
+        return [tātai_ōrau(*tatau) for tatau in ngā_tatau.tolist()]
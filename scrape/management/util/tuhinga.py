@@ -0,0 +1,136 @@
+import re
+
+from scrape.management.util.taumahi import whakatakitahi_kupu
+
+
+def clean_whitespace(paragraph):
+    return re.sub(r'\s+', ' ', paragraph).strip()
+
+
+# w followed by any kind of quotation mark is written as wh in text for the language model
+ripanga_tohutau = tuple(('w' + tohu, 'wh') for tohu in '”“"\'`‘’´')
+
+
+def tohutau(kupu):
+    # Formats text in a way suitable for the irstlm language model
+    kupu = whakatakitahi_kupu(kupu.lower(), ripanga_tohutau)
+    kupu = re.sub(r'[—–]', '-', kupu)
+    kupu = re.sub(r'([^A-Za-zĀĒĪŌŪāēīōū\s])', r' \1 ', kupu)
+    kupu = re.sub(r'< (date|number|time) >', r'<\1>', kupu)
+    kupu = re.sub(r'-', r'@-@', kupu)
+    return "<s> " + clean_whitespace(kupu) + " </s>"
+
+
+marama = '(Hanuere|Pepuere|Maehe|Apereira|Mei|Hune|Hurae|Akuhata|Hepetema|Oketopa|Noema|Nowema|Tihema)'
+# Around a date: a punctuation mark, which is replaced along with the date, or else the start or end of a word.
+# A space is left alone, so that two dates in a row are both found
+mua = r'(?:[^\w\s]|(?<!\w))'
+muri = r'(?:[^\w\s]|(?!\w))'
+
+# The replacements made by whakarauiri, in order of precedence. The calls to these functions in tau don't need to be
+# made for the irstlm language model, however replacements make the model more effective. Hence we use a tag to
+# represent the kind of object it is replacing.
+ture_whakarauiri = [
+    # Comma separated pound values, ending with common representations for shillings and pounds
+    (r'((£?([1-9]\d{0,2}[,\/‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3}([.,]{2}\d{1,2}){1,2}))', '<number>'),
+    (r'(?i:(£?[1-9]\d{0,2}[,\/‘`´’\'\".][ ]?(\d{3}[,\/‘`´’\'\".]?[ ]?)+ ?l\.? ?( ?\d+ ?[ds]\.? ?){0,2}))', '<number>'),
+    # Non-comma separated pound values, with the same endings
+    (r'(£?([1-9]\d*([.,]{2}\d{1,2}){1,2}))', '<number>'),
+    (r'(?i:((£?[1-9]\d*( ?\d+ ?[lsd]\.? ?){1,3})))', '<number>'),
+    # Typical date format xx/xx/xx
+    (r'((\d{1,2}\/){1,2}\d{2})', '<date>'),
+    # Other common date formats that involve words - e.g. the (day) of (month), (year); or (month) (day) (year)
+    (r'(?i:(' + mua + r'(te )\d{1,2}( [,o])? ' + marama + r',? \d{4}' + muri + '))', '<date>'),
+    (r'(?i:(' + mua + r'\d{1,2}( [,o])? ' + marama + r',? \d{4}' + muri + '))', '<date>'),
+    (r'(?i:(' + marama + r',? \d{1,2},? \d{4}' + muri + '))', '<date>'),
+    (r'(?i:(' + mua + r'\d{4},? ' + marama + '))', '<date>'),
+    (r'(?i:(' + marama + r',? \d{4}' + muri + '))', '<date>'),
+    (r'(?i:(' + mua + r'(te )\d{1,2}( [,o])? ' + marama + muri + '))', '<date>'),
+    (r'(?i:(' + mua + r'\d{1,2}( [,o])? ' + marama + muri + '))', '<date>'),
+    (r'(?i:(' + marama + r',? \d{1,2}' + muri + '))', '<date>'),
+    # Comma separated pound values with no suffixes
+    (r'(£([1-9]\d{0,2}[,‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3})', '<number>'),
+    # Other comma separated values, not financial
+    (r'(([1-9]\d{0,2}[,‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3})', '<number>'),
+    # Finds times separated by punctuation (with or without a space), optionally followed by am/pm
+    (r'(?i:((\d{1,2}\. ){1,2}(\d{1,2}) ?[ap]\.?m\.?))', '<time>'),
+    (r'(?i:((\d{1,2}[,.:]){0,2}(\d{1,2}) ?[ap]\.?m\.?))', '<time>'),
+    (r'((\d{1,2}\. ?){1,2}\d{1,2})', '<time>'),
+    # Deals with any leftover slash-separated values that weren't accepted as times
+    (r'((\d{1,6}( \/ | \/|\/ |\/|\.)){1,5}\d{1,5})', '<number>'),
+    # Finds all other monetary values
+    (r'(£(\d)+)', '<number>'),
+    # Finds all other numbers
+    (r'((\d)+)', '<number>'),
+]
+
+# Every match starts with a digit, £, 'te', a month, or a punctuation mark before a date
+kimikimi_tīmata = re.compile(r'(?=[\d£]|(?i:te |' + marama[1:-1] + r')|[^\w\s](?:\d|(?i:te )))')
+# All the rules in one alternation, each in its own named group, to find in a single scan the next place where a rule
+# matches and the first rule that does. The lookahead skips all other positions before trying the rules
+kimikimi_whakarauiri = re.compile(kimikimi_tīmata.pattern + '(?:' + '|'.join(
+    '(?P<r{}>{})'.format(i, tauira) for i, (tauira, tohu) in enumerate(ture_whakarauiri)) + ')')
+ture_kimikimi = [re.compile(tauira) for tauira, tohu in ture_whakarauiri]
+tohu_whakarauiri = [' {} '.format(tohu) for tauira, tohu in ture_whakarauiri]
+
+# Characters that aren't letters, spaces or punctuation
+kimikimi_pūriki_kē = re.compile(r'[^A-Za-zĀĒĪŌŪāēīōū!"#$%&\'()*+,./:;<=>?[\\]^_`‘’{|}-£´\s]')
+
+
+def kimi_whakarauiri(kupu):
+    """
+    Finds the numbers, dates, times and money in the text, with the same precedence as applying the rules one after
+    another over the whole text: where an earlier rule would be used for some of the text that a rule matches, the
+    rule can only match the text before it
+    :param kupu: the text
+    :return: list of (start, end, index of the rule) of the matches, in order
+    """
+    mutunga_mahara = {}
+    tuatahi_mahara = {}
+
+    def tuatahi(tūnga):
+        # The first rule that matches at tūnga, the earlier ones don't match there at all
+        if tūnga not in tuatahi_mahara:
+            tauriterite = kimikimi_whakarauiri.match(kupu, tūnga)
+            tuatahi_mahara[tūnga] = int(tauriterite.lastgroup[1:]) if tauriterite is not None else len(ture_kimikimi)
+        return tuatahi_mahara[tūnga]
+
+    def mutunga(i, tūnga):
+        # Where the match of rule i at tūnga ends, or None if there is none
+        if (i, tūnga) not in mutunga_mahara:
+            tauriterite = ture_kimikimi[i].match(kupu, tūnga)
+            if tauriterite is not None:
+                for tūnga_roto in range(tūnga + 1, tauriterite.end()):
+                    if any(mutunga(j, tūnga_roto) is not None for j in range(tuatahi(tūnga_roto), i)):
+                        tauriterite = ture_kimikimi[i].match(kupu, tūnga, tūnga_roto)
+                        break
+            mutunga_mahara[(i, tūnga)] = tauriterite.end() if tauriterite is not None else None
+        return mutunga_mahara[(i, tūnga)]
+
+    ngā_wāhi = []
+    tauriterite = kimikimi_whakarauiri.search(kupu)
+    while tauriterite is not None:
+        tūnga = tauriterite.start()
+        tuatahi_mahara[tūnga] = int(tauriterite.lastgroup[1:])
+        for i in range(tuatahi(tūnga), len(ture_kimikimi)):
+            if mutunga(i, tūnga) is not None:
+                ngā_wāhi.append((tūnga, mutunga(i, tūnga), i))
+                tūnga = mutunga(i, tūnga) - 1
+                break
+        tauriterite = kimikimi_whakarauiri.search(kupu, tūnga + 1)
+    return ngā_wāhi
+
+
+def whakarauiri(kupu):
+    # Replaces numbers, dates, times and money with <number>, <date> and <time>
+    wāhanga = []
+    tīmata = 0
+    for tūnga, mutunga, i in kimi_whakarauiri(kupu):
+        wāhanga += [kupu[tīmata:tūnga], tohu_whakarauiri[i]]
+        tīmata = mutunga
+    wāhanga.append(kupu[tīmata:])
+    kupu = ''.join(wāhanga)
+    # Removes characters that aren't letters or spaces.
+    kupu = kimikimi_pūriki_kē.sub('', kupu)
+    # Clears excess spaces
+    return clean_whitespace(kupu)
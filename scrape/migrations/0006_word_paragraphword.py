@@ -0,0 +1,40 @@
+# Generated by Django 2.0.4 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import root.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scrape', '0005_auto_20220107_2223'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Word',
+            fields=[
+                ('id', models.AutoField(auto_created=True, editable=False, max_length=255, primary_key=True, serialize=False)),
+                ('text', models.CharField(db_index=True, max_length=100)),
+                ('category', models.IntegerField()),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model, root.models.AutoSetterGetterMixin),
+        ),
+        migrations.CreateModel(
+            name='ParagraphWord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, editable=False, max_length=255, primary_key=True, serialize=False)),
+                ('count', models.IntegerField()),
+                ('paragraph', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scrape.Paragraph')),
+                ('word', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scrape.Word')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model, root.models.AutoSetterGetterMixin),
+        ),
+    ]
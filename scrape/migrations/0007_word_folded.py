@@ -0,0 +1,30 @@
+# Generated by Django 2.0.4 on 2026-10-18 14:37
+
+from django.db import migrations, models
+from django_bulk_update.helper import bulk_update
+
+no_tohutō = ''.maketrans({'ā': 'a', 'ē': 'e', 'ī': 'i', 'ō': 'o', 'ū': 'u'})
+
+
+def fill_folded(apps, schema_editor):
+    Word = apps.get_model('scrape', 'Word')
+    words = list(Word.objects.only('id', 'text'))
+    for word in words:
+        word.folded = word.text.lower().translate(no_tohutō)
+    bulk_update(words, update_fields=['folded'], batch_size=10000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scrape', '0006_word_paragraphword'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='word',
+            name='folded',
+            field=models.CharField(db_index=True, default='', max_length=100),
+        ),
+        migrations.RunPython(fill_folded, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 2.0.4 on 2026-10-18 18:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicates(apps, model_name, key_fields, children=()):
+    """
+    Keep the first row of each group of rows with the same natural key, move the children of the others onto it,
+    and delete the others. The grouping is done by the database so that it agrees with the unique index about
+    which values are equal (e.g. names differing only in case, with a case-insensitive collation)
+    """
+    model = apps.get_model('scrape', model_name)
+    groups = model.objects.values(*key_fields).annotate(row_count=Count('id')).filter(row_count__gt=1)
+    for group in groups:
+        key = {field: group[field] for field in key_fields}
+        ids = sorted(model.objects.filter(**key).values_list('id', flat=True))
+        kept_id, duplicate_ids = ids[0], ids[1:]
+        for child_name, fk in children:
+            child = apps.get_model('scrape', child_name)
+            child.objects.filter(**{fk + '_id__in': duplicate_ids}).update(**{fk + '_id': kept_id})
+        model.objects.filter(id__in=duplicate_ids).delete()
+
+
+def compare_word_texts_exactly(apps, schema_editor):
+    """
+    Words are told apart by their exact text (māori and maori are two words), but MySQL's default collations
+    compare strings regardless of case and accents, so a unique index on the text would reject one of them.
+    The column is given the binary collation of its character set before the duplicates are looked for
+    """
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT CHARACTER_SET_NAME FROM information_schema.COLUMNS "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'scrape_word' AND COLUMN_NAME = 'text'")
+        charset = cursor.fetchone()[0]
+    schema_editor.execute('ALTER TABLE scrape_word MODIFY text VARCHAR(100) CHARACTER SET {0} COLLATE {0}_bin '
+                          'NOT NULL'.format(charset))
+
+
+def remove_duplicates(apps, schema_editor):
+    # From the top down, as merging two publications can make two of their articles duplicates, and so on
+    merge_duplicates(apps, 'Newspaper', ['name'], [('Publication', 'newspaper')])
+    merge_duplicates(apps, 'Publication', ['newspaper', 'published_date'], [('Article', 'publication')])
+    merge_duplicates(apps, 'Article', ['publication', 'index'], [('Paragraph', 'article')])
+    # A duplicate paragraph has the same word counts as the one kept, they go with it
+    merge_duplicates(apps, 'Paragraph', ['article', 'index'])
+    # Words written twice by two processes at once. Their paragraphs then have the same count under both, which
+    # makes duplicate paragraph words, so this goes first
+    merge_duplicates(apps, 'Word', ['text'], [('ParagraphWord', 'word')])
+    merge_duplicates(apps, 'ParagraphWord', ['paragraph', 'word'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scrape', '0007_word_folded'),
+    ]
+
+    operations = [
+        migrations.RunPython(compare_word_texts_exactly, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='newspaper',
+            name='name',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='word',
+            name='text',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='publication',
+            unique_together={('newspaper', 'published_date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='article',
+            unique_together={('publication', 'index')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='paragraph',
+            unique_together={('article', 'index')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='paragraphword',
+            unique_together={('paragraph', 'word')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.4 on 2026-10-18 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scrape', '0008_natural_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paragraph',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True),
+        ),
+    ]
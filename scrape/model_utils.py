@@ -1,4 +1,7 @@
-from django.db import models
+import sys
+from collections import OrderedDict
+
+from django.db import connection, models
 
 from root.exceptions import CustomAssertionError
 
@@ -27,3 +30,110 @@ def get_or_error(obj, key, errmsg=None):
                 errmsg = '{} doesn\'t exist'.format(key)
         raise CustomAssertionError(errmsg)
     return value
+
+
+def bulk_upsert(model, objs, unique_fields, update_fields=(), batch_size=1000):
+    """
+    Insert the objects, and where a row with the same unique key already exists, update it instead (or leave it
+    alone if update_fields is empty). Unlike bulk_create this never fails on a duplicate, so it can be run again
+    on the same data, or from several processes at once.
+
+    There must be a unique constraint on exactly `unique_fields`. Like bulk_create on MySQL, the ids of the objects
+    aren't set, use get_ids to read them back.
+
+    :param model: the model class
+    :param objs: unsaved instances of the model
+    :param unique_fields: attnames of the fields of the unique constraint, e.g. ('publication_id', 'index')
+    :param update_fields: attnames of the fields to overwrite when the row exists
+    :param batch_size: number of rows per INSERT
+    """
+    if len(objs) == 0:
+        return
+
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    if len(update_fields) > 0:
+        # Like save(), an update also refreshes the auto_now timestamps
+        update_fields = list(update_fields) + [f.attname for f in fields
+                                               if getattr(f, 'auto_now', False) and f.attname not in update_fields]
+    columns = ', '.join(qn(f.column) for f in fields)
+    columns_by_attname = {f.attname: f.column for f in fields}
+
+    if connection.vendor == 'mysql':
+        if len(update_fields) == 0:
+            # Assigning a column to itself is MySQL's way of doing nothing
+            update_fields = unique_fields[:1]
+        updates = ', '.join('{0} = VALUES({0})'.format(qn(columns_by_attname[f])) for f in update_fields)
+        on_conflict = 'ON DUPLICATE KEY UPDATE {}'.format(updates)
+    else:
+        # PostgreSQL and SQLite
+        conflict_columns = ', '.join(qn(columns_by_attname[f]) for f in unique_fields)
+        if len(update_fields) == 0:
+            on_conflict = 'ON CONFLICT ({}) DO NOTHING'.format(conflict_columns)
+        else:
+            updates = ', '.join('{0} = EXCLUDED.{0}'.format(qn(columns_by_attname[f])) for f in update_fields)
+            on_conflict = 'ON CONFLICT ({}) DO UPDATE SET {}'.format(conflict_columns, updates)
+
+    row_placeholder = '({})'.format(', '.join(['%s'] * len(fields)))
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            params = []
+            for obj in batch:
+                params += [f.get_db_prep_save(f.pre_save(obj, True), connection) for f in fields]
+            sql = 'INSERT INTO {} ({}) VALUES {} {}'.format(qn(model._meta.db_table), columns,
+                                                            ', '.join([row_placeholder] * len(batch)), on_conflict)
+            cursor.execute(sql, params)
+
+
+def get_ids(queryset, field, values, key_fields, batch_size=1000):
+    """
+    Resolve natural keys to ids, with one query per batch of `values` instead of one per key
+    :param queryset: e.g. Article.objects
+    :param field: the field `values` are for, e.g. 'publication_id'
+    :param values: the values of `field` to look up, e.g. the ids of the publications being saved
+    :param key_fields: the fields making up the natural key, e.g. ('publication_id', 'index')
+    :param batch_size: number of values per query
+    :return: dict of natural key (a tuple of the values of key_fields) -> id
+    """
+    values = list(values)
+    ids = {}
+    for start in range(0, len(values), batch_size):
+        filters = {'{}__in'.format(field): values[start:start + batch_size]}
+        for row in queryset.filter(**filters).values_list('id', *key_fields):
+            ids[row[1:]] = row[0]
+    return ids
+
+
+class IdCache:
+    """
+    Natural key -> id, for at most `max_size` keys. The least recently used keys are forgotten first, so the cache
+    takes the same memory however big the tables are. Strings in the keys are interned, the same newspaper title
+    in a thousand keys is stored once.
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.ids = OrderedDict()
+
+    @staticmethod
+    def _intern(key):
+        if isinstance(key, str):
+            return sys.intern(key)
+        if isinstance(key, tuple):
+            return tuple(sys.intern(x) if isinstance(x, str) else x for x in key)
+        return key
+
+    def get(self, key):
+        id = self.ids.get(key, None)
+        if id is not None:
+            self.ids.move_to_end(key)
+        return id
+
+    def __setitem__(self, key, id):
+        self.ids[self._intern(key)] = id
+        self.ids.move_to_end(key)
+        while len(self.ids) > self.max_size:
+            self.ids.popitem(last=False)
+
+    def __len__(self):
+        return len(self.ids)
@@ -5,7 +5,7 @@ from root.models import SimpleModel
 
 
 class Newspaper(SimpleModel):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, unique=True)
 
     def __str__(self):
         return self.name
@@ -17,6 +17,9 @@ class Publication(SimpleModel):
     volume = models.IntegerField(null=True, blank=True)
     number = models.IntegerField(null=True, blank=True)
 
+    class Meta:
+        unique_together = ('newspaper', 'published_date')
+
     def __str__(self):
         return '{}, Volumn {}, Number {}, Published {}'.format(self.newspaper.name, self.volume, self.number, self.published_date.strftime('%Y-%m-%d'))
 
@@ -27,6 +30,9 @@ class Article(SimpleModel):
     title = models.TextField()
     url = models.CharField(max_length=1024, default='')
 
+    class Meta:
+        unique_together = ('publication', 'index')
+
 
 class Paragraph(SimpleModel):
     article = models.ForeignKey(Article, on_delete=models.CASCADE)
@@ -38,3 +44,34 @@ class Paragraph(SimpleModel):
     ambiguous_word_count = models.IntegerField(null=True, blank=True)
     other_word_count = models.IntegerField(null=True, blank=True)
     total_word_count = models.IntegerField(null=True, blank=True)
+    # When the row was last inserted or saved, so that rescore_paragraphs can re-index paragraphs edited in place.
+    # Rescoring doesn't change it, as bulk_update doesn't touch auto_now fields
+    modified = models.DateTimeField(auto_now=True, null=True, db_index=True)
+
+    class Meta:
+        unique_together = ('article', 'index')
+
+
+class Word(SimpleModel):
+    """
+    A distinct word (lowercased) found in the paragraphs, with its Taumahi category
+    (MĀORI, RANGIRUA or PĀKEHĀ) at the time it was first seen
+    """
+    # Compared exactly (binary collation on MySQL), so that e.g. māori and maori are two words
+    text = models.CharField(max_length=100, unique=True)
+    # The text without macrons, which is what word searches look up
+    folded = models.CharField(max_length=100, db_index=True, default='')
+    category = models.IntegerField()
+
+
+class ParagraphWord(SimpleModel):
+    """
+    How many times a word occurs in a paragraph, so that word frequencies can be aggregated per newspaper or year
+    without tokenising the content again
+    """
+    paragraph = models.ForeignKey(Paragraph, on_delete=models.CASCADE)
+    word = models.ForeignKey(Word, on_delete=models.CASCADE)
+    count = models.IntegerField()
+
+    class Meta:
+        unique_together = ('paragraph', 'word')
@@ -0,0 +1,60 @@
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from root.exceptions import CustomAssertionError
+from scrape.management.util.taumahi import kimikimi_kupu
+from scrape.models import ParagraphWord, Word
+from scrape.word_stats import fold_word
+
+__all__ = ['search_kupu']
+
+
+def get_paragraph_ids(words, limit=None):
+    """
+    Find the paragraphs containing all the given words, regardless of case and macrons
+    :param words: list of words
+    :param limit: maximum number of ids to return, None for all
+    :return: (sorted list of paragraph ids, total number of matching paragraphs)
+    """
+    terms = sorted(set(fold_word(word) for word in words))
+    # Several words can fold to the same term (e.g. māori and maori), each counts as that term
+    term_word_ids = {term: [] for term in terms}
+    for id, folded in Word.objects.filter(folded__in=terms).values_list('id', 'folded'):
+        # The database may match more loosely than the folding does, those words are ignored
+        if folded in term_word_ids:
+            term_word_ids[folded].append(id)
+    if any(len(ids) == 0 for ids in term_word_ids.values()):
+        return [], 0
+
+    # The intersection is done by the database: group the word counts of all the terms by paragraph and keep the
+    # paragraphs that have every term
+    term_index = Case(*[When(word_id__in=ids, then=Value(i)) for i, ids in enumerate(term_word_ids.values())],
+                      output_field=IntegerField())
+    matches = ParagraphWord.objects.filter(word_id__in=[id for ids in term_word_ids.values() for id in ids])\
+        .values('paragraph_id').annotate(term_count=Count(term_index, distinct=True))\
+        .filter(term_count=len(terms))
+
+    total = matches.count()
+    para_ids = matches.order_by('paragraph_id').values_list('paragraph_id', flat=True)
+    if limit is not None:
+        para_ids = para_ids[:limit]
+    return list(para_ids), total
+
+
+def search_kupu(request):
+    """
+    Find the paragraphs that contain all the words given in POST `kupu`, e.g. "whare karakia"
+    :param request: POST `kupu` is required, POST `limit` is the maximum number of ids to return (default 1000)
+    :return: the ids of the matching paragraphs and how many there are in total
+    """
+    words = kimikimi_kupu.findall(request.POST.get('kupu', ''))
+    if len(words) == 0:
+        raise CustomAssertionError('No word to search for')
+    try:
+        limit = int(request.POST.get('limit', 1000))
+    except ValueError:
+        limit = 0
+    if limit <= 0:
+        raise CustomAssertionError('Limit must be a positive whole number')
+
+    para_ids, total = get_paragraph_ids(words, limit)
+    return dict(origin='search_kupu', success=True, warning=None, payload=dict(ids=para_ids, total=total))
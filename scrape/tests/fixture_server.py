@@ -0,0 +1,105 @@
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+CAPTCHA_PAGE = '<html><body><form id="captcha-form"><div class="g-recaptcha" data-sitekey="fixture"></div>' \
+               '</form></body></html>'
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FixtureServer:
+    """
+    A local stand-in for nzdl.org: serves canned pages on 127.0.0.1 so that the scrapers and the Fetcher can be
+    run without touching the real site. It records how many requests it received, and the most that were in
+    flight at the same time, to check the concurrency limits. Pages are served with an ETag, and answered with
+    304 Not Modified when the client already has them.
+
+    Usage:
+        with FixtureServer({'/a': '<html>...</html>'}, delay=0.1) as server:
+            html = fetcher.fetch(server.url('/a'))
+    """
+    def __init__(self, pages=None, delay=0, captcha_paths=(), port=0):
+        """
+        :param pages: dict of path (including the query string) -> HTML
+        :param delay: seconds every response is held back, to make concurrency visible
+        :param captcha_paths: paths answered with a captcha page instead of their content
+        :param port: 0 to pick any free port
+        """
+        self.pages = dict(pages or {})
+        self.delay = delay
+        self.captcha_paths = set(captcha_paths)
+        self.request_count = 0
+        self.not_modified_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with fixture.lock:
+                    fixture.request_count += 1
+                    fixture.in_flight += 1
+                    fixture.max_in_flight = max(fixture.max_in_flight, fixture.in_flight)
+                try:
+                    if fixture.delay > 0:
+                        time.sleep(fixture.delay)
+                    if self.path in fixture.captcha_paths:
+                        self.respond(200, CAPTCHA_PAGE)
+                    elif self.path in fixture.pages:
+                        html = fixture.pages[self.path]
+                        etag = '"{}"'.format(hashlib.md5(html.encode('utf-8')).hexdigest())
+                        if self.headers.get('If-None-Match', None) == etag:
+                            with fixture.lock:
+                                fixture.not_modified_count += 1
+                            self.send_response(304)
+                            self.send_header('ETag', etag)
+                            self.end_headers()
+                        else:
+                            self.respond(200, html, etag)
+                    else:
+                        self.respond(404, '<html><body>Not found</body></html>')
+                finally:
+                    with fixture.lock:
+                        fixture.in_flight -= 1
+
+            def respond(self, status, html, etag=None):
+                body = html.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server.server_port, path)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
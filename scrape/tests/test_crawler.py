@@ -0,0 +1,88 @@
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+from django.test import SimpleTestCase
+
+from scrape.management.commands.scrape_maori_text import PublicationCrawler
+from scrape.management.util.auto_save_cache import AutoSaveCache
+from scrape.management.util.page_store import PageStore
+
+PAGE = '<html><body><div class="documenttext"><table><tr><td><p>Kei te pai</p></td></tr></table></div></body></html>'
+
+
+class WriterError(Exception):
+    pass
+
+
+class FakeFetcher:
+    """
+    Serves every url with the same one-page publication, slowly, except the urls containing 'broken'
+    """
+    def __init__(self, delay=0.01):
+        self.delay = delay
+
+    def fetch(self, url, cached=None):
+        time.sleep(self.delay)
+        if 'broken' in url:
+            raise IOError('Cannot fetch {}'.format(url))
+        return PAGE
+
+
+class PublicationCrawlerTest(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.cache = AutoSaveCache(self.cache_dir + '/cache.pkl', 10)
+        self.store = PageStore(self.cache_dir)
+        self.addCleanup(self.store.close)
+        # A small queue, so that the fetch threads are soon all waiting for the writer
+        self.crawler = PublicationCrawler(self.cache, self.store, FakeFetcher(), fetch_workers=2, parse_workers=1,
+                                          queue_size=1)
+        self.addCleanup(self.crawler.close)
+
+    def links(self, count, broken_at=None):
+        return [('http://example.org/{}{}'.format('broken' if i == broken_at else 'pub', i), 'Title', '1850')
+                for i in range(count)]
+
+    def crawl_in_thread(self, links, write):
+        """
+        Consume crawl() the way Page.query_all_publications does, in a thread so that a hang fails the test
+        :return: the exception crawl() ended with, or None
+        """
+        outcome = {}
+
+        def run():
+            try:
+                with closing(self.crawler.crawl(links)) as crawled:
+                    for publication in crawled:
+                        write(publication)
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout=30)
+        self.assertFalse(thread.is_alive(), 'crawl() did not return')
+        return outcome.get('error', None)
+
+    def test_crawls_every_publication(self):
+        written = []
+        error = self.crawl_in_thread(self.links(10), written.append)
+
+        self.assertIsNone(error)
+        self.assertEqual(sorted(link for link, _, _, _ in written), sorted(link for link, _, _ in self.links(10)))
+        self.assertTrue(all(len(para_and_links) == 1 for _, _, _, para_and_links in written))
+
+    def test_returns_when_the_writer_raises(self):
+        def write(publication):
+            raise WriterError()
+
+        error = self.crawl_in_thread(self.links(20), write)
+        self.assertIsInstance(error, WriterError)
+
+    def test_returns_when_a_publication_fails(self):
+        error = self.crawl_in_thread(self.links(20, broken_at=3), lambda publication: time.sleep(0.05))
+        self.assertIsInstance(error, IOError)
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import requests
+from django.test import SimpleTestCase
+
+from scrape.management.util.fetcher import Fetcher
+from scrape.management.util.http_transport import HttpTransport
+from scrape.tests.fixture_server import FixtureServer
+
+
+class FakeBrowser:
+    """
+    Stands in for a BrowserWrapper: answers every url with the same page and counts the calls
+    """
+    def __init__(self, broken=False):
+        """
+        :param broken: True to fail every query instead
+        """
+        self.broken = broken
+        self.urls = []
+        self.reload_count = 0
+
+    def make_query_retrial_if_fail(self, url):
+        self.urls.append(url)
+        if self.broken:
+            raise Exception('Max retrial exceeded')
+        return '<html><body>From the browser</body></html>'
+
+    def reload(self):
+        self.reload_count += 1
+
+
+def fetch_from_threads(fetcher, urls):
+    """
+    Call fetcher.fetch() for each url from its own thread, the way PublicationCrawler does
+    :return: the pages, in the same order as urls
+    """
+    pages = [None] * len(urls)
+
+    def fetch(i):
+        pages[i] = fetcher.fetch(urls[i])
+
+    threads = [threading.Thread(target=fetch, args=(i,)) for i in range(len(urls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return pages
+
+
+class FetcherTest(SimpleTestCase):
+    def setUp(self):
+        self.pages = {'/page/{}'.format(i): '<html><body>Page {}</body></html>'.format(i) for i in range(12)}
+        self.server = FixtureServer(self.pages, delay=0.1, captcha_paths=['/captcha']).start()
+        self.browser = FakeBrowser()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def make_fetcher(self, **kwargs):
+        fetcher = Fetcher(self.browser, transport=HttpTransport(pool_size=8, retries=0), **kwargs)
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def test_fetch_many_keeps_order(self):
+        fetcher = self.make_fetcher(host_delay=0)
+        paths = sorted(self.pages)
+        self.assertEqual(fetcher.fetch_many([self.server.url(path) for path in paths]),
+                         [self.pages[path] for path in paths])
+
+    def test_per_host_limit_holds_across_calls(self):
+        fetcher = self.make_fetcher(concurrency=8, per_host=2, host_delay=0)
+        pages = fetch_from_threads(fetcher, [self.server.url(path) for path in sorted(self.pages)])
+
+        self.assertEqual(pages, [self.pages[path] for path in sorted(self.pages)])
+        self.assertLessEqual(self.server.max_in_flight, 2)
+        self.assertEqual(fetcher.http_count, len(self.pages))
+
+    def test_host_delay_holds_across_calls(self):
+        fetcher = self.make_fetcher(concurrency=8, per_host=8, host_delay=0.05)
+        start = time.monotonic()
+        fetch_from_threads(fetcher, [self.server.url(path) for path in sorted(self.pages)])
+        # The last request can't start before 11 delays have passed
+        self.assertGreaterEqual(time.monotonic() - start, 11 * 0.05)
+
+    def test_limits_can_be_changed_until_the_first_fetch(self):
+        # As the commands do from their options
+        fetcher = self.make_fetcher(per_host=8, host_delay=0)
+        fetcher.concurrency = 3
+        fetch_from_threads(fetcher, [self.server.url(path) for path in sorted(self.pages)])
+        self.assertLessEqual(self.server.max_in_flight, 3)
+
+    def test_captcha_goes_to_the_browser(self):
+        fetcher = self.make_fetcher(host_delay=0)
+        html = fetcher.fetch(self.server.url('/captcha'))
+
+        self.assertIn('From the browser', html)
+        self.assertEqual(self.browser.urls, [self.server.url('/captcha')])
+        self.assertEqual((fetcher.http_count, fetcher.browser_count), (0, 1))
+
+    def test_cached_page_is_not_downloaded_again(self):
+        fetcher = self.make_fetcher(host_delay=0)
+        url = self.server.url('/page/0')
+        html = fetcher.fetch(url)
+        self.assertEqual(fetcher.fetch(url, cached=html), html)
+        self.assertEqual(self.server.not_modified_count, 1)
+        self.assertEqual(fetcher.transport.not_modified_count, 1)
+
+    def test_http_error_is_raised(self):
+        fetcher = self.make_fetcher(host_delay=0)
+        with self.assertRaises(requests.HTTPError):
+            fetcher.fetch(self.server.url('/missing'))
+        self.assertEqual(self.browser.urls, [])
+
+    def test_fetch_many_can_return_the_errors(self):
+        fetcher = self.make_fetcher(host_delay=0)
+        pages = fetcher.fetch_many([self.server.url('/page/0'), self.server.url('/missing')], return_exceptions=True)
+        self.assertEqual(pages[0], self.pages['/page/0'])
+        self.assertIsInstance(pages[1], requests.HTTPError)
+
+    def test_browser_gives_up(self):
+        self.browser = FakeBrowser(broken=True)
+        fetcher = self.make_fetcher(host_delay=0, browser_attempts=3)
+        with self.assertRaises(IOError):
+            fetcher.fetch(self.server.url('/captcha'))
+        self.assertEqual((len(self.browser.urls), self.browser.reload_count), (3, 2))
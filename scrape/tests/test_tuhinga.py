@@ -0,0 +1,117 @@
+import random
+import re
+
+from django.test import SimpleTestCase
+
+from scrape.management.util.tuhinga import clean_whitespace, kimikimi_pūriki_kē, tohu_whakarauiri, ture_kimikimi, \
+    whakarauiri
+
+marama = '(Hanuere|Pepuere|Maehe|Apereira|Mei|Hune|Hurae|Akuhata|Hepetema|Oketopa|Noema|Nowema|Tihema)'
+
+# The rules of whakarauiri as they were when each one was applied to the whole paragraph in turn. The boundary groups
+# were written in plain strings, where \b is a backspace, so that is what they are here
+ture_tawhito = [
+    (r'((£?([1-9]\d{0,2}[,\/‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3}([.,]{2}\d{1,2}){1,2}))', '<number>'),
+    (r'(?i)(£?[1-9]\d{0,2}[,\/‘`´’\'\".][ ]?(\d{3}[,\/‘`´’\'\".]?[ ]?)+ ?l\.? ?( ?\d+ ?[ds]\.? ?){0,2})', '<number>'),
+    (r'(£?([1-9]\d*([.,]{2}\d{1,2}){1,2}))', '<number>'),
+    (r'(?i)((£?[1-9]\d*( ?\d+ ?[lsd]\.? ?){1,3}))', '<number>'),
+    (r'((\d{1,2}\/){1,2}\d{2})', '<date>'),
+    (r'(?i)((\x08|\W|\s|^)(te )\d{1,2}( [,o])? ' + marama + r',? \d{4}(\x08|\W|\s|\s|$|\W))', '<date>'),
+    (r'(?i)((\x08|\W|\s|^)\d{1,2}( [,o])? ' + marama + r',? \d{4}(\x08|\W|\s|\s|$|\W))', '<date>'),
+    (r'(?i)(' + marama + r',? \d{1,2},? \d{4}(\x08|\W|\s|$))', '<date>'),
+    (r'(?i)((\x08|\W|\s|^)\d{4},? ' + marama + ')', '<date>'),
+    (r'(?i)(' + marama + r',? \d{4}(\x08|\W|\s|$))', '<date>'),
+    (r'(?i)((\x08|\W|\s|^)(te )\d{1,2}( [,o])? ' + marama + r'(\x08|\W|\s|$))', '<date>'),
+    (r'(?i)((\x08|\W|\s|^)\d{1,2}( [,o])? ' + marama + r'(\x08|\W|\s|$))', '<date>'),
+    (r'(?i)(' + marama + r',? \d{1,2}(\x08|\W|\s|$))', '<date>'),
+    (r'(£([1-9]\d{0,2}[,‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3})', '<number>'),
+    (r'(([1-9]\d{0,2}[,‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3})', '<number>'),
+    (r'(?i)((\d{1,2}\. ){1,2}(\d{1,2}) ?[ap]\.?m\.?)', '<time>'),
+    (r'(?i)((\d{1,2}[,.:]){0,2}(\d{1,2}) ?[ap]\.?m\.?)', '<time>'),
+    (r'((\d{1,2}\. ?){1,2}\d{1,2})', '<time>'),
+    (r'((\d{1,6}( \/ | \/|\/ |\/|\.)){1,5}\d{1,5})', '<number>'),
+    (r'(£(\d)+)', '<number>'),
+    (r'((\d)+)', '<number>'),
+]
+
+
+def whakarauiri_tawhito(kupu):
+    # The old whakarauiri: every copy of the text of each match is replaced, one rule after another
+    for tauira, tohu in ture_tawhito:
+        for ngā_whakataki in re.findall(tauira, kupu):
+            kupu = kupu.replace(ngā_whakataki[0].strip(), ' {} '.format(tohu))
+    return clean_whitespace(kimikimi_pūriki_kē.sub('', kupu))
+
+
+def whakarauiri_raupapa(kupu):
+    # The current rules, applied one after another, each match replaced where it is
+    for kimikimi, tohu in zip(ture_kimikimi, tohu_whakarauiri):
+        kupu = kimikimi.sub(tohu, kupu)
+    return clean_whitespace(kimikimi_pūriki_kē.sub('', kupu))
+
+
+ngā_kōwae = [
+    '12 Hepetema 21, 1874',
+    'Te 3 o Hune, 1874, i Akarana',
+    'Akarana, Hune 12, 1874.',
+    'Poneke, Mei 3, 1880. Ki te Etita.',
+    'Akuhata 4, 1869, ka tae mai te kaipuke',
+    'I tuhia i te 21 o Hepetema, 1874.',
+    'te 3 o Hurae 1868',
+    '10 Hune, 1870',
+    '1874, Hune',
+    'Tihema 25',
+    'i te 4 o Akuhata',
+    '(12 Hune 1874)',
+    'Ko te utu £1,250 10s. 6d. mo te whenua',
+    'E £3 10s. 6d. te utu mo te eka',
+    '£5 10s.',
+    '£1 1s. 1d.',
+    '£12',
+    '1,000,000 pauna',
+    'e 1,500 nga eka',
+    '1,250l. 10s.',
+    '12/3/65',
+    '21/9/74 me 22/9/74',
+    'i te 10.30 a.m. o te ata',
+    '4.30 p.m.',
+    '3 a.m.',
+    '7 o nga haora 3.15',
+    '12.30 p.m. Mane 3 Hune 1874',
+    'e 12 nga tau, 1862',
+    '5 eka me 1875',
+    '1 Hune 1874 2 Hune 1875',
+    'te 1 o Hune 1874 te 2 o Hune 1875',
+]
+
+# The outputs that differ from the old whakarauiri, as (old, new). Each is a fix:
+# - Every copy of a match's text was replaced, so '5' was also replaced inside '1875'
+# - A boundary group took the space after a date, which left none for a date right after it, and that one was then
+#   matched as a number and a shorter date
+ngā_rerekētanga = {
+    '5 eka me 1875': ('<number> eka me 187 <number>', '<number> eka me <number>'),
+    '1 Hune 1874 2 Hune 1875': ('<date> <number> <date>', '<date> <date>'),
+    'te 1 o Hune 1874 te 2 o Hune 1875': ('<date> te <date>', '<date> <date>'),
+}
+
+
+class WhakarauiriTest(SimpleTestCase):
+    def test_same_as_old(self):
+        for kōwae in ngā_kōwae:
+            with self.subTest(kōwae=kōwae):
+                tawhito, hou = ngā_rerekētanga.get(kōwae, (whakarauiri_tawhito(kōwae),) * 2)
+                self.assertEqual(whakarauiri_tawhito(kōwae), tawhito)
+                self.assertEqual(whakarauiri(kōwae), hou)
+
+    def test_precedence(self):
+        # Where the rules overlap, the one that comes first wins, wherever the matches start
+        self.assertEqual(whakarauiri('12 Hepetema 21, 1874'), '<number> <date>')
+        self.assertEqual(whakarauiri('£1,250 10s. 6d.'), '<number> , <number>')
+
+        tauira = ['1862', '12', '3', '£1,250', '£3', '10s.', '6d.', '12/3/65', '4.30', 'p.m.', 'Hune', 'Hepetema',
+                  'te', 'o', ',', '.', '1,500', '3.45', '(', ')', 'ka', '1874', '21,', '1874.', 'l.', '2/6', 'Mei']
+        rng = random.Random(0)
+        for kōwae in ngā_kōwae + [' '.join(rng.choice(tauira) for _ in range(rng.randint(1, 8)))
+                                  for _ in range(2000)]:
+            with self.subTest(kōwae=kōwae):
+                self.assertEqual(whakarauiri(kōwae), whakarauiri_raupapa(kōwae))
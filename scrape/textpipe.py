@@ -0,0 +1,120 @@
+"""
+Text normalisation shared by the scrapers and the importers.
+
+A pipeline is a list of stages, each a plain str -> str function whose regexes are compiled once at import time.
+Pipelines can be applied to a single string or to a batch of strings, and keep per-stage timing counters so that
+an ingest command can report which stage its time went on.
+"""
+import re
+import time
+
+import regex
+
+from scrape.management.util.tuhinga import clean_whitespace, tohutau, whakarauiri
+
+__all__ = ['Pipeline', 'escape_text', 'paragraph_text', 'joined_paragraphs', 'language_model_text', 'report']
+
+newlines_re = re.compile('\n+')
+spaces_re = re.compile(' +')
+dots_re = re.compile(r'\.+')
+non_latin_re = regex.compile(r'[^\p{Latin} \p{posix_punct}]')
+
+transl_table = dict([(ord(x), ord(y)) for x, y in zip(u"‘’´“”–-", u"'''\"\"--")])
+
+
+def strip(text):
+    return text.strip()
+
+
+def collapse_newlines(text):
+    return newlines_re.sub(' ', text)
+
+
+def collapse_spaces(text):
+    return spaces_re.sub(' ', text)
+
+
+def collapse_dots(text):
+    return dots_re.sub(' ', text)
+
+
+def latin_only(text):
+    # Removes everything that isn't a latin letter, a space or ASCII punctuation
+    return non_latin_re.sub('', text)
+
+
+def normalise_quotes(text):
+    return text.translate(transl_table)
+
+
+all_pipelines = []
+
+
+class Pipeline:
+    def __init__(self, name, *stages):
+        """
+        :param name: shown in the timing report
+        :param stages: functions taking and returning a string, applied in the given order
+        """
+        self.name = name
+        self.stages = stages
+        self.calls = {stage.__name__: 0 for stage in stages}
+        self.seconds = {stage.__name__: 0.0 for stage in stages}
+        all_pipelines.append(self)
+
+    def __call__(self, text):
+        for stage in self.stages:
+            start = time.perf_counter()
+            text = stage(text)
+            self.seconds[stage.__name__] += time.perf_counter() - start
+            self.calls[stage.__name__] += 1
+        return text
+
+    def apply_many(self, texts):
+        """
+        Apply the pipeline to a batch of strings, one stage at a time over the whole batch
+        :param texts: any iterable of strings
+        :return: list of the normalised strings, in the same order
+        """
+        texts = list(texts)
+        for stage in self.stages:
+            start = time.perf_counter()
+            texts = [stage(text) for text in texts]
+            self.seconds[stage.__name__] += time.perf_counter() - start
+            self.calls[stage.__name__] += len(texts)
+        return texts
+
+    def reset_timings(self):
+        for stage in self.stages:
+            self.calls[stage.__name__] = 0
+            self.seconds[stage.__name__] = 0.0
+
+    def report(self):
+        lines = []
+        total = sum(self.seconds.values())
+        for stage in self.stages:
+            name = stage.__name__
+            seconds = self.seconds[name]
+            share = 0 if total == 0 else seconds / total * 100
+            lines.append('  {:<20}{:>10} calls{:>10.3f}s{:>7.1f}%'.format(name, self.calls[name], seconds, share))
+        return '{} ({:.3f}s)\n{}'.format(self.name, total, '\n'.join(lines))
+
+
+# Text of theses and journal articles, as stored in the mongo imports
+escape_text = Pipeline('escape_text', strip, collapse_newlines, latin_only, collapse_spaces, normalise_quotes)
+
+# Text of a single HTML paragraph
+paragraph_text = Pipeline('paragraph_text', strip, collapse_newlines)
+
+# Paragraphs joined with '. ' into the text of a whole document
+joined_paragraphs = Pipeline('joined_paragraphs', collapse_dots)
+
+# Text for the irstlm language model: numbers, dates and times replaced with tags, then tokenised
+language_model_text = Pipeline('language_model_text', clean_whitespace, whakarauiri, tohutau)
+
+
+def report():
+    """
+    :return: the timing report of every pipeline that has been used so far
+    """
+    return '\n'.join(pipeline.report() for pipeline in all_pipelines if sum(pipeline.calls.values()) > 0)
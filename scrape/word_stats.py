@@ -0,0 +1,145 @@
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import ExtractYear
+
+from scrape.management.util.taumahi import no_tohutō, whakatakirua_kupu, whakatakitahi_kupu
+from scrape.model_utils import IdCache, bulk_upsert, get_ids
+from scrape.models import Word, ParagraphWord, Paragraph
+
+__all__ = ['WordCountWriter', 'fold_word', 'get_word_counts', 'get_vocabulary', 'get_word_frequency_by_year',
+           'get_total_words_by_year']
+
+
+def fold_word(kupu):
+    # Lowercased and without macrons, so that e.g. Māori, maori and MAORI are found by the same search. w' and w’
+    # are spelled wh, as Taumahi does before the words are stored
+    return whakatakirua_kupu(whakatakitahi_kupu(kupu.lower())).translate(no_tohutō)
+
+
+def get_word_counts(ngā_raupapa):
+    """
+    Merge the dictionaries returned by Taumahi.kōmiri_kupu into one keyed by lowercased word
+    :param ngā_raupapa: the Māori, ambiguous and non-Māori word count dictionaries, in that order
+    :return: dict of word -> (category, count)
+    """
+    word_counts = {}
+    for category, raupapa in enumerate(ngā_raupapa):
+        for kupu, count in raupapa.items():
+            kupu = kupu.lower()
+            if len(kupu) > Word._meta.get_field('text').max_length:
+                continue
+            _, existing = word_counts.get(kupu, (category, 0))
+            word_counts[kupu] = (category, existing + count)
+    return word_counts
+
+
+class WordCountWriter:
+    """
+    Stores the word counts of newly saved paragraphs. Only the words of the paragraphs being written are looked up,
+    with one query per batch, and the ids of the most recently used words are cached in between, so that memory
+    doesn't grow with the Word table. Keep one writer for a whole run to make the most of the cache.
+    """
+    def __init__(self, batch_size=10000, id_cache_size=200000):
+        self.batch_size = batch_size
+        self.word_ids = IdCache(id_cache_size)
+
+    def read_ids(self, texts, word_ids):
+        for (text,), id in get_ids(Word.objects, 'text', texts, ('text',), self.batch_size).items():
+            word_ids[text] = id
+            self.word_ids[text] = id
+
+    def resolve_words(self, word_categories):
+        """
+        :param word_categories: dict of word -> category of the words to resolve
+        :return: dict of word -> id, the words never seen before are inserted
+        """
+        word_ids = {text: self.word_ids.get(text) for text in word_categories}
+        unknown_texts = [text for text, id in word_ids.items() if id is None]
+        if len(unknown_texts) == 0:
+            return word_ids
+        self.read_ids(unknown_texts, word_ids)
+
+        new_words = [Word(text=text, folded=fold_word(text), category=word_categories[text])
+                     for text in unknown_texts if word_ids[text] is None]
+        if len(new_words) > 0:
+            # Another process may have inserted some of them since they were read, those are left as they are
+            bulk_upsert(Word, new_words, ['text'], batch_size=self.batch_size)
+            # The ids aren't set by the insert, so read them back
+            self.read_ids([word.text for word in new_words], word_ids)
+        return word_ids
+
+    def write(self, para_word_counts):
+        """
+        :param para_word_counts: list of (paragraph id, dict returned by get_word_counts)
+        """
+        word_categories = {}
+        for _, word_counts in para_word_counts:
+            for text, (category, _) in word_counts.items():
+                word_categories.setdefault(text, category)
+        word_ids = self.resolve_words(word_categories)
+
+        para_words = []
+        for paragraph_id, word_counts in para_word_counts:
+            for text, (_, count) in word_counts.items():
+                para_words.append(ParagraphWord(paragraph_id=paragraph_id, word_id=word_ids[text], count=count))
+        # All or nothing, so that a paragraph either has all its word counts or none. Counts already there are
+        # overwritten rather than added twice
+        with transaction.atomic():
+            bulk_upsert(ParagraphWord, para_words, ['paragraph_id', 'word_id'], ['count'], batch_size=self.batch_size)
+
+
+def filter_para_words(qs, newspaper=None, year_from=None, year_to=None, prefix='paragraph__'):
+    publication = prefix + 'article__publication__'
+    if newspaper is not None:
+        qs = qs.filter(**{publication + 'newspaper__name': newspaper})
+    if year_from is not None:
+        qs = qs.filter(**{publication + 'published_date__year__gte': year_from})
+    if year_to is not None:
+        qs = qs.filter(**{publication + 'published_date__year__lte': year_to})
+    return qs
+
+
+def get_vocabulary(newspaper=None, year_from=None, year_to=None, category=None, limit=None):
+    """
+    Most frequent words of a newspaper and/or period
+    :param newspaper: name of the newspaper, None for all
+    :param year_from: first year, inclusive
+    :param year_to: last year, inclusive
+    :param category: MĀORI, RANGIRUA or PĀKEHĀ, None for all
+    :param limit: number of words to return, None for all
+    :return: list of (word, total count), most frequent first
+    """
+    qs = filter_para_words(ParagraphWord.objects.all(), newspaper, year_from, year_to)
+    if category is not None:
+        qs = qs.filter(word__category=category)
+    qs = qs.values_list('word__text').annotate(total=Sum('count')).order_by('-total')
+    if limit is not None:
+        qs = qs[:limit]
+    return list(qs)
+
+
+def get_word_frequency_by_year(words, newspaper=None, year_from=None, year_to=None):
+    """
+    :param words: list of words, matched lowercased
+    :return: dict of word -> {year: count}
+    """
+    qs = ParagraphWord.objects.filter(word__text__in=[word.lower() for word in words])
+    qs = filter_para_words(qs, newspaper, year_from, year_to)
+    qs = qs.annotate(year=ExtractYear('paragraph__article__publication__published_date'))\
+        .values_list('word__text', 'year').annotate(total=Sum('count'))
+
+    retval = {word.lower(): {} for word in words}
+    for text, year, total in qs:
+        retval[text][year] = total
+    return retval
+
+
+def get_total_words_by_year(newspaper=None, year_from=None, year_to=None):
+    """
+    Number of words per year, to turn the counts of get_word_frequency_by_year into relative frequencies
+    :return: dict of year -> total word count
+    """
+    qs = filter_para_words(Paragraph.objects.all(), newspaper, year_from, year_to, prefix='')
+    qs = qs.annotate(year=ExtractYear('article__publication__published_date'))\
+        .values_list('year').annotate(total=Sum('total_word_count'))
+    return {year: total for year, total in qs}